@@ -0,0 +1,291 @@
+# accuracy_cost_benchmark.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import numpy as np
+import matplotlib.pyplot as plt
+import adaptive_threshold_estimation as ate
+import fixed_point_search as fps
+import generate_capture_data as gcd
+import strength_duration_curve as sdc
+
+
+def exact_thresholds(voltage_grid, capture_matrix):
+    """Exact capture threshold of every capture record
+
+    The threshold of a record is the voltage of the first grid index
+    where the capture status is 1, found for every record at once.
+
+    Args:
+        voltage_grid (list or np.array): stimulus voltages [V] shared by
+                                         every record
+        capture_matrix (np.array): 2D array of capture status values
+                                   with one row per record
+
+    Returns:
+        thresholds (np.array): threshold [V] of every record (NaN for a
+                               record that never captures)
+    """
+    capture = np.asarray(capture_matrix) == 1
+    first = np.argmax(capture, axis=1)
+    captured = capture[np.arange(len(first)), first]
+    return np.where(captured, np.asarray(voltage_grid, dtype=float)[first],
+                    np.nan)
+
+
+def synthetic_cohort(n_patients: int,
+                     durations=(0.1, 0.2, 0.3, 0.4, 0.5, 1, 1.4),
+                     seed: int = 0, min_threshold: float = 0.1,
+                     max_threshold: float = 4.99):
+    """Capture records of a synthetic cohort
+
+    Every patient has a log-normal rheobase and chronaxie (same
+    distribution as capture_management_strategies.SyntheticPatients)
+    and one deterministic capture record per pulse duration with the
+    threshold of the Lapicque curve. Patients with a threshold outside
+    [min_threshold, max_threshold] at any duration are drawn again:
+    generate_capture_records() would clamp a threshold above the grid
+    to its top voltage (4.99 V, which would then count as exact), and
+    find_capture_voltage() does not finish below 0.1 V. So the cohort is
+    the log-normal population truncated to thresholds on the grid.
+
+    Returns:
+        cohort (dict): "rheobase" and "chronaxie" of every patient,
+                "durations" (pulse durations of every patient),
+                "record_durations" (duration of every record, patient
+                by patient), "thresholds" (true threshold of every
+                record), "voltage_grid" and "capture_matrix"
+    """
+    rng = np.random.default_rng(seed)
+    durations = np.asarray(durations, dtype=float)
+    rheobase = np.empty(0)
+    chronaxie = np.empty(0)
+    while len(rheobase) < n_patients:
+        draw_rheobase = rng.lognormal(np.log(0.7), 0.3, n_patients)
+        draw_chronaxie = rng.lognormal(np.log(0.4), 0.3, n_patients)
+        thresholds = sdc.lapicque_voltage(durations[np.newaxis, :],
+                                          draw_rheobase[:, np.newaxis],
+                                          draw_chronaxie[:, np.newaxis])
+        on_grid = np.all((thresholds >= min_threshold) &
+                         (thresholds <= max_threshold), axis=1)
+        rheobase = np.concatenate([rheobase, draw_rheobase[on_grid]])
+        chronaxie = np.concatenate([chronaxie, draw_chronaxie[on_grid]])
+    rheobase = rheobase[:n_patients]
+    chronaxie = chronaxie[:n_patients]
+    thresholds = sdc.lapicque_voltage(durations[np.newaxis, :],
+                                      rheobase[:, np.newaxis],
+                                      chronaxie[:, np.newaxis])
+    voltage_grid, capture_matrix = gcd.generate_capture_records(
+        thresholds.ravel())
+    return {"rheobase": rheobase,
+            "chronaxie": chronaxie,
+            "durations": durations,
+            "record_durations": np.tile(durations, n_patients),
+            "thresholds": thresholds.ravel(),
+            "voltage_grid": voltage_grid,
+            "capture_matrix": capture_matrix}
+
+
+def reference_search(durations, voltage_grid, capture_matrix):
+    """find_capture_voltage() on every capture record
+
+    Runs on the fixed-point kernel, which is bit-exact with
+    find_capture_voltage() (same probes, energy and threshold) but
+    much faster.
+
+    Returns:
+        thresholds (np.array): threshold [V] of every record (NaN if
+                               the search failed)
+        probe_counts (np.array): number of pulses of every search
+        search_energies (np.array): energy [J] of every search
+    """
+    return fps.bulk_search(durations, voltage_grid, capture_matrix)
+
+
+def bayesian_search(tolerance: float, spread: float = 0.05,
+                    backup_voltage: float = 4.5,
+                    pacing_resistance: float = 1000):
+    """Creates a bayesian_threshold_search() strategy
+
+    Runs every record at once with batch_bayesian_threshold_search()
+    (same probes and estimates as bayesian_threshold_search()), so large
+    cohorts can be benchmarked.
+
+    Args:
+        tolerance (float): width [V] of the credible interval at which
+                           the search stops
+        spread (float): width [V] of the assumed psychometric function
+        backup_voltage (float): voltage [V] of the backup pulse
+        pacing_resistance (float): total pacing impedence [ohms]
+
+    Returns:
+        search (function): search strategy with the arguments and
+                           results of reference_search()
+    """
+    def search(durations, voltage_grid, capture_matrix):
+        results = ate.batch_bayesian_threshold_search(
+            capture_matrix, spread=spread, tolerance=tolerance,
+            backup_voltage=backup_voltage, voltage_grid=voltage_grid)
+        probe_voltages = np.nan_to_num(results["probe_voltages"])
+        n_backup = np.sum(results["capture_results"] == 0, axis=1)
+        search_energies = sdc.calculate_energy(
+            np.asarray(durations, dtype=float), 1.0, pacing_resistance) * \
+            (np.sum(probe_voltages**2, axis=1) + n_backup * backup_voltage**2)
+        return (results["capture_voltage"], results["probe_count"],
+                search_energies)
+
+    return search
+
+
+def default_search_strategies():
+    """Returns the search strategies compared by run_benchmark()"""
+    return {"find_capture_voltage": reference_search,
+            "bayesian (tolerance 0.1 V)": bayesian_search(0.1),
+            "bayesian (tolerance 0.25 V)": bayesian_search(0.25)}
+
+
+def pareto_front(costs):
+    """Finds the configurations that no other configuration beats
+
+    Args:
+        costs (np.array): 2D array with one row per configuration and
+                          one column per cost (lower is better)
+
+    Returns:
+        front (np.array): True for configurations on the Pareto
+                          frontier
+    """
+    costs = np.asarray(costs, dtype=float)
+    no_worse = np.all(costs[:, np.newaxis, :] <= costs[np.newaxis, :, :],
+                      axis=2)
+    better = np.any(costs[:, np.newaxis, :] < costs[np.newaxis, :, :],
+                    axis=2)
+    dominated = np.any(no_worse & better, axis=0)
+    return ~dominated
+
+
+def run_benchmark(cohort: dict, strategies=None, fit_models=None):
+    """Error, probe count and search energy of every configuration
+
+    A configuration is a search strategy followed by a fitting method
+    (a model of strength_duration_curve.STRENGTH_DURATION_MODELS, or
+    "bic" for the model chosen per patient by
+    select_strength_duration_model()). Errors are relative to the
+    exact thresholds of the capture records (exact_thresholds()).
+
+    Args:
+        cohort (dict): output of synthetic_cohort()
+        strategies (dict or None): search strategy name -> function
+                with the arguments and results of reference_search().
+                Defaults to default_search_strategies()
+        fit_models (list or None): fitting methods. Defaults to every
+                registered model and "bic"
+
+    Returns:
+        rows (list): one dictionary per configuration with the keys
+                "search", "fit", "threshold_error" (mean relative
+                error of the search thresholds), "failure_rate"
+                (searches without a threshold), "curve_error" (mean
+                relative error of the fitted curve at the measured
+                durations), "probes" and "search_energy" [J] (means per
+                patient), "pareto" (on the frontier of threshold error,
+                probes and search energy) and "curve_pareto" (on the
+                frontier of curve error, probes and search energy)
+    """
+    if strategies is None:
+        strategies = default_search_strategies()
+    if fit_models is None:
+        fit_models = list(sdc.STRENGTH_DURATION_MODELS) + ["bic"]
+    n_patients = len(cohort["rheobase"])
+    n_durations = len(cohort["durations"])
+    exact = exact_thresholds(cohort["voltage_grid"],
+                             cohort["capture_matrix"]).reshape(
+        n_patients, n_durations)
+    durations = np.broadcast_to(cohort["durations"], exact.shape)
+
+    rows = []
+    for name, search in strategies.items():
+        thresholds, probe_counts, search_energies = search(
+            cohort["record_durations"], cohort["voltage_grid"],
+            cohort["capture_matrix"])
+        thresholds = thresholds.reshape(exact.shape)
+        threshold_error = np.abs(thresholds - exact) / exact
+        fits = sdc.fit_strength_duration_models(durations, thresholds)
+        curves = {model: sdc.STRENGTH_DURATION_MODELS[model]["voltage"](
+            durations, fit["rheobase"][:, np.newaxis],
+            fit["chronaxie"][:, np.newaxis])
+            for model, fit in fits.items()}
+        if "bic" in fit_models:
+            best_model, _ = sdc.select_strength_duration_model(fits)
+            model_names = np.array(list(fits))
+            best_idx = np.argmax(best_model[:, np.newaxis] ==
+                                 model_names[np.newaxis, :], axis=1)
+            curves["bic"] = np.stack([curves[model] for model in fits])[
+                best_idx, np.arange(n_patients)]
+        for model in fit_models:
+            curve_error = np.abs(curves[model] - exact) / exact
+            rows.append({
+                "search": name,
+                "fit": model,
+                "threshold_error": float(np.nanmean(threshold_error)),
+                "failure_rate": float(np.mean(np.isnan(thresholds))),
+                "curve_error": float(np.nanmean(curve_error)),
+                "probes": float(probe_counts.sum() / n_patients),
+                "search_energy": float(search_energies.sum() / n_patients)})
+    for key, error in (("pareto", "threshold_error"),
+                       ("curve_pareto", "curve_error")):
+        front = pareto_front([[row[error], row["probes"],
+                               row["search_energy"]] for row in rows])
+        for row, pareto in zip(rows, front):
+            row[key] = bool(pareto)
+    return rows
+
+
+def plot_frontier(rows: list, filename=None, error: str = "threshold_error"):
+    """Plots an error against search energy (marker size = probes)
+
+    Configurations on the Pareto frontier of that error ("pareto" for
+    the threshold error, "curve_pareto" for the curve error) are
+    labelled. The figure is saved to filename, or shown if no filename
+    is given.
+
+    Args:
+        rows (list): output of run_benchmark()
+        filename (str or None): file name of the figure
+        error (str): "threshold_error" or "curve_error"
+    """
+    pareto_key = "pareto" if error == "threshold_error" else "curve_pareto"
+    fig, ax = plt.subplots()
+    for row in rows:
+        ax.scatter(row["search_energy"] * 1e6, row[error] * 100,
+                   s=4 * row["probes"],
+                   color="tab:red" if row[pareto_key] else "tab:gray",
+                   alpha=0.7)
+        if row[pareto_key]:
+            ax.annotate("{} + {}".format(row["search"], row["fit"]),
+                        (row["search_energy"] * 1e6, row[error] * 100),
+                        fontsize=7)
+    ax.set_xlabel("Search energy per patient [uJ]")
+    ax.set_ylabel("Threshold error [%]" if error == "threshold_error" else
+                  "Strength-duration curve error [%]")
+    ax.set_title("Accuracy vs. Cost (marker size = probes per patient)")
+    if filename is None:
+        plt.show()
+    else:
+        fig.savefig(filename)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    cohort = synthetic_cohort(2000)
+    rows = run_benchmark(cohort)
+    for row in sorted(rows, key=lambda row: row["curve_error"]):
+        print("{:>28} + {:<12} threshold error {:6.2%}{}, curve error \
+{:6.2%}{}, {:5.1f} probes, {:.2e} J".format(
+            row["search"], row["fit"], row["threshold_error"],
+            " (Pareto)" if row["pareto"] else "", row["curve_error"],
+            " (Pareto)" if row["curve_pareto"] else "", row["probes"],
+            row["search_energy"]))
+    plot_frontier(rows)
+    plot_frontier(rows, error="curve_error")
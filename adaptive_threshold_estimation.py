@@ -0,0 +1,385 @@
+# adaptive_threshold_estimation.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import functools
+import logging
+import numpy as np
+import generate_capture_data as gcd
+
+
+def threshold_grid():
+    """Returns the voltage grid [V] used by the generated capture data
+
+    Returns:
+        voltage_grid (np.array): voltages from 0 V to 4.99 V in 0.01 V
+                                 steps (same as generate_capture_data())
+    """
+    return np.round(np.arange(0, 5, 0.01), 2)
+
+
+def capture_likelihood(probe_voltages, threshold_voltages, spread: float,
+                       lapse_rate: float):
+    """Probability of capture for every probe voltage and threshold
+
+    The psychometric function of generate_capture_data.py is mixed
+    with a small lapse rate so that a single unexpected capture result
+    (for example a mis-detected beat) never rules out a threshold
+    completely.
+
+    Args:
+        probe_voltages (np.array): candidate stimulus voltages [V]
+        threshold_voltages (np.array): candidate capture thresholds [V]
+        spread (float): width [V] of the psychometric function
+        lapse_rate (float): probability that a capture result is wrong
+
+    Returns:
+        likelihood (np.array): array with one row per probe voltage and
+                one column per threshold containing P(capture)
+    """
+    probability = gcd.capture_probability(
+        np.asarray(probe_voltages)[:, np.newaxis],
+        np.asarray(threshold_voltages)[np.newaxis, :], spread)
+    likelihood = lapse_rate + (1 - 2 * lapse_rate) * probability
+    return likelihood
+
+
+@functools.lru_cache(maxsize=8)
+def likelihood_tables(voltage_grid: tuple, spread: float, lapse_rate: float,
+                      backup_voltage: float):
+    """Probe grid and likelihood tables of a voltage grid (cached)
+
+    The tables only depend on the grid, spread, lapse rate and backup
+    voltage, so they are built once and shared by every search. They
+    must not be modified.
+
+    Args:
+        voltage_grid (tuple): candidate thresholds and probe voltages [V]
+        spread (float): width [V] of the psychometric function
+        lapse_rate (float): probability that a capture result is wrong
+        backup_voltage (float): highest probe voltage [V]
+
+    Returns:
+        probe_idx (np.array): grid index of every probe voltage
+        likelihood (np.array): capture_likelihood() of the probe
+                               voltages (one row per probe)
+        outcome_information (np.array): sum of L*log2(L) over both
+                capture results (L = P(result)) for every probe and
+                threshold, used by batch_next_probe_indices()
+    """
+    voltage_grid = np.asarray(voltage_grid, dtype=float)
+    probe_idx = np.flatnonzero(voltage_grid <= backup_voltage)
+    likelihood = capture_likelihood(voltage_grid[probe_idx], voltage_grid,
+                                    spread, lapse_rate)
+    outcome_information = likelihood * np.log2(likelihood) + \
+        (1 - likelihood) * np.log2(1 - likelihood)
+    for table in (probe_idx, likelihood, outcome_information):
+        table.flags.writeable = False
+    return probe_idx, likelihood, outcome_information
+
+
+def entropy(probability):
+    """Shannon entropy [bits] of each row of a probability array
+
+    Args:
+        probability (np.array): probabilities along the last axis
+
+    Returns:
+        entropy (np.array or float): entropy of each distribution
+    """
+    probability = np.clip(probability, 1e-300, None)
+    return -np.sum(probability * np.log2(probability), axis=-1)
+
+
+def credible_interval(voltage_grid, posterior, confidence: float):
+    """Central credible interval of the threshold posterior
+
+    Args:
+        voltage_grid (np.array): candidate capture thresholds [V]
+        posterior (np.array): probability of each candidate threshold
+        confidence (float): probability mass inside the interval
+
+    Returns:
+        low (float): lower bound of the interval [V]
+        high (float): upper bound of the interval [V]
+    """
+    cdf = np.cumsum(posterior)
+    tail = (1 - confidence) / 2
+    low = voltage_grid[np.searchsorted(cdf, tail)]
+    high_idx = min(np.searchsorted(cdf, 1 - tail), len(voltage_grid) - 1)
+    high = voltage_grid[high_idx]
+    return float(low), float(high)
+
+
+def next_probe_voltage(probe_voltages, likelihood, posterior):
+    """Finds the probe voltage that is expected to be most informative
+
+    For every candidate probe voltage the expected entropy of the
+    threshold posterior after observing the capture result is
+    calculated. The probe with the lowest expected entropy (the most
+    expected information gain) is returned.
+
+    Args:
+        probe_voltages (np.array): candidate stimulus voltages [V]
+        likelihood (np.array): output of capture_likelihood()
+        posterior (np.array): current probability of each threshold
+
+    Returns:
+        probe_idx (int): index of the chosen probe voltage
+        probe_voltage (float): chosen probe voltage [V]
+    """
+    joint_capture = likelihood * posterior
+    joint_no_capture = (1 - likelihood) * posterior
+    p_capture = joint_capture.sum(axis=1)
+    p_no_capture = joint_no_capture.sum(axis=1)
+    expected_entropy = \
+        p_capture * entropy(joint_capture / p_capture[:, np.newaxis]) + \
+        p_no_capture * entropy(joint_no_capture /
+                               p_no_capture[:, np.newaxis])
+    probe_idx = int(np.argmin(expected_entropy))
+    return probe_idx, float(probe_voltages[probe_idx])
+
+
+def bayesian_threshold_search(capture_function, spread: float = 0.05,
+                              confidence: float = 0.95,
+                              tolerance: float = 0.1,
+                              max_probes: int = 30,
+                              lapse_rate: float = 0.01,
+                              backup_voltage: float = 4.5,
+                              voltage_grid=None, prior=None):
+    """Estimates the capture threshold with an adaptive Bayesian search
+
+    find_capture_voltage() in capture_threshold_detection.py assumes
+    that capture is deterministic. This function instead keeps a
+    probability distribution (posterior) over the possible capture
+    thresholds and updates it after every stimulus pulse. Each new
+    probe voltage is chosen to maximize the expected information gain,
+    so the threshold is found with as few pulses (and therefore as few
+    backup pulses) as possible.
+
+    Summary of how this function works:
+        - The posterior starts as the prior (uniform by default)
+        - The most informative probe voltage (at most the backup
+                voltage) is chosen
+        - A pulse is delivered with capture_function() and the
+                posterior is updated with the capture result
+        - A failed capture would be followed by a backup pulse
+        - The search stops once the central credible interval at the
+                requested confidence is narrower than the tolerance
+                (or after max_probes pulses)
+
+    Args:
+        capture_function (function): takes a stimulus voltage [V] and
+                returns the capture status (1 = capture,
+                0 = no capture). See
+                generate_capture_data.stochastic_capture_oracle()
+        spread (float): width [V] of the psychometric function that is
+                        assumed for the patient
+        confidence (float): probability that the true threshold is
+                            within the reported credible interval
+        tolerance (float): maximum width [V] of the credible interval
+        max_probes (int): maximum number of stimulus pulses
+        lapse_rate (float): probability that a capture result is wrong
+        backup_voltage (float): voltage [V] of the backup pulse. No
+                probe is delivered above it (a pulse that strong would
+                just be a backup pulse)
+        voltage_grid (np.array or None): candidate thresholds and probe
+                voltages [V]. Defaults to threshold_grid()
+        prior (np.array or None): prior probability of each candidate
+                threshold. Defaults to a uniform prior
+
+    Returns:
+        capture_voltage (float): posterior mean of the capture
+                                 threshold [V]
+        interval (tuple): (low, high) credible interval [V]
+        probe_voltages (list): stimulus voltage [V] of every pulse
+        capture_results (list): capture status of every pulse
+    """
+    if voltage_grid is None:
+        voltage_grid = threshold_grid()
+    voltage_grid = np.asarray(voltage_grid, dtype=float)
+    if prior is None:
+        posterior = np.ones(len(voltage_grid)) / len(voltage_grid)
+    else:
+        posterior = np.asarray(prior, dtype=float)
+        posterior = posterior / posterior.sum()
+    probe_idx, likelihood, _ = likelihood_tables(
+        tuple(voltage_grid.tolist()), spread, lapse_rate, backup_voltage)
+    probe_grid = voltage_grid[probe_idx]
+
+    probe_voltages = []
+    capture_results = []
+    interval = credible_interval(voltage_grid, posterior, confidence)
+    while interval[1] - interval[0] > tolerance and \
+            len(probe_voltages) < max_probes:
+        probe_idx, probe_voltage = next_probe_voltage(probe_grid,
+                                                      likelihood, posterior)
+        capture_status = capture_function(probe_voltage)
+        if capture_status == 1:
+            posterior = posterior * likelihood[probe_idx]
+        else:
+            logging.info("Failed to Capture: {} V. A backup pulse of \
+{} V was applied to the patient".format(probe_voltage, backup_voltage))
+            posterior = posterior * (1 - likelihood[probe_idx])
+        posterior = posterior / posterior.sum()
+        probe_voltages.append(probe_voltage)
+        capture_results.append(capture_status)
+        interval = credible_interval(voltage_grid, posterior, confidence)
+
+    capture_voltage = float(np.sum(voltage_grid * posterior))
+    logging.info("Bayesian capture voltage estimate: {} V ({}% credible \
+interval {} V to {} V) after {} pulses".format(
+        round(capture_voltage, 3), confidence * 100, interval[0],
+        interval[1], len(probe_voltages)))
+    return capture_voltage, interval, probe_voltages, capture_results
+
+
+def batch_next_probe_indices(likelihood, outcome_information, posterior):
+    """next_probe_voltage() for many posteriors at once
+
+    The expected entropy of the posterior p after a probe with capture
+    likelihood L is
+
+        E[H] = H(p) - p @ I + P(c) log2 P(c) + P(n) log2 P(n)
+
+    with I = L log2 L + (1-L) log2 (1-L) summed over the thresholds
+    (outcome_information), P(c) = p @ L and P(n) = 1 - P(c). H(p) is the
+    same for every probe, so the best probe of every posterior is found
+    with two matrix products.
+
+    Args:
+        likelihood (np.array): likelihood table of likelihood_tables()
+        outcome_information (np.array): table of likelihood_tables()
+        posterior (np.array): 2D array with one posterior per row
+
+    Returns:
+        probe_idx (np.array): row of the likelihood table chosen for
+                              every posterior
+    """
+    p_capture = np.clip(posterior @ likelihood.T, 1e-300, 1)
+    p_no_capture = np.clip(1 - p_capture, 1e-300, 1)
+    expected_entropy = -(posterior @ outcome_information.T) + \
+        p_capture * np.log2(p_capture) + p_no_capture * np.log2(p_no_capture)
+    return np.argmin(expected_entropy, axis=1)
+
+
+def batch_bayesian_threshold_search(capture_matrix, spread: float = 0.05,
+                                    confidence: float = 0.95,
+                                    tolerance: float = 0.1,
+                                    max_probes: int = 30,
+                                    lapse_rate: float = 0.01,
+                                    backup_voltage: float = 4.5,
+                                    voltage_grid=None,
+                                    chunk_size: int = 512):
+    """bayesian_threshold_search() on many capture records at once
+
+    Every record keeps its own posterior (one row of a 2D array), and
+    the next probe of all unfinished searches is chosen with
+    batch_next_probe_indices(), so a large cohort takes a few matrix
+    products per pulse instead of a Python loop per record. The
+    likelihood tables are built once per grid (likelihood_tables()).
+    Nothing is logged.
+
+    Args:
+        capture_matrix (np.array): 2D array of capture status values
+                with one row per record and one column per voltage of
+                voltage_grid
+        voltage_grid (np.array or None): stimulus voltages [V] of the
+                capture records. Defaults to threshold_grid()
+        chunk_size (int): records that are searched together (larger
+                chunks only add memory traffic)
+        (the other arguments are those of bayesian_threshold_search())
+
+    Returns:
+        results (dict): "capture_voltage" (posterior mean [V]), "low"
+                and "high" (credible interval [V]), "probe_count",
+                "probe_voltages" (2D array, NaN after the last pulse)
+                and "capture_results" (2D array, -1 after the last
+                pulse) of every record
+    """
+    if voltage_grid is None:
+        voltage_grid = threshold_grid()
+    voltage_grid = np.asarray(voltage_grid, dtype=float)
+    capture_matrix = np.asarray(capture_matrix)
+    if len(capture_matrix) > chunk_size:
+        chunks = [batch_bayesian_threshold_search(
+            capture_matrix[start:start + chunk_size], spread, confidence,
+            tolerance, max_probes, lapse_rate, backup_voltage, voltage_grid,
+            chunk_size)
+            for start in range(0, len(capture_matrix), chunk_size)]
+        return {key: np.concatenate([chunk[key] for chunk in chunks])
+                for key in chunks[0]}
+    probe_idx, likelihood, outcome_information = likelihood_tables(
+        tuple(voltage_grid.tolist()), spread, lapse_rate, backup_voltage)
+    n_records, n_grid = capture_matrix.shape
+    posterior = np.full((n_records, n_grid), 1 / n_grid)
+    probe_voltages = np.full((n_records, max_probes), np.nan)
+    capture_results = np.full((n_records, max_probes), -1, dtype=np.int8)
+    probe_count = np.zeros(n_records, dtype=int)
+    tail = (1 - confidence) / 2
+
+    def interval(posterior):
+        cdf = np.cumsum(posterior, axis=1)
+        low = np.sum(cdf < tail, axis=1)
+        high = np.minimum(np.sum(cdf < 1 - tail, axis=1), n_grid - 1)
+        return voltage_grid[low], voltage_grid[high]
+
+    low, high = interval(posterior)
+    active = np.flatnonzero(high - low > tolerance)
+    for step in range(max_probes):
+        if len(active) == 0:
+            break
+        choice = batch_next_probe_indices(likelihood, outcome_information,
+                                          posterior[active])
+        captured = capture_matrix[active, probe_idx[choice]] == 1
+        update = np.where(captured[:, np.newaxis], likelihood[choice],
+                          1 - likelihood[choice])
+        posterior[active] *= update
+        posterior[active] /= posterior[active].sum(axis=1)[:, np.newaxis]
+        probe_voltages[active, step] = voltage_grid[probe_idx[choice]]
+        capture_results[active, step] = captured
+        probe_count[active] += 1
+        low[active], high[active] = interval(posterior[active])
+        active = active[high[active] - low[active] > tolerance]
+
+    return {"capture_voltage": posterior @ voltage_grid,
+            "low": low,
+            "high": high,
+            "probe_count": probe_count,
+            "probe_voltages": probe_voltages,
+            "capture_results": capture_results}
+
+
+def data_capture_function(voltage_list: list, capture_list: list):
+    """Creates a capture function from imported capture data
+
+    Lets bayesian_threshold_search() run on the data files used by
+    capture_threshold_detection.py. The capture status of the data
+    point with the closest voltage is returned.
+
+    Args:
+        voltage_list (list): stimulus voltage amplitudes [V]
+        capture_list (list): capture status values coresponding to
+                             voltage_list (1 = capture, 0 = no capture)
+
+    Returns:
+        capture_function (function): function that takes a stimulus
+                voltage [V] and returns its capture status
+    """
+    def capture_function(voltage):
+        idx, _ = gcd.find_nearest(voltage_list, voltage)
+        return int(capture_list[idx])
+
+    return capture_function
+
+
+if __name__ == "__main__":
+    # Stochastic patient with a threshold of 2.2 V
+    capture_function = gcd.stochastic_capture_oracle(2.2, 0.05, seed=1)
+    capture_voltage, interval, probe_voltages, capture_results = \
+        bayesian_threshold_search(capture_function)
+    print("Capture voltage estimate: {} V".format(round(capture_voltage, 3)))
+    print("95% credible interval: {}".format(interval))
+    print("Probe voltages: {}".format(probe_voltages))
+    print("Capture results: {}".format(capture_results))
@@ -0,0 +1,608 @@
+# capture_management_strategies.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import time
+import numpy as np
+import strength_duration_curve as sdc
+
+
+# Every strategy delivers one stimulus pulse per beat to every patient.
+# The simulator asks the strategy for the pulse of each beat (pulse()),
+# checks which patients were captured and tells the strategy
+# (respond()), which answers with the backup pulse of every patient.
+# All strategy state is kept in numpy arrays with one value per patient,
+# so every beat is processed for the whole cohort at once.
+
+
+def snap_to_grid(voltage):
+    """Rounds voltages to the 0.01 V grid of the capture data (0-4.99 V)"""
+    return np.clip(np.round(voltage, 2), 0, 4.99)
+
+
+class SyntheticPatients:
+    """Shared synthetic patients for the strategy simulator
+
+    Every patient has a rheobase and chronaxie (log-normal). The
+    threshold at pulse duration t and beat b is
+
+        V_th = Vr_b * (1 + t_c / t) * exp(noise_b)
+
+    where Vr_b follows a diurnal (24 hour) variation around the
+    rheobase and noise_b is beat-to-beat threshold fluctuation. The
+    noise of every beat is generated from the seed, so every strategy
+    sees exactly the same thresholds.
+
+    Args:
+        n_patients (int): number of patients
+        seed (int): seed of the random number generator
+        beats_per_minute (float): pacing rate
+        diurnal_amplitude (float): relative amplitude of the diurnal
+                                   threshold variation
+        beat_noise (float): standard deviation of the relative
+                            beat-to-beat threshold fluctuation
+    """
+
+    chunk_beats = 1024
+
+    def __init__(self, n_patients: int, seed: int = 0,
+                 beats_per_minute: float = 60,
+                 diurnal_amplitude: float = 0.1,
+                 beat_noise: float = 0.03):
+        rng = np.random.default_rng(seed)
+        self.n_patients = n_patients
+        self.seed = seed
+        self.beats_per_minute = beats_per_minute
+        self.rheobase = rng.lognormal(np.log(0.7), 0.3, n_patients)
+        self.chronaxie = rng.lognormal(np.log(0.4), 0.3, n_patients)
+        self.phase = rng.uniform(0, 2 * np.pi, n_patients)
+        self.diurnal_amplitude = diurnal_amplitude
+        self.beat_noise = beat_noise
+        self._chunk_idx = -1
+        self._chunk = None
+
+    def beats_per_day(self):
+        return self.beats_per_minute * 60 * 24
+
+    def _noise(self, beat: int):
+        chunk_idx = beat // self.chunk_beats
+        if chunk_idx != self._chunk_idx:
+            rng = np.random.default_rng([self.seed, chunk_idx])
+            self._chunk = np.exp(self.beat_noise * rng.standard_normal(
+                (self.chunk_beats, self.n_patients)))
+            self._chunk_idx = chunk_idx
+        return self._chunk[beat % self.chunk_beats]
+
+    def rheobase_at(self, beat: int):
+        """Rheobase [V] of every patient at a beat (without beat noise)"""
+        angle = 2 * np.pi * beat / self.beats_per_day() + self.phase
+        return self.rheobase * (1 + self.diurnal_amplitude * np.sin(angle))
+
+    def threshold(self, beat: int, duration):
+        """Capture threshold [V] of every patient at a beat and duration
+
+        Args:
+            beat (int): beat number
+            duration (float or np.array): pulse duration [ms] (one value
+                                          or one value per patient)
+
+        Returns:
+            threshold (np.array): threshold voltage of every patient
+        """
+        return self.rheobase_at(beat) * (1 + self.chronaxie / duration) * \
+            self._noise(beat)
+
+
+class CaptureManagementStrategy:
+    """Interface of a capture management strategy
+
+    Subclasses keep their state in arrays with one value per patient
+    and implement:
+        reset(patients): allocates the state for a cohort
+        pulse(beat): returns the voltage [V], duration [ms] and
+                search flag (True for pulses of a threshold search) of
+                the pulse of every patient
+        respond(beat, captured): updates the state with the capture
+                result of every patient and returns the voltage [V]
+                (0 for none) and duration [ms] of the backup pulse
+    """
+
+    name = "strategy"
+
+    def reset(self, patients: SyntheticPatients):
+        raise NotImplementedError
+
+    def pulse(self, beat: int):
+        raise NotImplementedError
+
+    def respond(self, beat: int, captured):
+        raise NotImplementedError
+
+
+class StJudeAutocapture(CaptureManagementStrategy):
+    """St. Jude Autocapture
+
+    - Evoked response (capture) is verified on every beat
+    - A 4.5 V backup pulse is delivered immediately on loss of capture
+    - A threshold search starts after two consecutive backup pulses
+      (and every search_interval_hours)
+    - Search: the amplitude is decreased in 0.25 V steps from 3.0 V
+      until loss of capture, then increased in 0.125 V steps until two
+      consecutive captures
+    - Output = threshold + 0.3 V at a fixed pulse duration
+    - If the search reaches the backup voltage without two consecutive
+      captures, the output is set to the backup voltage
+    """
+
+    name = "St. Jude Autocapture"
+
+    def __init__(self, duration: float = 0.4, safety_margin: float = 0.3,
+                 backup_voltage: float = 4.5,
+                 search_interval_hours: float = 8):
+        self.duration = duration
+        self.safety_margin = safety_margin
+        self.backup_voltage = backup_voltage
+        self.search_interval_hours = search_interval_hours
+
+    def reset(self, patients):
+        n = patients.n_patients
+        self.search_interval = int(self.search_interval_hours * 60 *
+                                   patients.beats_per_minute)
+        self.output = np.full(n, self.backup_voltage)
+        self.mode = np.ones(n, dtype=np.int8)    # 0 pace, 1 down, 2 up
+        self.search_voltage = np.full(n, 3.0)
+        self.n_loss = np.zeros(n, dtype=int)
+        self.n_capture = np.zeros(n, dtype=int)
+        self.next_search = np.full(n, self.search_interval)
+
+    def pulse(self, beat):
+        start = (self.mode == 0) & (beat >= self.next_search)
+        self.mode[start] = 1
+        self.search_voltage[start] = 3.0
+        searching = self.mode != 0
+        voltage = np.where(searching, self.search_voltage, self.output)
+        return voltage, np.full(len(voltage), self.duration), searching
+
+    def respond(self, beat, captured):
+        pacing = self.mode == 0
+        down = self.mode == 1
+        up = self.mode == 2
+        loss = ~captured
+
+        self.n_loss = np.where(pacing & loss, self.n_loss + 1,
+                               np.where(pacing, 0, self.n_loss))
+        trigger = pacing & (self.n_loss >= 2)
+        self.mode[trigger] = 1
+        self.search_voltage[trigger] = 3.0
+        self.n_loss[trigger] = 0
+
+        step_down = down & captured
+        self.search_voltage[step_down] -= 0.25
+        turn_up = down & loss
+        self.mode[turn_up] = 2
+        self.n_capture[turn_up] = 0
+        self.search_voltage[turn_up] += 0.125
+        floor = step_down & (self.search_voltage < 0.125)
+        self.search_voltage[floor] = 0.125
+        self.mode[floor] = 2
+
+        self.n_capture = np.where(up & captured, self.n_capture + 1,
+                                  np.where(up, 0, self.n_capture))
+        step_up = up & loss
+        at_maximum = step_up & (self.search_voltage >= self.backup_voltage)
+        self.search_voltage[step_up] = np.minimum(
+            self.search_voltage[step_up] + 0.125, self.backup_voltage)
+        found = (up & (self.n_capture >= 2)) | at_maximum
+        self.output[found] = np.minimum(
+            self.search_voltage[found] + self.safety_margin,
+            self.backup_voltage)
+        self.mode[found] = 0
+        self.next_search[found] = beat + self.search_interval
+
+        backup = np.where(loss, self.backup_voltage, 0.0)
+        return backup, np.full(len(backup), self.duration)
+
+
+class BostonScientificAutomaticCapture(CaptureManagementStrategy):
+    """Boston Scientific Automatic Capture
+
+    - Capture is verified on every beat (ventricular evoked response)
+    - On loss of capture a backup pulse of (measured threshold + 1.5 V)
+      is delivered
+    - A threshold search starts when 2 of the last 4 beats did not
+      capture (and every search_interval_hours)
+    - Search: the amplitude is decreased in 0.1 V steps from
+      (threshold + 1.5 V) until loss of capture; the last capturing
+      amplitude is the threshold
+    - Output = threshold + 0.5 V at a fixed pulse duration (at most
+      max_voltage)
+    - If the first search pulse does not capture, no threshold was
+      measured: the threshold is set to max_voltage, so the output and
+      the backup pulses are at max_voltage
+    """
+
+    name = "Boston Scientific Automatic Capture"
+
+    def __init__(self, duration: float = 0.4, safety_margin: float = 0.5,
+                 backup_margin: float = 1.5, max_voltage: float = 5.0,
+                 search_interval_hours: float = 21):
+        self.duration = duration
+        self.safety_margin = safety_margin
+        self.backup_margin = backup_margin
+        self.max_voltage = max_voltage
+        self.search_interval_hours = search_interval_hours
+        self.popcount = np.array([bin(i).count("1") for i in range(16)])
+
+    def reset(self, patients):
+        n = patients.n_patients
+        self.search_interval = int(self.search_interval_hours * 60 *
+                                   patients.beats_per_minute)
+        self.threshold = np.full(n, 3.5 - self.backup_margin)
+        self.mode = np.ones(n, dtype=np.int8)    # 0 pace, 1 search
+        self.search_voltage = np.full(n, self.max_voltage)
+        self.last_capture = np.full(n, np.nan)
+        self.history = np.zeros(n, dtype=np.int8)
+        self.next_search = np.full(n, self.search_interval)
+
+    def _start_search(self, start):
+        self.mode[start] = 1
+        self.search_voltage[start] = np.minimum(
+            self.threshold[start] + self.backup_margin, self.max_voltage)
+        self.last_capture[start] = np.nan
+
+    def pulse(self, beat):
+        self._start_search((self.mode == 0) & (beat >= self.next_search))
+        searching = self.mode != 0
+        voltage = np.where(searching, self.search_voltage,
+                           np.minimum(self.threshold + self.safety_margin,
+                                      self.max_voltage))
+        return voltage, np.full(len(voltage), self.duration), searching
+
+    def respond(self, beat, captured):
+        pacing = self.mode == 0
+        searching = ~pacing
+        loss = ~captured
+        backup = np.where(loss, np.minimum(self.threshold + self.backup_margin,
+                                           self.max_voltage), 0.0)
+
+        self.history = np.where(pacing, ((self.history << 1) |
+                                         loss.astype(np.int8)) & 0b1111,
+                                self.history)
+        trigger = pacing & (self.popcount[self.history] >= 2)
+        self.history[trigger] = 0
+        self._start_search(trigger)
+
+        step_down = searching & captured
+        self.last_capture[step_down] = self.search_voltage[step_down]
+        self.search_voltage[step_down] -= 0.1
+        found = (searching & loss) | \
+            (step_down & (self.search_voltage < 0.1))
+        at_maximum = found & np.isnan(self.last_capture)
+        self.threshold[found] = self.last_capture[found]
+        self.threshold[at_maximum] = self.max_voltage
+        self.mode[found] = 0
+        self.next_search[found] = beat + self.search_interval
+        return backup, np.full(len(backup), self.duration)
+
+
+class MedtronicCaptureManagement(CaptureManagementStrategy):
+    """Medtronic Ventricular Capture Management (VCM)
+
+    - Intermittent: a search runs every search_interval_minutes, there
+      is no beat-to-beat capture verification between searches (loss
+      of capture between searches is a lost beat)
+    - Rheobase: at 1 ms the amplitude is decreased in 0.125 V steps
+      until loss of capture and then increased until capture
+    - Chronaxie: at twice the rheobase amplitude the pulse width is
+      decreased in 0.05 ms steps until loss of capture and then
+      increased until capture
+    - Test pulses that do not capture are followed by a backup pulse
+    - Output = 2x the threshold of the strength-duration curve at the
+      programmed pulse duration (at most the backup voltage). If the
+      rheobase search reaches the backup voltage without capture, the
+      output is set to the backup voltage
+    """
+
+    name = "Medtronic Ventricular Capture Management"
+
+    def __init__(self, duration: float = 0.4, voltage_margin: float = 2,
+                 backup_voltage: float = 4.5,
+                 search_interval_minutes: float = 15):
+        self.duration = duration
+        self.voltage_margin = voltage_margin
+        self.backup_voltage = backup_voltage
+        self.search_interval_minutes = search_interval_minutes
+
+    def reset(self, patients):
+        n = patients.n_patients
+        self.search_interval = int(self.search_interval_minutes *
+                                   patients.beats_per_minute)
+        self.output = np.full(n, self.backup_voltage)
+        # 0 pace, 1 rheobase down, 2 rheobase up, 3 chronaxie down,
+        # 4 chronaxie up
+        self.mode = np.ones(n, dtype=np.int8)
+        self.search_voltage = np.full(n, 3.0)
+        self.search_duration = np.ones(n)
+        self.rheobase = np.full(n, 3.0)
+        self.next_search = np.full(n, self.search_interval)
+
+    def pulse(self, beat):
+        start = (self.mode == 0) & (beat >= self.next_search)
+        self.mode[start] = 1
+        self.search_voltage[start] = np.minimum(self.output[start],
+                                                self.backup_voltage)
+        searching = self.mode != 0
+        chronaxie_search = self.mode >= 3
+        voltage = np.where(searching, np.where(
+            chronaxie_search, 2 * self.rheobase, self.search_voltage),
+            self.output)
+        duration = np.where(chronaxie_search, self.search_duration,
+                            np.where(searching, 1.0, self.duration))
+        return voltage, duration, searching
+
+    def respond(self, beat, captured):
+        loss = ~captured
+        mode = self.mode.copy()
+        searching = mode != 0
+        backup = np.where(searching & loss, self.backup_voltage, 0.0)
+        backup_duration = np.where(mode >= 3, self.search_duration, 1.0)
+
+        rheobase_down = (mode == 1) & captured
+        self.search_voltage[rheobase_down] -= 0.125
+        rheobase_up = ((mode == 1) | (mode == 2)) & loss
+        at_maximum = rheobase_up & \
+            (self.search_voltage >= self.backup_voltage)
+        self.mode[rheobase_up] = 2
+        self.search_voltage[rheobase_up] = np.minimum(
+            self.search_voltage[rheobase_up] + 0.125, self.backup_voltage)
+        rheobase_found = ((mode == 2) & captured) | \
+            (rheobase_down & (self.search_voltage < 0.125))
+        self.rheobase[rheobase_found] = np.maximum(
+            self.search_voltage[rheobase_found], 0.125)
+        self.mode[rheobase_found] = 3
+        self.search_duration[rheobase_found] = 1.0
+
+        chronaxie_down = (mode == 3) & captured
+        self.search_duration[chronaxie_down] -= 0.05
+        chronaxie_up = ((mode == 3) | (mode == 4)) & loss
+        self.mode[chronaxie_up] = 4
+        self.search_duration[chronaxie_up] += 0.05
+        found = ((mode == 4) & captured) | \
+            (chronaxie_down & (self.search_duration < 0.05)) | \
+            (chronaxie_up & (self.search_duration > 2))
+        chronaxie = np.clip(self.search_duration[found], 0.05, 2)
+        self.output[found] = np.minimum(
+            self.voltage_margin * self.rheobase[found] *
+            (1 + chronaxie / self.duration), self.backup_voltage)
+        self.output[at_maximum] = self.backup_voltage
+        found = found | at_maximum
+        self.mode[found] = 0
+        self.next_search[found] = beat + self.search_interval
+        return backup, backup_duration
+
+
+class ProjectEnergySavingAlgorithm(CaptureManagementStrategy):
+    """Energy saving algorithm of this project
+
+    - Intermittent like Medtronic VCM (no beat-to-beat verification
+      between searches)
+    - Search: the search of
+      capture_threshold_detection.find_capture_voltage() (start at
+      3 V, x0.75 steps, then x0.95 steps, stop after 2 misses) at every
+      duration of search_durations; every miss gets a 4.5 V backup
+    - The rheobase and chronaxie are fitted to the thresholds and the
+      output is set as in patient_strength_duration_data():
+      2x rheobase at 3x chronaxie
+    """
+
+    name = "Project Energy Saving Algorithm"
+
+    def __init__(self, search_durations=(0.2, 0.3, 0.5, 1.0, 1.5),
+                 voltage_margin: float = 2, duration_margin: float = 3,
+                 backup_voltage: float = 4.5,
+                 search_interval_minutes: float = 15,
+                 max_probes: int = 40):
+        self.search_durations = np.asarray(search_durations, dtype=float)
+        self.voltage_margin = voltage_margin
+        self.duration_margin = duration_margin
+        self.backup_voltage = backup_voltage
+        self.search_interval_minutes = search_interval_minutes
+        self.max_probes = max_probes
+
+    def reset(self, patients):
+        n = patients.n_patients
+        self.search_interval = int(self.search_interval_minutes *
+                                   patients.beats_per_minute)
+        self.output_voltage = np.full(n, self.backup_voltage)
+        self.output_duration = np.full(n, 0.5)
+        self.searching = np.ones(n, dtype=bool)
+        self.next_search = np.full(n, self.search_interval)
+        self.thresholds = np.full((n, len(self.search_durations)), np.nan)
+        self.duration_idx = np.zeros(n, dtype=int)
+        self.rheobase = np.full(n, np.nan)
+        self.chronaxie = np.full(n, np.nan)
+        self.n_searches = 0
+        self._reset_duration(np.ones(n, dtype=bool))
+
+    def _reset_duration(self, mask):
+        if not hasattr(self, "voltage"):
+            n = len(mask)
+            self.voltage = np.zeros(n)
+            self.small_step = np.zeros(n, dtype=bool)
+            self.n_miss = np.zeros(n, dtype=int)
+            self.last_capture = np.zeros(n)
+            self.n_probes = np.zeros(n, dtype=int)
+        self.voltage[mask] = 3.0
+        self.small_step[mask] = False
+        self.n_miss[mask] = 0
+        self.last_capture[mask] = np.nan
+        self.n_probes[mask] = 0
+
+    def pulse(self, beat):
+        start = ~self.searching & (beat >= self.next_search)
+        self.searching[start] = True
+        self.duration_idx[start] = 0
+        self.thresholds[start] = np.nan
+        self._reset_duration(start)
+        idx = np.minimum(self.duration_idx, len(self.search_durations) - 1)
+        voltage = np.where(self.searching, self.voltage,
+                           self.output_voltage)
+        duration = np.where(self.searching, self.search_durations[idx],
+                            self.output_duration)
+        return voltage, duration, self.searching.copy()
+
+    def _finish_search(self, beat, finished):
+        rows = np.flatnonzero(finished)
+        durations, voltages, mask = sdc.cohort_arrays(
+            np.broadcast_to(self.search_durations,
+                            (len(rows), len(self.search_durations))),
+            self.thresholds[rows])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rheobase, chronaxie = sdc.lapicque_batch_fit(durations, voltages,
+                                                         mask)
+        valid = np.isfinite(rheobase) & np.isfinite(chronaxie) & \
+            (rheobase > 0) & (chronaxie > 0)
+        self.rheobase[rows] = np.where(valid, rheobase, np.nan)
+        self.chronaxie[rows] = np.where(valid, chronaxie, np.nan)
+        self.n_searches += len(rows)
+        self.output_voltage[rows] = np.where(
+            valid, np.minimum(self.voltage_margin * rheobase,
+                              self.backup_voltage), self.backup_voltage)
+        self.output_duration[rows] = np.where(
+            valid, np.clip(self.duration_margin * chronaxie, 0.1, 2), 0.5)
+        self.searching[rows] = False
+        self.next_search[rows] = beat + self.search_interval
+
+    def respond(self, beat, captured):
+        searching = self.searching
+        loss = ~captured
+        backup = np.where(searching & loss, self.backup_voltage, 0.0)
+        idx = np.minimum(self.duration_idx, len(self.search_durations) - 1)
+        backup_duration = np.where(searching, self.search_durations[idx],
+                                   self.output_duration)
+
+        self.n_probes[searching] += 1
+        hit = searching & captured
+        self.last_capture[hit] = self.voltage[hit]
+        self.voltage[hit] = snap_to_grid(
+            self.voltage[hit] * np.where(self.small_step[hit], 0.95, 0.75))
+        no_capture_yet = np.isnan(self.last_capture)
+        start_miss = searching & loss & no_capture_yet
+        gave_up = start_miss & (self.voltage >= 4.99)
+        self.voltage[start_miss] = snap_to_grid(self.voltage[start_miss] + 1)
+        miss = searching & loss & ~no_capture_yet
+        self.n_miss[miss] += 1
+        self.voltage[miss] = snap_to_grid(self.last_capture[miss] * 0.95)
+        self.small_step[miss] = True
+
+        done = searching & ((self.n_miss >= 2) | gave_up |
+                            (self.n_probes >= self.max_probes))
+        rows = np.flatnonzero(done)
+        self.thresholds[rows, self.duration_idx[rows]] = \
+            self.last_capture[rows]
+        self.duration_idx[rows] += 1
+        self._reset_duration(done)
+        finished = done & (self.duration_idx >= len(self.search_durations))
+        if finished.any():
+            self._finish_search(beat, finished)
+        return backup, backup_duration
+
+
+def default_strategies():
+    """Returns the three vendor strategies and the project algorithm"""
+    return [StJudeAutocapture(), BostonScientificAutomaticCapture(),
+            MedtronicCaptureManagement(), ProjectEnergySavingAlgorithm()]
+
+
+def simulate_strategy(strategy: CaptureManagementStrategy,
+                      patients: SyntheticPatients, n_beats: int,
+                      pacing_resistance: float = 1000):
+    """Simulates a capture management strategy beat by beat
+
+    Every beat is processed for all patients at once. Backup pulses are
+    assumed to capture if they are above the threshold of that beat;
+    a beat that neither the pulse nor a backup pulse captured is lost.
+
+    Args:
+        strategy (CaptureManagementStrategy): strategy to simulate
+        patients (SyntheticPatients): shared synthetic patients
+        n_beats (int): number of beats per patient
+        pacing_resistance (float): total pacing impedence [ohms]
+
+    Returns:
+        result (dict): "pacing_energy", "backup_energy",
+                "search_energy" and "total_energy" [J] summed over all
+                patients, "patient_energy" (total energy [J] of every
+                patient), "n_beats" (simulated beats of all patients),
+                "backup_pulses", "search_pulses", "lost_beats" and
+                "elapsed" [s]
+    """
+    start_time = time.perf_counter()
+    strategy.reset(patients)
+    n = patients.n_patients
+    pacing_energy = np.zeros(n)
+    search_energy = np.zeros(n)
+    backup_energy = np.zeros(n)
+    backup_pulses = 0
+    search_pulses = 0
+    lost_beats = 0
+    for beat in range(n_beats):
+        voltage, duration, searching = strategy.pulse(beat)
+        captured = voltage >= patients.threshold(beat, duration)
+        backup_voltage, backup_duration = strategy.respond(beat, captured)
+        energy = sdc.calculate_energy(duration, voltage, pacing_resistance)
+        search_energy += np.where(searching, energy, 0)
+        pacing_energy += np.where(searching, 0, energy)
+        backup = backup_voltage > 0
+        backup_energy += np.where(backup, sdc.calculate_energy(
+            backup_duration, backup_voltage, pacing_resistance), 0)
+        backup_captured = backup & (backup_voltage >= patients.threshold(
+            beat, backup_duration))
+        backup_pulses += int(backup.sum())
+        search_pulses += int(searching.sum())
+        lost_beats += int(np.sum(~captured & ~backup_captured))
+    patient_energy = pacing_energy + search_energy + backup_energy
+    return {"pacing_energy": float(pacing_energy.sum()),
+            "backup_energy": float(backup_energy.sum()),
+            "search_energy": float(search_energy.sum()),
+            "total_energy": float(patient_energy.sum()),
+            "patient_energy": patient_energy,
+            "n_beats": n * n_beats,
+            "backup_pulses": backup_pulses,
+            "search_pulses": search_pulses,
+            "lost_beats": lost_beats,
+            "elapsed": time.perf_counter() - start_time}
+
+
+def compare_strategies(patients: SyntheticPatients, n_beats: int,
+                       strategies=None, pacing_resistance: float = 1000):
+    """Simulates several strategies on the same synthetic patients
+
+    Args:
+        patients (SyntheticPatients): shared synthetic patients
+        n_beats (int): number of beats per patient
+        strategies (list or None): strategies to compare. Defaults to
+                                   default_strategies()
+        pacing_resistance (float): total pacing impedence [ohms]
+
+    Returns:
+        results (dict): strategy name -> output of simulate_strategy()
+    """
+    if strategies is None:
+        strategies = default_strategies()
+    return {strategy.name: simulate_strategy(strategy, patients, n_beats,
+                                             pacing_resistance)
+            for strategy in strategies}
+
+
+if __name__ == "__main__":
+    # 1000 patients for 2 hours at 60 bpm = 7.2 million beats per strategy
+    patients = SyntheticPatients(1000, seed=0)
+    results = compare_strategies(patients, 2 * 60 * 60)
+    for name, result in results.items():
+        print("{}: total energy {:.4f} J (pacing {:.4f} J, backup {:.4f} \
+J, search {:.4f} J), {} lost beats, {:.1f} s".format(
+            name, result["total_energy"], result["pacing_energy"],
+            result["backup_energy"], result["search_energy"],
+            result["lost_beats"], result["elapsed"]))
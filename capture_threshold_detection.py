@@ -4,6 +4,8 @@
 
 # Import necessary packages
 import logging
+import time
+import numpy as np
 import import_capture_data as icd
 import generate_capture_data as gcd
 import strength_duration_curve as sdc
@@ -24,7 +26,7 @@ def detect_capture(voltage_list, capture_list, trial_voltage):
 
 
 def find_capture_voltage(duration_list: list, voltage_list: list,
-                         capture_list: list):
+                         capture_list: list, probe_trace: list = None):
     """Finds the capture voltage of a patient at a certain stimulus duration.
 
     This function contains the algorithm to find the capture voltage
@@ -60,6 +62,9 @@ def find_capture_voltage(duration_list: list, voltage_list: list,
         capture_list (list): List of Capture Status values coresponding
                              to the duration_list and voltage_list
                              (1 = capture, 0 = no capture)
+        probe_trace (list or None): if a list is given, a
+                             (voltage, capture status) tuple is appended
+                             to it for every stimulus pulse of the search
 
     Returns:
         capture_duration (float): duration of the capture voltage
@@ -87,6 +92,9 @@ of {} ms".format(duration_experimental))
         idx, voltage_experimental = gcd.find_nearest(voltage_list,
                                                      voltage_experimental)
         capture_status = capture_list[idx]
+        if probe_trace is not None:
+            probe_trace.append((float(voltage_experimental),
+                                int(capture_status)))
 
         if capture_status == 1:
             logging.info("Captured: Myocardial tissue was captured with \
@@ -136,11 +144,45 @@ is: {}\n".format(capture_voltage))
     return duration_experimental, capture_voltage
 
 
-def find_patient_capture_voltage(filename: str):
+def calculate_search_energy(duration: float, probe_voltages: list,
+                            capture_results: list,
+                            backup_voltage: float = 4.5,
+                            pacing_resistance: float = 1000):
+    """Finds the energy spent by a capture threshold search
+
+    Every stimulus pulse of the search costs energy, and every pulse
+    that does not capture the myocardial tissue is followed by a backup
+    pulse of backup_voltage at the same pulse duration.
+
+    Args:
+        duration (float): pulse duration [ms] of the search
+        probe_voltages (list): stimulus voltage [V] of every pulse
+        capture_results (list): capture status of every pulse
+                                (1 = capture, 0 = no capture)
+        backup_voltage (float): voltage [V] of the backup pulse
+        pacing_resistance (float): total pacing impedence [ohms]
+
+    Returns:
+        search_energy (float): energy [J] of the probe and backup pulses
+    """
+    probe_voltages = np.asarray(probe_voltages, dtype=float)
+    n_backup = len(capture_results) - int(np.sum(capture_results))
+    search_energy = \
+        np.sum(sdc.calculate_energy(duration, probe_voltages,
+                                    pacing_resistance)) + \
+        n_backup * sdc.calculate_energy(duration, backup_voltage,
+                                        pacing_resistance)
+    return float(search_energy)
+
+
+def find_patient_capture_voltage(filename: str, probe_trace: list = None):
     """Finds the capture voltage of a patient data file
 
     Args:
         filename (str): patient data file ending in .csv
+        probe_trace (list or None): if a list is given, a
+                (voltage, capture status) tuple is appended to it for
+                every stimulus pulse of the search
 
         Note: The patient data should have the following columns:
         (1) stimulus duration - constant pulse duration
@@ -160,26 +202,36 @@ def find_patient_capture_voltage(filename: str):
 #                        level=logging.INFO)
     capture_duration, capture_voltage = \
         find_capture_voltage(duration_list, voltage_list,
-                             capture_list)
+                             capture_list, probe_trace)
     return capture_duration, capture_voltage
 
 
 def patient_strength_duration_data(patient_name: str,
-                                   patient_data_filename_list: list):
-    """
-
+                                   patient_data_filename_list: list,
+                                   history_store=None, timestamp=None):
+    """Finds the strength-duration data and recommended output of a patient
+
+    If a threshold_history_store.ThresholdHistoryStore is given as
+    history_store, the session (thresholds, rheobase, chronaxie,
+    recommended output and search energy) is appended to the patient's
+    history at timestamp [s] (default: now).
     """
     logging.basicConfig(filename="log_files/{}.log".format(
                         patient_name), filemode="w",
                         level=logging.INFO)
     capture_duration_data = []
     capture_voltage_data = []
+    search_energy = 0
 
     for filename in patient_data_filename_list:
+        probe_trace = []
         capture_duration, capture_voltage = \
-                    find_patient_capture_voltage(filename)
+            find_patient_capture_voltage(filename, probe_trace)
         capture_duration_data.append(capture_duration)
         capture_voltage_data.append(capture_voltage)
+        search_energy += calculate_search_energy(
+            capture_duration, [probe[0] for probe in probe_trace],
+            [probe[1] for probe in probe_trace])
 
     print("The capture duration data (in ms) {} is: {}".format(
         patient_name, capture_duration_data))
@@ -213,6 +265,14 @@ def patient_strength_duration_data(patient_name: str,
     logging.info("Energy at reccomended pulse duration and voltage \
 for {} = {} J".format(patient_name, energy_at_pulse_reccomendation))
 
+    if history_store is not None:
+        if timestamp is None:
+            timestamp = time.time()
+        history_store.append(patient_name, timestamp, capture_duration_data,
+                             capture_voltage_data, rheobase, chronaxie,
+                             voltage_at_chronaxie,
+                             reccomended_pulse_duration, search_energy)
+
     return rheobase, chronaxie
 
 
@@ -0,0 +1,378 @@
+# cohort_analytics.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+# Per-patient result metrics that are summarized by default and the
+# (low, high, number of bins) range of their histograms
+DEFAULT_METRICS = {
+    "rheobase": (0, 5, 50),                 # [V]
+    "chronaxie": (0, 2, 40),                # [ms]
+    "recommended_voltage": (0, 10, 50),     # [V]
+    "recommended_duration": (0, 6, 60),     # [ms]
+    # Search energy of all pulse durations of a patient (about 2.4e-4 to
+    # 4.5e-4 J for seven durations up to 1.4 ms)
+    "search_energy": (0, 1e-3, 100),        # [J]
+    "probe_count": (0, 100, 100),           # pulses
+}
+
+
+class RunningMoments:
+    """Count, mean, variance, min and max of a stream of values
+
+    Values can be added one at a time or as arrays. Two RunningMoments
+    objects (for example from two worker processes) are combined with
+    merge() using the parallel variance formula of Chan et al., so the
+    result is the same as if all values had been added to one object.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        other = RunningMoments()
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(np.sum((values - other.mean)**2))
+        other.min = float(values.min())
+        other.max = float(values.max())
+        self.merge(other)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with a relative accuracy guarantee
+
+    Positive values are counted in logarithmic buckets
+    (bucket = ceil(log(value) / log(gamma))), so every quantile is
+    returned within relative_accuracy of the true value. Negative
+    values use a mirrored set of buckets and values close to zero are
+    counted separately. The number of buckets is capped by max_buckets
+    (the lowest buckets are collapsed), so the memory does not grow
+    with the number of values.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01,
+                 max_buckets: int = 2048, min_value: float = 1e-12):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _add_to_buckets(self, buckets, values):
+        keys = np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+        unique_keys, counts = np.unique(keys, return_counts=True)
+        for key, count in zip(unique_keys.tolist(), counts.tolist()):
+            buckets[key] = buckets.get(key, 0) + count
+        self._collapse(buckets)
+
+    def _collapse(self, buckets):
+        if len(buckets) <= self.max_buckets:
+            return
+        keys = sorted(buckets)
+        n_extra = len(keys) - self.max_buckets
+        target = keys[n_extra]
+        for key in keys[:n_extra]:
+            buckets[target] += buckets.pop(key)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        positive = values[values > self.min_value]
+        negative = -values[values < -self.min_value]
+        self.zero_count += len(values) - len(positive) - len(negative)
+        if len(positive):
+            self._add_to_buckets(self.positive, positive)
+        if len(negative):
+            self._add_to_buckets(self.negative, negative)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative "
+                             "accuracy can be merged")
+        for buckets, other_buckets in ((self.positive, other.positive),
+                                       (self.negative, other.negative)):
+            for key, count in other_buckets.items():
+                buckets[key] = buckets.get(key, 0) + count
+            self._collapse(buckets)
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def _bucket_value(self, key):
+        return 2 * self.gamma**key / (self.gamma + 1)
+
+    def quantile(self, q: float):
+        """Returns the value at quantile q (0 <= q <= 1)"""
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._bucket_value(key)
+        return self._bucket_value(max(self.positive))
+
+
+class Histogram:
+    """Fixed-bin histogram with underflow and overflow counts"""
+
+    def __init__(self, low: float, high: float, n_bins: int):
+        self.edges = np.linspace(low, high, n_bins + 1)
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        self.underflow += int(np.sum(values < self.edges[0]))
+        self.overflow += int(np.sum(values > self.edges[-1]))
+        counts, _ = np.histogram(values, bins=self.edges)
+        self.counts += counts
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Only histograms with the same bins can be "
+                             "merged")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+
+class MetricSummary:
+    """Moments, quantile sketch and histogram of one result metric"""
+
+    def __init__(self, low: float, high: float, n_bins: int,
+                 relative_accuracy: float = 0.01):
+        self.moments = RunningMoments()
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.histogram = Histogram(low, high, n_bins)
+
+    def update(self, values):
+        self.moments.update(values)
+        self.sketch.update(values)
+        self.histogram.update(values)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        self.histogram.merge(other.histogram)
+
+    def summary(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        return {
+            "count": self.moments.count,
+            "mean": self.moments.mean,
+            "std": math.sqrt(self.moments.variance()),
+            "min": self.moments.min,
+            "max": self.moments.max,
+            "quantiles": {q: self.sketch.quantile(q) for q in quantiles},
+            "histogram": {"edges": self.histogram.edges.tolist(),
+                          "counts": self.histogram.counts.tolist(),
+                          "underflow": self.histogram.underflow,
+                          "overflow": self.histogram.overflow}}
+
+
+class CohortAggregate:
+    """Constant-memory summary of per-patient results
+
+    Consumes per-patient result records (dictionaries such as
+    {"rheobase": 1.86, "chronaxie": 0.17, "probe_count": 6, ...}) from
+    any runner. Only the metrics given in the constructor are kept and
+    missing metrics are skipped, so records from different runners can
+    be mixed. Aggregates built in parallel are combined with merge().
+    """
+
+    def __init__(self, metrics: dict = None,
+                 relative_accuracy: float = 0.01):
+        if metrics is None:
+            metrics = DEFAULT_METRICS
+        self.n_records = 0
+        self.metrics = {name: MetricSummary(low, high, n_bins,
+                                            relative_accuracy)
+                        for name, (low, high, n_bins) in metrics.items()}
+
+    def update(self, record: dict):
+        """Adds one per-patient result record"""
+        self.n_records += 1
+        for name, metric in self.metrics.items():
+            if record.get(name) is not None:
+                metric.update([record[name]])
+
+    def update_batch(self, records: dict):
+        """Adds many records given as a dictionary of arrays
+
+        Args:
+            records (dict): metric name -> array of values (one value
+                            per patient, NaN for missing values)
+        """
+        lengths = [len(np.atleast_1d(values)) for values in records.values()]
+        self.n_records += max(lengths, default=0)
+        for name, metric in self.metrics.items():
+            if name in records:
+                metric.update(records[name])
+
+    def merge(self, other):
+        """Adds the partial aggregate of another worker to this one"""
+        self.n_records += other.n_records
+        for name, metric in self.metrics.items():
+            if name in other.metrics:
+                metric.merge(other.metrics[name])
+        return self
+
+    def summary(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        """Returns a dictionary with the summary of every metric"""
+        summary = {"n_records": self.n_records}
+        for name, metric in self.metrics.items():
+            summary[name] = metric.summary(quantiles)
+        return summary
+
+
+def aggregate_records(records, metrics: dict = None):
+    """Aggregates an iterable of per-patient result records
+
+    Records are consumed one at a time, so the iterable can be a
+    generator over millions of patients.
+
+    Args:
+        records (iterable): per-patient result dictionaries
+        metrics (dict or None): metrics to summarize (see
+                                DEFAULT_METRICS)
+
+    Returns:
+        aggregate (CohortAggregate): summary of the records
+    """
+    aggregate = CohortAggregate(metrics)
+    for record in records:
+        aggregate.update(record)
+    return aggregate
+
+
+def merge_aggregates(aggregates):
+    """Combines partial aggregates into one CohortAggregate
+
+    Args:
+        aggregates (iterable): CohortAggregate objects with the same
+                               metrics
+
+    Returns:
+        aggregate (CohortAggregate): combined aggregate
+    """
+    aggregates = iter(aggregates)
+    aggregate = next(aggregates)
+    for other in aggregates:
+        aggregate.merge(other)
+    return aggregate
+
+
+def _aggregate_task(runner, task, metrics):
+    return aggregate_records(runner(task), metrics)
+
+
+def parallel_aggregate(runner, tasks, metrics: dict = None,
+                       max_workers=None):
+    """Runs a result runner on worker processes and merges the results
+
+    Every worker aggregates the records of its own task, so only the
+    small partial aggregates are sent back to the main process.
+
+    Args:
+        runner (function): top-level function that takes a task and
+                returns (or yields) per-patient result records
+        tasks (iterable): tasks to run (for example lists of patients)
+        metrics (dict or None): metrics to summarize (see
+                                DEFAULT_METRICS)
+        max_workers (int or None): number of worker processes
+
+    Returns:
+        aggregate (CohortAggregate): summary of the records of all tasks
+    """
+    aggregate = CohortAggregate(metrics)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_aggregate_task, runner, task, metrics)
+                   for task in tasks]
+        for future in futures:
+            aggregate.merge(future.result())
+    return aggregate
+
+
+def synthetic_result_batch(seed: int, n_patients: int = 100000):
+    """Generates random per-patient results (used by the example below)
+
+    Args:
+        seed (int): seed of the random number generator
+        n_patients (int): number of patients
+
+    Returns:
+        records (dict): metric name -> array of values
+    """
+    rng = np.random.default_rng(seed)
+    rheobase = rng.lognormal(np.log(0.9), 0.3, n_patients)
+    chronaxie = rng.lognormal(np.log(0.4), 0.3, n_patients)
+    return {"rheobase": rheobase,
+            "chronaxie": chronaxie,
+            "recommended_voltage": 2 * rheobase,
+            "recommended_duration": 3 * chronaxie,
+            "search_energy": rng.lognormal(np.log(2.7e-4), 0.1, n_patients),
+            "probe_count": rng.integers(4, 12, n_patients)}
+
+
+def _synthetic_aggregate(seed):
+    aggregate = CohortAggregate()
+    aggregate.update_batch(synthetic_result_batch(seed))
+    return aggregate
+
+
+if __name__ == "__main__":
+    # Summarize 1 million synthetic patients on 4 worker processes
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        cohort = merge_aggregates(executor.map(_synthetic_aggregate,
+                                               range(10)))
+    summary = cohort.summary()
+    print("Patients: {}".format(summary["n_records"]))
+    for name in ["rheobase", "chronaxie", "recommended_voltage"]:
+        print("{}: mean = {:.3f}, median = {:.3f}, 95th percentile = \
+{:.3f}".format(name, summary[name]["mean"],
+               summary[name]["quantiles"][0.5],
+               summary[name]["quantiles"][0.95]))
@@ -0,0 +1,314 @@
+# evoked_response_detection.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import time
+import numpy as np
+import generate_capture_data as gcd
+
+
+# Electrogram settings
+SAMPLING_RATE = 1000        # [Hz] samples per second
+N_SAMPLES = 64              # samples recorded after every pacing pulse
+BLANKING = 8                # samples blanked after the pulse
+
+
+def evoked_response_template(n_samples: int = N_SAMPLES,
+                             sampling_rate: float = SAMPLING_RATE,
+                             delay=0):
+    """Shape of the evoked response with a peak amplitude of 1 mV
+
+    The evoked response of captured myocardium is a large negative
+    deflection about 20 ms after the pulse followed by a smaller
+    positive repolarization lobe.
+
+    Args:
+        n_samples (int): samples after the pulse
+        sampling_rate (float): samples per second [Hz]
+        delay (int or np.array): extra latency [samples]. An array of
+                                 delays gives one row per delay
+
+    Returns:
+        template (np.array): evoked response [mV] at every sample
+    """
+    delay = np.asarray(delay)[..., np.newaxis]
+    t = (np.arange(n_samples) - delay) * 1000 / sampling_rate     # [ms]
+    return -np.exp(-((t - 20) / 6)**2) + \
+        0.4 * np.exp(-((t - 40) / 8)**2)
+
+
+def generate_post_pacing_electrograms(captured, voltage, duration,
+                                      seed=None,
+                                      n_samples: int = N_SAMPLES,
+                                      sampling_rate: float = SAMPLING_RATE,
+                                      er_amplitude: float = 8,
+                                      polarization_gain: float = 5,
+                                      noise_sd: float = 0.5):
+    """Simulates the electrogram after each pacing pulse
+
+    Every beat is the sum of:
+        - the evoked response (only if the beat captured), with a
+          random amplitude around er_amplitude [mV] and a random delay
+        - the polarization artifact of the electrode,
+          A * exp(-t / tau) with A proportional to the pulse charge
+          (polarization_gain [mV per V*ms]) and a random tau (5-20 ms)
+        - white measurement noise
+
+    Args:
+        captured (np.array): capture status of every beat
+        voltage (float or np.array): pulse voltage [V] of every beat
+        duration (float or np.array): pulse duration [ms] of every beat
+        seed (int or None): seed of the random number generator
+        n_samples (int): samples per beat
+        sampling_rate (float): samples per second [Hz]
+        er_amplitude (float): mean evoked response amplitude [mV]
+        polarization_gain (float): artifact amplitude [mV] per V*ms
+        noise_sd (float): standard deviation of the noise [mV]
+
+    Returns:
+        electrograms (np.array): 2D array [mV] with one row per beat
+    """
+    rng = np.random.default_rng(seed)
+    captured = np.asarray(captured, dtype=bool)
+    n_beats = len(captured)
+    t = np.arange(n_samples) * 1000 / sampling_rate
+    charge = np.broadcast_to(np.asarray(voltage, dtype=float) *
+                             np.asarray(duration, dtype=float), (n_beats,))
+    tau = rng.uniform(5, 20, n_beats)
+    electrograms = (polarization_gain * charge)[:, np.newaxis] * \
+        np.exp(-t[np.newaxis, :] / tau[:, np.newaxis])
+    amplitude = np.clip(rng.normal(er_amplitude, 0.2 * er_amplitude,
+                                   n_beats), 0, None)
+    delay = rng.integers(-2, 3, n_beats)
+    shifted = evoked_response_template(n_samples, sampling_rate, delay)
+    electrograms += np.where(captured, amplitude, 0)[:, np.newaxis] * shifted
+    electrograms += rng.normal(0, noise_sd, (n_beats, n_samples))
+    return electrograms
+
+
+def detection_weights(n_samples: int = N_SAMPLES,
+                      sampling_rate: float = SAMPLING_RATE,
+                      blanking: int = BLANKING,
+                      max_lag: int = 2,
+                      artifact_taus=(5, 10, 20)):
+    """Template matching weights that ignore the polarization artifact
+
+    The polarization artifact is (approximately) a combination of
+    decaying exponentials and an offset. The evoked response template
+    is projected onto the space orthogonal to those basis functions, so
+    the dot product of a beat with the returned weights estimates the
+    evoked response amplitude [mV] without being affected by the
+    artifact. The evoked response latency varies from beat to beat, so
+    there is one set of weights per template shift from -max_lag to
+    +max_lag samples.
+
+    Returns:
+        weights (np.array): 2D array with one column per template shift
+                            and one row per sample (0 in the blanking
+                            period)
+    """
+    t = np.arange(blanking, n_samples) * 1000 / sampling_rate
+    basis = np.column_stack([np.ones_like(t)] +
+                            [np.exp(-t / tau) for tau in artifact_taus])
+    projection = np.eye(len(t)) - \
+        basis @ np.linalg.pinv(basis.T @ basis) @ basis.T
+    weights = np.zeros((n_samples, 2 * max_lag + 1))
+    for i, lag in enumerate(range(-max_lag, max_lag + 1)):
+        shifted = evoked_response_template(n_samples, sampling_rate,
+                                           lag)[blanking:]
+        projected = projection @ shifted
+        weights[blanking:, i] = projected / (projected @ shifted)
+    return weights
+
+
+class StreamingCaptureDetector:
+    """Beat-by-beat capture detector for post-pacing electrograms
+
+    Beats are processed in blocks as they arrive. The evoked response
+    amplitude of every beat is estimated with a few dot products
+    (detection_weights(), one per template shift), so a block of beats
+    is one matrix product. A beat is classified as captured when the
+    amplitude is above a fraction of the running average amplitude of
+    captured beats. The decision of a beat only needs its own
+    n_samples, so the detection latency is fixed at
+    n_samples / sampling_rate.
+
+    Args:
+        n_samples (int): samples per beat
+        sampling_rate (float): samples per second [Hz]
+        blanking (int): samples ignored after the pulse
+        initial_amplitude (float): expected evoked response amplitude
+                                   [mV] before any beat was captured
+        threshold_fraction (float): fraction of the running amplitude
+                                    that counts as capture
+        adaptation (float): weight of a new block in the running
+                            amplitude (0 = no adaptation)
+    """
+
+    def __init__(self, n_samples: int = N_SAMPLES,
+                 sampling_rate: float = SAMPLING_RATE,
+                 blanking: int = BLANKING,
+                 initial_amplitude: float = 8,
+                 threshold_fraction: float = 0.5,
+                 adaptation: float = 0.05):
+        self.n_samples = n_samples
+        self.sampling_rate = sampling_rate
+        self.weights = detection_weights(n_samples, sampling_rate, blanking)
+        self.amplitude = initial_amplitude
+        self.threshold_fraction = threshold_fraction
+        self.adaptation = adaptation
+        self.n_beats = 0
+
+    def latency_ms(self):
+        """Time [ms] from the pacing pulse to the capture decision"""
+        return self.n_samples * 1000 / self.sampling_rate
+
+    def process(self, electrograms):
+        """Classifies a block of beats
+
+        Args:
+            electrograms (np.array): 2D array [mV] with one row per beat
+
+        Returns:
+            captured (np.array): 1 = capture, 0 = no capture per beat
+        """
+        amplitudes = np.max(np.atleast_2d(electrograms) @ self.weights,
+                            axis=1)
+        captured = amplitudes > self.threshold_fraction * self.amplitude
+        if captured.any():
+            self.amplitude += self.adaptation * \
+                (amplitudes[captured].mean() - self.amplitude)
+        self.n_beats += len(amplitudes)
+        return captured.astype(np.int8)
+
+
+def evoked_response_capture_list(voltage_list: list, duration: float,
+                                 capture_voltage: float, spread=None,
+                                 seed=None, detector=None):
+    """Capture status of every stimulus voltage from simulated signals
+
+    Plugs the detector into capture_threshold_detection.py as a capture
+    source: a post-pacing electrogram is simulated for every voltage of
+    voltage_list (captured if the voltage is above the threshold, or
+    sampled from the psychometric function if a spread is given) and
+    the capture status is what the detector classifies. As in
+    generate_capture_data(), the highest voltage always captures (a
+    missed detection there would make the search of
+    find_capture_voltage(), which keeps stepping up until it captures,
+    run forever), so the result can be given to find_capture_voltage()
+    as its capture_list.
+
+    Args:
+        voltage_list (list): stimulus voltage amplitudes [V]
+        duration (float): pulse duration [ms]
+        capture_voltage (float): true capture threshold [V]
+        spread (float or None): width [V] of the psychometric function.
+                                None for a deterministic threshold
+        seed (int or None): seed of the random number generator
+        detector (StreamingCaptureDetector or None): detector to use
+
+    Returns:
+        capture_list (list): detected capture status of every voltage
+                             (1 at the highest voltage)
+    """
+    rng = np.random.default_rng(seed)
+    voltages = np.asarray(voltage_list, dtype=float)
+    if spread is None:
+        true_capture = voltages >= capture_voltage
+    else:
+        true_capture = rng.random(len(voltages)) < gcd.capture_probability(
+            voltages, capture_voltage, spread)
+    electrograms = generate_post_pacing_electrograms(
+        true_capture, voltages, duration, seed=rng.integers(2**32))
+    if detector is None:
+        detector = StreamingCaptureDetector()
+    capture_list = detector.process(electrograms)
+    capture_list[np.argmax(voltages)] = 1
+    return capture_list.tolist()
+
+
+def electrogram_capture_function(capture_voltage: float, duration: float,
+                                 spread=None, seed=None, detector=None):
+    """Creates a pulse-by-pulse capture function from simulated signals
+
+    Every call simulates the electrogram of one pulse and returns the
+    detector's classification, so it can be used as the
+    capture_function of
+    adaptive_threshold_estimation.bayesian_threshold_search().
+
+    Args:
+        capture_voltage (float): true capture threshold [V]
+        duration (float): pulse duration [ms]
+        spread (float or None): width [V] of the psychometric function
+        seed (int or None): seed of the random number generator
+        detector (StreamingCaptureDetector or None): detector to use
+
+    Returns:
+        capture_function (function): takes a stimulus voltage [V] and
+                returns the detected capture status
+    """
+    rng = np.random.default_rng(seed)
+    if detector is None:
+        detector = StreamingCaptureDetector()
+
+    def capture_function(voltage):
+        if spread is None:
+            captured = voltage >= capture_voltage
+        else:
+            captured = rng.random() < gcd.capture_probability(
+                voltage, capture_voltage, spread)
+        electrogram = generate_post_pacing_electrograms(
+            [captured], voltage, duration, seed=rng.integers(2**32))
+        return int(detector.process(electrogram)[0])
+
+    return capture_function
+
+
+def benchmark_detector(n_beats: int = 200000, block_size: int = 4096,
+                       seed: int = 0):
+    """Measures detector throughput and accuracy on one core
+
+    Args:
+        n_beats (int): number of simulated beats
+        block_size (int): beats per processed block
+        seed (int): seed of the random number generator
+
+    Returns:
+        results (dict): "beats_per_second", "latency_ms",
+                "sensitivity" and "specificity"
+    """
+    rng = np.random.default_rng(seed)
+    captured = rng.random(n_beats) < 0.5
+    voltage = rng.uniform(0.5, 4.5, n_beats)
+    duration = rng.choice([0.2, 0.4, 0.5, 1.0], n_beats)
+    electrograms = generate_post_pacing_electrograms(captured, voltage,
+                                                     duration, seed=seed)
+    detector = StreamingCaptureDetector()
+    detected = np.empty(n_beats, dtype=np.int8)
+    start = time.perf_counter()
+    for i in range(0, n_beats, block_size):
+        detected[i:i + block_size] = detector.process(
+            electrograms[i:i + block_size])
+    elapsed = time.perf_counter() - start
+    return {"beats_per_second": n_beats / elapsed,
+            "latency_ms": detector.latency_ms(),
+            "sensitivity": float(np.mean(detected[captured] == 1)),
+            "specificity": float(np.mean(detected[~captured] == 0))}
+
+
+if __name__ == "__main__":
+    import capture_threshold_detection as ctd
+
+    results = benchmark_detector()
+    print("Detector: {:.0f} beats per second per core, latency {} ms, \
+sensitivity {:.4f}, specificity {:.4f}".format(
+        results["beats_per_second"], results["latency_ms"],
+        results["sensitivity"], results["specificity"]))
+
+    # Threshold search with capture detected from simulated signals
+    voltage_list = np.round(np.arange(0, 5, 0.01), 2).tolist()
+    capture_list = evoked_response_capture_list(voltage_list, 0.4, 2.6,
+                                                seed=1)
+    ctd.find_capture_voltage([0.4] * len(voltage_list), voltage_list,
+                             capture_list)
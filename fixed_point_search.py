@@ -0,0 +1,306 @@
+# fixed_point_search.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+from array import array
+import functools
+import numpy as np
+import generate_capture_data as gcd
+
+
+# Device memory sizes [bytes] used for the memory budget
+# RAM: current code, last capture code (uint16), step mode, miss
+# counter, done flag (uint8), probe and backup counters (uint8),
+# energy accumulator (uint64), operation counter (uint32) and pulse
+# duration [us] (uint16)
+STATE_RAM_BYTES = 2 + 2 + 1 + 1 + 1 + 1 + 1 + 8 + 4 + 2
+# ROM: per grid code the voltage [mV] and three step tables (uint16)
+ROM_BYTES_PER_CODE = 4 * 2
+
+# Operations per search pulse used for the operation budget. Every pulse
+# costs: 1 capture read, 1 backup/energy multiply-accumulate, 1 counter
+# increment, 1 step table lookup and the branch compares of its path.
+OPS_CAPTURE = 6          # read, compare, MAC, store, lookup, increment
+OPS_MISS = 8             # read, compare, MAC x2, compare, lookup, store x2
+OPS_START_MISS = 7       # read, compare, MAC x2, compare, lookup, store
+
+
+@functools.lru_cache(maxsize=8)
+def build_step_tables(voltage_grid: tuple):
+    """Builds the read-only (ROM) tables of a voltage grid
+
+    The tables are cached per grid and shared by every kernel of that
+    grid. They are never written, so kernels in different threads can
+    share them.
+
+    Args:
+        voltage_grid (tuple): stimulus voltages [V] (ascending)
+
+    Returns:
+        grid_mv (array): voltage [mV] of every grid code
+        coarse_step (array): grid code after a x0.75 step
+        fine_step (array): grid code after a x0.95 step
+        start_step (array): grid code after a +1 V step
+    """
+    voltage_grid = np.asarray(voltage_grid, dtype=float)
+    grid_mv = array("H", np.round(voltage_grid * 1000).astype(int).tolist())
+    coarse_step = array("H", gcd.find_nearest_indices(
+        voltage_grid, voltage_grid * 0.75).tolist())
+    fine_step = array("H", gcd.find_nearest_indices(
+        voltage_grid, voltage_grid * 0.95).tolist())
+    start_step = array("H", gcd.find_nearest_indices(
+        voltage_grid, voltage_grid + 1).tolist())
+    return grid_mv, coarse_step, fine_step, start_step
+
+
+class FixedPointSearchKernel:
+    """Fixed-size state machine of the capture threshold search
+
+    Implements the same search as
+    capture_threshold_detection.find_capture_voltage(), but in the form
+    it would run on a pacemaker microcontroller:
+        - Voltages are integer codes of the voltage grid (the DAC codes
+          of the device) and integer millivolts
+        - Pulse durations are integer microseconds
+        - Pulse energy is accumulated as an integer in mV^2 * us
+        - All state is preallocated in __slots__ and the step targets
+          are lookup tables (ROM), so no memory is allocated per pulse
+
+    The step tables hold the grid code that the reference search snaps
+    to after each kind of step (x0.75 coarse step, x0.95 fine step and
+    +1 V when the start voltage does not capture). They are built once
+    per voltage grid with the same nearest-value rule as the reference,
+    which makes the kernel bit-exact with the float search (including
+    the voltages that lie exactly halfway between two grid values).
+
+    The reference search never finishes for thresholds below about
+    0.1 V (the x0.95 step snaps back to the same grid value), so the
+    kernel stops after max_probes pulses and reports a failed search.
+
+    Args:
+        voltage_grid (list or np.array): stimulus voltages [V] of the
+                                         capture records (ascending)
+        voltage_start (float): start voltage [V] of the search
+        max_probes (int): a search stops (and fails) after this many
+                          pulses, so a search is always bounded
+    """
+
+    __slots__ = ("n_codes", "grid_mv", "coarse_step", "fine_step",
+                 "start_step", "start_code", "max_probes",
+                 "code", "last_capture_code", "small_step",
+                 "miss_count", "done", "n_probes", "n_backup",
+                 "energy_acc", "operation_count", "duration_us")
+
+    def __init__(self, voltage_grid, voltage_start: float = 3,
+                 max_probes: int = 64):
+        self.n_codes = len(voltage_grid)
+        self.grid_mv, self.coarse_step, self.fine_step, self.start_step = \
+            build_step_tables(tuple(voltage_grid))
+        self.start_code, _ = gcd.find_nearest(voltage_grid, voltage_start)
+        self.max_probes = max_probes
+        self.reset(0)
+
+    def reset(self, duration_us: int):
+        """Starts a new search at a pulse duration [us]"""
+        self.duration_us = duration_us
+        self.code = self.start_code
+        self.last_capture_code = -1
+        self.small_step = 0
+        self.miss_count = 0
+        self.done = 0
+        self.n_probes = 0
+        self.n_backup = 0
+        self.energy_acc = 0
+        self.operation_count = 0
+
+    def report(self, capture_status: int):
+        """Updates the state with the capture result of the current code
+
+        Args:
+            capture_status (int): 1 = capture, 0 = no capture
+
+        Returns:
+            done (int): 1 when the search is finished
+        """
+        code = self.code
+        self.n_probes += 1
+        self.energy_acc += self.grid_mv[code] * self.grid_mv[code]
+        if capture_status:
+            self.last_capture_code = code
+            if self.small_step:
+                self.code = self.fine_step[code]
+            else:
+                self.code = self.coarse_step[code]
+            self.operation_count += OPS_CAPTURE
+        elif self.last_capture_code < 0:
+            # Start voltage did not capture: backup pulse and +1 V
+            self.n_backup += 1
+            self.code = self.start_step[code]
+            self.operation_count += OPS_START_MISS
+        else:
+            self.n_backup += 1
+            self.miss_count += 1
+            self.code = self.fine_step[self.last_capture_code]
+            self.small_step = 1
+            self.operation_count += OPS_MISS
+        if self.miss_count >= 2 or self.n_probes >= self.max_probes:
+            self.done = 1
+        return self.done
+
+    def run(self, duration_us: int, capture_record):
+        """Runs a complete search on a capture record
+
+        Args:
+            duration_us (int): pulse duration [us]
+            capture_record (sequence): capture status of every grid code
+
+        Returns:
+            capture_code (int): grid code of the capture threshold
+                                (-1 if the search failed)
+        """
+        self.reset(duration_us)
+        while not self.done:
+            self.report(capture_record[self.code])
+        if self.miss_count < 2:
+            return -1
+        return self.last_capture_code
+
+    def search_energy(self, backup_voltage_mv: int = 4500,
+                      pacing_resistance: int = 1000):
+        """Energy [J] of the probe and backup pulses of the last search
+
+        The integer accumulators are only converted to joules here:
+        E = sum(V^2) * t / R with V in mV and t in us (1e-12 V^2 s).
+        """
+        energy_acc = self.energy_acc + \
+            self.n_backup * backup_voltage_mv * backup_voltage_mv
+        return energy_acc * self.duration_us * 1e-12 / pacing_resistance
+
+    def budget(self):
+        """Operation and memory budget of the last search
+
+        Returns:
+            budget (dict): "probes", "backup_pulses", "operations"
+                    (counted integer operations of the search),
+                    "ram_bytes" (search state) and "rom_bytes"
+                    (grid voltages and step tables)
+        """
+        return {"probes": self.n_probes,
+                "backup_pulses": self.n_backup,
+                "operations": self.operation_count,
+                "ram_bytes": STATE_RAM_BYTES,
+                "rom_bytes": ROM_BYTES_PER_CODE * self.n_codes}
+
+
+def find_capture_voltage_fixed_point(duration_list: list,
+                                     voltage_list: list,
+                                     capture_list: list,
+                                     probe_trace: list = None):
+    """Finds the capture voltage with the fixed-point search kernel
+
+    Drop-in replacement of
+    capture_threshold_detection.find_capture_voltage() (same arguments
+    and results) that runs FixedPointSearchKernel. Nothing is printed
+    or logged per pulse. Every call uses its own kernel state (only the
+    step tables are shared), so calls from different threads are safe.
+
+    Args:
+        duration_list (list): list of constant pulse durations
+        voltage_list (list): stimulus voltage amplitude that is the
+                             varying voltage of the stimulus
+        capture_list (list): List of Capture Status values coresponding
+                             to the duration_list and voltage_list
+                             (1 = capture, 0 = no capture)
+        probe_trace (list or None): if a list is given, a
+                             (voltage, capture status) tuple is appended
+                             to it for every stimulus pulse of the search
+
+    Returns:
+        capture_duration (float): duration of the capture voltage
+        capture_voltage (float): capture voltage of the myocardial tissue
+
+    Raises:
+        ValueError: if the search does not finish within max_probes
+                    pulses
+    """
+    kernel = FixedPointSearchKernel(voltage_list)
+    duration = duration_list[0]
+    kernel.reset(int(round(duration * 1000)))
+    while not kernel.done:
+        code = kernel.code
+        capture_status = int(capture_list[code])
+        if probe_trace is not None:
+            probe_trace.append((float(voltage_list[code]), capture_status))
+        kernel.report(capture_status)
+    if kernel.miss_count < 2:
+        raise ValueError("The capture threshold search did not finish "
+                         "within {} pulses".format(kernel.max_probes))
+    return duration, voltage_list[kernel.last_capture_code]
+
+
+def bulk_search(durations, voltage_grid, capture_matrix):
+    """Runs the fixed-point search on many capture records
+
+    Args:
+        durations (list or np.array): pulse duration [ms] of every record
+        voltage_grid (list or np.array): stimulus voltages [V] shared by
+                                         every record
+        capture_matrix (np.array): 2D array of capture status values
+                                   with one row per record (any integer
+                                   or boolean dtype)
+
+    Returns:
+        capture_voltages (np.array): threshold [V] of every record (NaN
+                                     if the search failed)
+        probe_counts (np.array): number of pulses of every search
+        search_energies (np.array): energy [J] of every search
+    """
+    kernel = FixedPointSearchKernel(voltage_grid)
+    voltage_grid = np.asarray(voltage_grid, dtype=float)
+    # One byte per capture status so that every row can be read as bytes
+    capture_matrix = np.asarray(capture_matrix).astype(np.uint8)
+    n_records = len(capture_matrix)
+    capture_codes = np.empty(n_records, dtype=int)
+    probe_counts = np.empty(n_records, dtype=int)
+    search_energies = np.empty(n_records)
+    durations_us = np.round(np.asarray(durations) * 1000).astype(int)
+    for i in range(n_records):
+        capture_codes[i] = kernel.run(int(durations_us[i]),
+                                      capture_matrix[i].tobytes())
+        probe_counts[i] = kernel.n_probes
+        search_energies[i] = kernel.search_energy()
+    capture_voltages = np.where(capture_codes >= 0,
+                                voltage_grid[capture_codes], np.nan)
+    return capture_voltages, probe_counts, search_energies
+
+
+if __name__ == "__main__":
+    import time
+    import probe_trace_replay as ptr
+
+    # Bit-exact check against the float search and timing comparison
+    rng = np.random.default_rng(0)
+    n_records = 20000
+    durations = rng.choice([0.1, 0.2, 0.3, 0.4, 0.5, 1, 1.5], n_records)
+    voltage_grid, capture_matrix = gcd.generate_capture_records(
+        rng.uniform(0.3, 4.9, n_records))
+    start = time.perf_counter()
+    trace_set = ptr.record_trace_set(durations, voltage_grid,
+                                     capture_matrix)
+    float_time = time.perf_counter() - start
+    report = ptr.replay_trace_set(trace_set,
+                                  find_capture_voltage_fixed_point)
+    print("Fixed-point kernel: {} of {} searches differ".format(
+        report["n_changed"], report["n_traces"]))
+
+    start = time.perf_counter()
+    capture_voltages, probe_counts, search_energies = bulk_search(
+        durations, voltage_grid, capture_matrix)
+    fixed_time = time.perf_counter() - start
+    print("Float search: {:.2f} s, fixed-point kernel: {:.2f} s".format(
+        float_time, fixed_time))
+
+    kernel = FixedPointSearchKernel(voltage_grid)
+    kernel.run(500, capture_matrix[0].tobytes())
+    print("Budget of one search: {}".format(kernel.budget()))
@@ -26,8 +26,88 @@ def find_nearest(a, a0):
     return idx, nearest_val
 
 
+def find_nearest_indices(a, values):
+    """
+    Finds the indices of the elements in the sorted array `a` closest to
+    every value in `values`. Gives the same result as calling
+    find_nearest() for every value (ties go to the lower index).
+    Args:
+        a (np.array or list): sorted array of values
+        values (np.array or list): values to find in array `a`
+    Returns:
+        idx (np.array): index of the element in `a` closest to each value
+    """
+    a = np.asarray(a)
+    values = np.asarray(values)
+    idx = np.clip(np.searchsorted(a, values), 1, len(a) - 1)
+    use_lower = np.abs(a[idx - 1] - values) <= np.abs(a[idx] - values)
+    return idx - use_lower
+
+
+def capture_probability(voltage, capture_voltage: float, spread: float):
+    """Probability that a stimulus captures the myocardial tissue
+
+    Real capture thresholds fluctuate from beat to beat, so a stimulus
+    near the threshold only captures some of the time. This function
+    models that with a logistic psychometric function centered on the
+    capture voltage:
+
+        P(capture) = 1 / (1 + exp(-(V - V_capture) / spread))
+
+    At the capture voltage the probability of capture is 50%. The
+    spread sets how wide the uncertain region around the threshold is
+    (roughly 95% of the transition happens within +/- 3 * spread).
+
+    Args:
+        voltage (float or np.array): stimulus voltage amplitude(s) [V]
+        capture_voltage (float): voltage [V] that captures the
+                                 myocardial tissue 50% of the time
+        spread (float): width [V] of the transition from no capture
+                        to capture. Must be greater than 0
+
+    Returns:
+        probability (float or np.array): probability of capture for
+                                         each stimulus voltage
+    """
+    if spread <= 0:
+        raise ValueError("spread must be greater than 0")
+    voltage = np.asarray(voltage, dtype=float)
+    probability = 1 / (1 + np.exp(-(voltage - capture_voltage) / spread))
+    return probability
+
+
+def stochastic_capture_oracle(capture_voltage: float, spread: float,
+                              seed=None):
+    """Creates a function that samples capture status beat by beat
+
+    Every call of the returned function is one stimulus pulse. The
+    capture status of that pulse is sampled from the psychometric
+    function described in capture_probability(), so calling the
+    function twice with the same voltage can give different results.
+
+    Args:
+        capture_voltage (float): voltage [V] that captures the
+                                 myocardial tissue 50% of the time
+        spread (float): width [V] of the transition from no capture
+                        to capture
+        seed (int or None): seed of the random number generator
+
+    Returns:
+        capture_function (function): function that takes a stimulus
+                voltage [V] and returns its capture status
+                (1 = capture, 0 = no capture)
+    """
+    rng = np.random.default_rng(seed)
+
+    def capture_function(voltage):
+        probability = capture_probability(voltage, capture_voltage, spread)
+        return int(rng.random() < probability)
+
+    return capture_function
+
+
 def generate_capture_data(filename: str, duration: int or float,
-                          capture_voltage: int):
+                          capture_voltage: int, spread=None, seed=None):
     """
     This function creates a file and generates data
 
@@ -36,12 +116,23 @@ def generate_capture_data(filename: str, duration: int or float,
         (2) Stimulus Voltage Amplitude - varying voltage of the stimulus
         (3) Capture Status (1 = capture, 0 = no capture)
 
+    By default the capture status is deterministic: every voltage at or
+    above the capture voltage captures. If a spread is given, the
+    capture status of each voltage is instead sampled from the
+    psychometric function described in capture_probability(). The
+    highest voltage of the file always captures, otherwise
+    find_capture_voltage() could keep stepping up to it forever.
+
     Args:
         filename (str): name of test data file to be created
         duration (int or float): pulse duration
         capture_voltage(): min stimulation voltage that
                            captures myocardial tissue at
                            the provided pulse duration
+        spread (float or None): width [V] of the psychometric
+                                function. None for deterministic data
+        seed (int or None): seed of the random number generator
+                            (only used when spread is given)
 
     Returns:
         file with 3 columns of data described above
@@ -50,12 +141,62 @@ def generate_capture_data(filename: str, duration: int or float,
     stim_duration = duration * np.ones((data_length))
     stim_voltage = np.arange(0, 5, 5/data_length)
     capture_status = np.zeros((data_length))
-    index, _ = find_nearest(stim_voltage, capture_voltage)
-    capture_status[index:] = 1
+    if spread is None:
+        index, _ = find_nearest(stim_voltage, capture_voltage)
+        capture_status[index:] = 1
+    else:
+        rng = np.random.default_rng(seed)
+        probability = capture_probability(stim_voltage, capture_voltage,
+                                          spread)
+        capture_status = (rng.random(data_length) < probability).astype(int)
+        # The highest voltage always captures so that the search of
+        # capture_threshold_detection.py (which keeps stepping up until
+        # it captures) always finishes
+        capture_status[-1] = 1
     data = np.column_stack([stim_duration, stim_voltage, capture_status])
     np.savetxt(filename, data, fmt=['%.2f', '%.2f', '%d'], delimiter=',')
 
 
+def generate_capture_records(capture_voltages, spread=None, seed=None):
+    """Generates the capture data of many records at once (in memory)
+
+    Vectorized version of generate_capture_data() for simulations that
+    need many capture records without writing files. Every record uses
+    the same voltage grid, rounded to 0.01 V like the data files.
+
+    Args:
+        capture_voltages (list or np.array): capture voltage [V] of
+                                             every record
+        spread (float or None): width [V] of the psychometric
+                                function. None for deterministic data
+        seed (int or None): seed of the random number generator
+                            (only used when spread is given)
+
+    Returns:
+        voltage_grid (np.array): stimulus voltages [V] of every record
+        capture_matrix (np.array): 2D int8 array of capture status
+                values with one row per record (1 = capture,
+                0 = no capture). As in generate_capture_data(), the
+                highest voltage always captures
+    """
+    data_length = 500      # length of data
+    stim_voltage = np.arange(0, 5, 5/data_length)
+    capture_voltages = np.asarray(capture_voltages, dtype=float)
+    if spread is None:
+        index = find_nearest_indices(stim_voltage, capture_voltages)
+        capture_matrix = (np.arange(data_length)[np.newaxis, :] >=
+                          index[:, np.newaxis])
+    else:
+        rng = np.random.default_rng(seed)
+        probability = capture_probability(stim_voltage[np.newaxis, :],
+                                          capture_voltages[:, np.newaxis],
+                                          spread)
+        capture_matrix = rng.random(probability.shape) < probability
+        capture_matrix[:, -1] = True
+    voltage_grid = np.round(stim_voltage, 2)
+    return voltage_grid, capture_matrix.astype(np.int8)
+
+
 # Generate psuedo data for the energy saving algorithm
 def create_patient_capture_data_files(pulse_duration_experimental: list,
                                       voltage_amp_experimental: list,
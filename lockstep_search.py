@@ -0,0 +1,178 @@
+# lockstep_search.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import numpy as np
+import generate_capture_data as gcd
+import strength_duration_curve as sdc
+
+
+def lockstep_search(durations, voltage_grid, capture_matrix,
+                    voltage_start: float = 3, coarse_factor: float = 0.75,
+                    fine_factor: float = 0.95, miss_limit: int = 2,
+                    start_increment: float = 1, max_probes: int = 64,
+                    backup_voltage: float = 4.5,
+                    pacing_resistance: float = 1000,
+                    record_probes: bool = False):
+    """Runs the capture threshold search on many records at once
+
+    Advances the search of
+    capture_threshold_detection.find_capture_voltage() for every
+    capture record in lockstep: every iteration delivers the next pulse
+    of all unfinished searches with numpy array operations. The state
+    of every search is kept in arrays (current voltage, step mode, miss
+    counter and last capturing voltage) and finished searches are
+    dropped from the active set. Voltages are snapped to the grid with
+    find_nearest_indices() (same tie rule as find_nearest()) and are
+    stepped with the same float operations as the scalar search, so
+    every search delivers exactly the same pulses and finds the same
+    threshold.
+
+    Summary of the search (default parameters = find_capture_voltage()):
+        - Start at voltage_start
+        - After a capture the voltage is multiplied by coarse_factor,
+                or by fine_factor after the first miss
+        - If the start voltage does not capture, the voltage is
+                increased by start_increment
+        - After a miss the voltage is fine_factor times the last
+                capturing voltage
+        - The search stops after miss_limit misses (or fails after
+                max_probes pulses)
+
+    Args:
+        durations (list or np.array): pulse duration [ms] of every record
+        voltage_grid (list or np.array): stimulus voltages [V] shared by
+                                         every record (ascending)
+        capture_matrix (np.array): 2D array of capture status values
+                                   with one row per record
+        voltage_start (float): start voltage [V]
+        coarse_factor (float): voltage factor after a capture before
+                               the first miss
+        fine_factor (float): voltage factor after the first miss
+        miss_limit (int): misses that end the search
+        start_increment (float): voltage step [V] when the start
+                                 voltage does not capture
+        max_probes (int): a search stops (and fails) after this many
+                          pulses
+        backup_voltage (float): voltage [V] of the backup pulse that
+                                follows every miss
+        pacing_resistance (float): total pacing impedence [ohms]
+        record_probes (bool): also return the grid index of every pulse
+
+    Returns:
+        results (dict): "capture_voltage" (threshold of every record,
+                NaN if the search failed), "probe_count",
+                "backup_count", "search_energy" [J] (probe and backup
+                pulses, as calculate_search_energy()) and, with
+                record_probes, "probe_indices" (2D array with the grid
+                index of every pulse, -1 after the last pulse)
+    """
+    voltage_grid = np.asarray(voltage_grid, dtype=float)
+    capture_matrix = np.asarray(capture_matrix)
+    durations = np.broadcast_to(np.asarray(durations, dtype=float),
+                                (len(capture_matrix),))
+    n_records = len(capture_matrix)
+
+    voltage = np.full(n_records, float(voltage_start))
+    last_capture = np.full(n_records, np.nan)
+    small_step = np.zeros(n_records, dtype=bool)
+    n_miss = np.zeros(n_records, dtype=int)
+    n_probes = np.zeros(n_records, dtype=int)
+    n_backup = np.zeros(n_records, dtype=int)
+    sum_squares = np.zeros(n_records)
+    if record_probes:
+        probe_indices = np.full((n_records, max_probes), -1, dtype=np.int16)
+
+    active = np.arange(n_records)
+    step = 0
+    while len(active) and step < max_probes:
+        idx = gcd.find_nearest_indices(voltage_grid, voltage[active])
+        probe_voltage = voltage_grid[idx]
+        captured = capture_matrix[active, idx] == 1
+        if record_probes:
+            probe_indices[active, step] = idx
+        sum_squares[active] += probe_voltage**2
+
+        hit = active[captured]
+        last_capture[hit] = probe_voltage[captured]
+        voltage[hit] = probe_voltage[captured] * np.where(
+            small_step[hit], fine_factor, coarse_factor)
+        missed = ~captured
+        n_backup[active[missed]] += 1
+        start_miss = missed & np.isnan(last_capture[active])
+        voltage[active[start_miss]] = probe_voltage[start_miss] + \
+            start_increment
+        miss = active[missed & ~start_miss]
+        n_miss[miss] += 1
+        voltage[miss] = last_capture[miss] * fine_factor
+        small_step[miss] = True
+
+        step += 1
+        n_probes[active] = step
+        active = active[n_miss[active] < miss_limit]
+
+    finished = n_miss >= miss_limit
+    search_energy = sdc.calculate_energy(durations, 1.0, pacing_resistance) * \
+        (sum_squares + n_backup * backup_voltage**2)
+    results = {"capture_voltage": np.where(finished, last_capture, np.nan),
+               "probe_count": n_probes,
+               "backup_count": n_backup,
+               "search_energy": search_energy}
+    if record_probes:
+        results["probe_indices"] = probe_indices
+    return results
+
+
+def find_capture_voltage_lockstep(duration_list: list, voltage_list: list,
+                                  capture_list: list,
+                                  probe_trace: list = None):
+    """Finds the capture voltage of one record with lockstep_search()
+
+    Drop-in replacement of
+    capture_threshold_detection.find_capture_voltage() (same arguments
+    and results), used to check the lockstep search against recorded
+    traces (probe_trace_replay.py). Nothing is printed or logged.
+
+    Raises:
+        ValueError: if the search does not finish within max_probes
+                    pulses
+    """
+    results = lockstep_search(duration_list[:1], voltage_list,
+                              [capture_list], record_probes=True)
+    if probe_trace is not None:
+        for idx in results["probe_indices"][0, :results["probe_count"][0]]:
+            probe_trace.append((float(voltage_list[idx]),
+                                int(capture_list[idx])))
+    capture_voltage = results["capture_voltage"][0]
+    if np.isnan(capture_voltage):
+        raise ValueError("The capture threshold search did not finish "
+                         "within {} pulses".format(
+                             results["probe_count"][0]))
+    return duration_list[0], capture_voltage
+
+
+if __name__ == "__main__":
+    import time
+    import fixed_point_search as fps
+
+    rng = np.random.default_rng(0)
+    n_records = 100000
+    durations = rng.choice([0.1, 0.2, 0.3, 0.4, 0.5, 1, 1.5], n_records)
+    voltage_grid, capture_matrix = gcd.generate_capture_records(
+        rng.uniform(0.1, 4.99, n_records))
+    start = time.perf_counter()
+    results = lockstep_search(durations, voltage_grid, capture_matrix)
+    elapsed = time.perf_counter() - start
+    print("{} lockstep searches in {:.3f} s".format(n_records, elapsed))
+
+    start = time.perf_counter()
+    capture_voltages, probe_counts, _ = fps.bulk_search(
+        durations[:10000], voltage_grid, capture_matrix[:10000])
+    print("10000 fixed-point kernel searches in {:.3f} s".format(
+        time.perf_counter() - start))
+    print("Identical thresholds and probe counts: {}".format(
+        np.array_equal(capture_voltages,
+                       results["capture_voltage"][:10000],
+                       equal_nan=True) and
+        np.array_equal(probe_counts, results["probe_count"][:10000])))
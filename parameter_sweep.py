@@ -0,0 +1,378 @@
+# parameter_sweep.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import accuracy_cost_benchmark as acb
+import lockstep_search as ls
+import strength_duration_curve as sdc
+
+
+# Parameters of the threshold search and the output recommendation, with
+# the values used by find_capture_voltage() and
+# patient_strength_duration_data()
+DEFAULT_PARAMETERS = {"voltage_start": 3,
+                      "coarse_factor": 0.75,
+                      "fine_factor": 0.95,
+                      "start_increment": 1,
+                      "miss_limit": 2,
+                      "backup_voltage": 4.5,
+                      "voltage_margin": 2,
+                      "duration_margin": 3}
+# Parameters that change the pulses of a search. Configurations that only
+# differ in the other parameters share the search of every record, and
+# configurations that only differ in miss_limit share every pulse up to
+# the miss that ends the shorter search
+SEARCH_PARAMETERS = ("voltage_start", "coarse_factor", "fine_factor",
+                     "start_increment")
+
+
+def complete_configuration(configuration: dict):
+    """Fills the missing parameters of a configuration with defaults"""
+    unknown = set(configuration) - set(DEFAULT_PARAMETERS)
+    if unknown:
+        raise ValueError("Unknown parameters: {}".format(sorted(unknown)))
+    return {**DEFAULT_PARAMETERS, **configuration}
+
+
+def parameter_grid(**values):
+    """Every combination of the given parameter values
+
+    Example: parameter_grid(miss_limit=[2, 3], voltage_margin=[1.5, 2])
+    gives 4 configurations. Parameters that are not given keep their
+    default value (DEFAULT_PARAMETERS).
+
+    Returns:
+        configurations (list): one complete parameter dictionary per
+                               combination
+    """
+    names = list(values)
+    return [complete_configuration(dict(zip(names, combination)))
+            for combination in itertools.product(*values.values())]
+
+
+def random_configurations(n_configurations: int, seed: int = 0,
+                          **ranges):
+    """Random sample of parameter configurations
+
+    Args:
+        n_configurations (int): number of configurations
+        seed (int): seed of the random number generator
+        ranges: parameter name -> (low, high) tuple, sampled uniformly
+                (as integers if both limits are integers), or a list of
+                values to choose from
+
+    Returns:
+        configurations (list): complete parameter dictionaries
+    """
+    rng = np.random.default_rng(seed)
+    samples = {}
+    for name, values in ranges.items():
+        if isinstance(values, tuple):
+            low, high = values
+            if isinstance(low, int) and isinstance(high, int):
+                samples[name] = rng.integers(low, high + 1,
+                                             n_configurations).tolist()
+            else:
+                samples[name] = rng.uniform(low, high,
+                                            n_configurations).tolist()
+        else:
+            samples[name] = [values[i] for i in rng.integers(
+                len(values), size=n_configurations)]
+    return [complete_configuration({name: sample[i]
+                                    for name, sample in samples.items()})
+            for i in range(n_configurations)]
+
+
+def truncate_searches(probe_indices, voltage_grid, capture_matrix,
+                      miss_limit: int):
+    """Results of the searches with a smaller miss limit
+
+    A search with a miss limit of k delivers the same pulses as a search
+    with a larger miss limit until its k-th miss, so its results can be
+    read from the recorded pulses of the longer search
+    (lockstep_search() with record_probes=True). Misses before the first
+    capture do not count, as in the search.
+
+    Args:
+        probe_indices (np.array): recorded grid indices of the longer
+                                  searches (-1 after the last pulse)
+        voltage_grid (np.array): stimulus voltages [V]
+        capture_matrix (np.array): capture status values (one row per
+                                   record)
+        miss_limit (int): misses that end the shorter search
+
+    Returns:
+        results (dict): "capture_voltage" (NaN if the shorter search did
+                not finish within the recorded pulses), "probe_count",
+                "backup_count" and "sum_squares" (sum of the squared
+                probe voltages) of every record
+    """
+    voltage_grid = np.asarray(voltage_grid, dtype=float)
+    valid = probe_indices >= 0
+    idx = np.where(valid, probe_indices, 0)
+    rows = np.arange(len(probe_indices))[:, np.newaxis]
+    captured = valid & (np.asarray(capture_matrix)[rows, idx] == 1)
+    missed = valid & ~captured
+    captured_before = np.cumsum(captured, axis=1) - captured
+    counted_miss = np.cumsum(missed & (captured_before > 0), axis=1)
+    finished = counted_miss[:, -1] >= miss_limit
+    last = np.where(finished, np.argmax(counted_miss >= miss_limit, axis=1),
+                    np.sum(valid, axis=1) - 1)
+    prefix = np.arange(probe_indices.shape[1])[np.newaxis, :] <= \
+        last[:, np.newaxis]
+    probe_voltage = voltage_grid[idx]
+    last_capture = np.max(np.where(prefix & captured,
+                                   np.arange(probe_indices.shape[1]), -1),
+                          axis=1)
+    return {"capture_voltage": np.where(
+                finished, probe_voltage[rows[:, 0], last_capture], np.nan),
+            "probe_count": np.sum(prefix & valid, axis=1),
+            "backup_count": np.sum(prefix & missed, axis=1),
+            "sum_squares": np.sum(np.where(prefix & valid,
+                                           probe_voltage**2, 0), axis=1)}
+
+
+def run_search_group(search_parameters: dict, miss_limits, voltage_grid,
+                     capture_matrix, max_probes: int = 64):
+    """Runs the searches of every miss limit of one search configuration
+
+    One lockstep_search() with the largest miss limit is run, and the
+    results of the smaller miss limits are read from its pulses
+    (truncate_searches()).
+
+    Args:
+        search_parameters (dict): values of SEARCH_PARAMETERS
+        miss_limits (list): miss limits to evaluate
+        voltage_grid (np.array): stimulus voltages [V]
+        capture_matrix (np.array): capture status values (one row per
+                                   record)
+        max_probes (int): pulses after which a search fails
+
+    Returns:
+        results (dict): miss limit -> results of truncate_searches()
+    """
+    searches = ls.lockstep_search(1.0, voltage_grid, capture_matrix,
+                                  miss_limit=max(miss_limits),
+                                  max_probes=max_probes,
+                                  record_probes=True, **search_parameters)
+    return {miss_limit: truncate_searches(searches["probe_indices"],
+                                          voltage_grid, capture_matrix,
+                                          miss_limit)
+            for miss_limit in miss_limits}
+
+
+def _search_group_task(args):
+    return run_search_group(*args)
+
+
+def cohort_fingerprint(cohort: dict):
+    """Digest of the cohort data that the searches and fits depend on
+
+    Args:
+        cohort (dict): output of accuracy_cost_benchmark.synthetic_cohort()
+
+    Returns:
+        fingerprint (str): SHA-1 digest of the voltage grid, the capture
+                           matrix and the pulse durations
+    """
+    digest = hashlib.sha1()
+    for name in ("voltage_grid", "capture_matrix", "durations",
+                 "record_durations"):
+        values = np.ascontiguousarray(cohort[name])
+        digest.update(str((name, values.dtype.str, values.shape)).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def evaluate_configuration(configuration: dict, searches: dict, fit: dict,
+                           cohort: dict, exact: np.array,
+                           pacing_resistance: float = 1000):
+    """Energy, accuracy and safety of one configuration
+
+    Args:
+        configuration (dict): complete parameter dictionary
+        searches (dict): results of truncate_searches() for its search
+        fit (dict): "rheobase" and "chronaxie" fitted to the thresholds
+        cohort (dict): output of accuracy_cost_benchmark.synthetic_cohort()
+        exact (np.array): exact threshold of every record
+        pacing_resistance (float): total pacing impedence [ohms]
+
+    Returns:
+        row (dict): the configuration and its metrics (see run_sweep())
+    """
+    n_patients = len(cohort["rheobase"])
+    unit_energy = sdc.calculate_energy(cohort["record_durations"], 1.0,
+                                       pacing_resistance)
+    search_energy = unit_energy * (
+        searches["sum_squares"] +
+        searches["backup_count"] * configuration["backup_voltage"]**2)
+    # A backup pulse below the true threshold of its record does not
+    # capture, so the beat after that missed probe is lost
+    lost_backup_beats = searches["backup_count"] * (
+        configuration["backup_voltage"] < cohort["thresholds"])
+
+    output_voltage = configuration["voltage_margin"] * fit["rheobase"]
+    output_duration = configuration["duration_margin"] * fit["chronaxie"]
+    true_threshold = sdc.lapicque_voltage(output_duration,
+                                          cohort["rheobase"],
+                                          cohort["chronaxie"])
+    safety_margin = output_voltage / true_threshold
+    capture = safety_margin >= 1
+    pacing_energy = sdc.calculate_energy(output_duration, output_voltage,
+                                         pacing_resistance)
+
+    thresholds = searches["capture_voltage"]
+    row = dict(configuration)
+    row.update({
+        "threshold_error": float(np.nanmean(np.abs(thresholds - exact) /
+                                            exact)),
+        "failure_rate": float(np.mean(np.isnan(thresholds))),
+        "rheobase_error": float(np.nanmean(
+            np.abs(fit["rheobase"] - cohort["rheobase"]) /
+            cohort["rheobase"])),
+        "chronaxie_error": float(np.nanmean(
+            np.abs(fit["chronaxie"] - cohort["chronaxie"]) /
+            cohort["chronaxie"])),
+        "probes": float(searches["probe_count"].sum() / n_patients),
+        "search_energy": float(search_energy.sum() / n_patients),
+        "lost_backup_beats": float(lost_backup_beats.sum() / n_patients),
+        "pacing_energy": float(np.nanmean(pacing_energy)),
+        "median_safety_margin": float(np.nanmedian(safety_margin)),
+        "min_safety_margin": float(np.nanmin(safety_margin)),
+        "loss_of_capture_rate": float(np.mean(~capture))})
+    return row
+
+
+def run_sweep(cohort: dict, configurations: list, max_workers=None,
+              max_probes: int = 64, pacing_resistance: float = 1000,
+              cache: dict = None):
+    """Evaluates parameter configurations on a synthetic cohort
+
+    Work is shared between configurations: every distinct search
+    (SEARCH_PARAMETERS) is run once for all of its miss limits
+    (run_search_group()), and every search result is fitted once. The
+    backup voltage and the safety margins are applied afterwards. The
+    search groups run in parallel on worker processes.
+
+    Args:
+        cohort (dict): output of accuracy_cost_benchmark.synthetic_cohort()
+        configurations (list): parameter dictionaries (missing
+                               parameters get their default value)
+        max_workers (int or None): number of worker processes. 1 runs
+                                   every search in this process
+        max_probes (int): pulses after which a search fails
+        pacing_resistance (float): total pacing impedence [ohms]
+        cache (dict or None): search and fit results of earlier sweeps,
+                keyed by cohort_fingerprint(), max_probes, search
+                parameters and miss limit. It is updated with the new
+                results
+
+    Returns:
+        rows (list): one dictionary per configuration with its
+                parameters and "threshold_error" (mean relative error of
+                the search thresholds), "failure_rate" (searches without
+                a threshold), "rheobase_error" and "chronaxie_error"
+                (mean relative errors of the fit), "probes" and
+                "search_energy" [J] (per patient, backup pulses
+                included), "pacing_energy" [J] (mean energy of one
+                pulse of the recommended output), "lost_backup_beats"
+                (per patient, missed probes whose backup pulse is below
+                the true threshold of the record), "median_safety_margin"
+                and "min_safety_margin" (recommended voltage / true
+                threshold at the recommended duration),
+                "loss_of_capture_rate" (patients whose recommended
+                output does not capture, or without a recommendation)
+                and "pareto" (on the frontier of search energy, pacing
+                energy, threshold error, lost backup beats and loss of
+                capture rate)
+    """
+    if cache is None:
+        cache = {}
+    configurations = [complete_configuration(configuration)
+                      for configuration in configurations]
+    n_patients = len(cohort["rheobase"])
+    n_durations = len(cohort["durations"])
+    exact = acb.exact_thresholds(cohort["voltage_grid"],
+                                 cohort["capture_matrix"])
+
+    fingerprint = cohort_fingerprint(cohort)
+
+    def search_key(configuration):
+        return tuple(configuration[name] for name in SEARCH_PARAMETERS)
+
+    def cache_key(key, miss_limit):
+        return (fingerprint, max_probes, key, miss_limit)
+
+    groups = {}
+    for configuration in configurations:
+        key = search_key(configuration)
+        if cache_key(key, configuration["miss_limit"]) not in cache:
+            groups.setdefault(key, set()).add(configuration["miss_limit"])
+    tasks = [(dict(zip(SEARCH_PARAMETERS, key)), sorted(miss_limits),
+              cohort["voltage_grid"], cohort["capture_matrix"], max_probes)
+             for key, miss_limits in groups.items()]
+    if max_workers == 1:
+        group_results = map(_search_group_task, tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        group_results = executor.map(_search_group_task, tasks)
+    try:
+        for key, results in zip(groups, group_results):
+            for miss_limit, searches in results.items():
+                rheobase, chronaxie = sdc.lapicque_batch_fit(
+                    *sdc.cohort_arrays(
+                        np.broadcast_to(cohort["durations"],
+                                        (n_patients, n_durations)),
+                        searches["capture_voltage"].reshape(n_patients,
+                                                            n_durations)))
+                cache[cache_key(key, miss_limit)] = (
+                    searches, {"rheobase": rheobase, "chronaxie": chronaxie})
+    finally:
+        if max_workers != 1:
+            executor.shutdown()
+
+    rows = []
+    for configuration in configurations:
+        searches, fit = cache[cache_key(search_key(configuration),
+                                        configuration["miss_limit"])]
+        rows.append(evaluate_configuration(configuration, searches, fit,
+                                           cohort, exact, pacing_resistance))
+    front = acb.pareto_front([[row["search_energy"], row["pacing_energy"],
+                               row["threshold_error"],
+                               row["lost_backup_beats"],
+                               row["loss_of_capture_rate"]] for row in rows])
+    for row, pareto in zip(rows, front):
+        row["pareto"] = bool(pareto)
+    return rows
+
+
+if __name__ == "__main__":
+    import time
+
+    cohort = acb.synthetic_cohort(2000)
+    configurations = parameter_grid(voltage_start=[2, 3, 4],
+                                    coarse_factor=[0.5, 0.75],
+                                    fine_factor=[0.9, 0.95, 0.98],
+                                    miss_limit=[1, 2, 3],
+                                    backup_voltage=[3.5, 4.5],
+                                    voltage_margin=[1.5, 2, 2.5],
+                                    duration_margin=[1, 3])
+    start = time.perf_counter()
+    rows = run_sweep(cohort, configurations)
+    print("{} configurations, {} searches per configuration, in {:.2f} \
+s".format(len(rows), len(cohort["record_durations"]),
+          time.perf_counter() - start))
+    for row in sorted((row for row in rows if row["pareto"]),
+                      key=lambda row: row["search_energy"])[:20]:
+        print(("start {voltage_start} V, x{coarse_factor}/x{fine_factor}, "
+               "{miss_limit} misses, backup {backup_voltage} V, "
+               "{voltage_margin}x rheobase at {duration_margin}x chronaxie: "
+               "search {search_energy:.2e} J, pacing {pacing_energy:.2e} J, "
+               "threshold error {threshold_error:.2%}, lost backup beats "
+               "{lost_backup_beats:.2f}, loss of capture "
+               "{loss_of_capture_rate:.2%}").format(**row))
@@ -0,0 +1,276 @@
+# probe_trace_replay.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import contextlib
+import logging
+import os
+import time
+import numpy as np
+import capture_threshold_detection as ctd
+import generate_capture_data as gcd
+
+
+# A trace set stores the capture records and the full probe sequence of
+# a threshold search for every record as a dictionary of numpy arrays:
+#     "voltage_grid": stimulus voltages [V] shared by every record
+#     "durations": pulse duration [ms] of every record
+#     "capture_bits": capture status of every record (np.packbits)
+#     "probe_offsets": probes of record i are probe_offsets[i] to
+#                      probe_offsets[i + 1] of the probe arrays
+#     "probe_indices": index in voltage_grid of every probe voltage
+#     "probe_captures": capture status of every probe
+#     "capture_voltage": threshold found by the search of every record
+#                        (NaN if the search did not finish within
+#                        max_probes pulses)
+#     "search_energy": energy [J] of the probe and backup pulses
+#     "backup_voltage": voltage [V] of the backup pulse
+#     "pacing_resistance": total pacing impedence [ohms]
+# The number of backup pulses of a search is the number of probes that
+# did not capture.
+
+
+class ProbeLimitExceeded(RuntimeError):
+    """Raised when a search uses more pulses than its probe limit"""
+
+
+class BoundedProbeTrace(list):
+    """Probe trace that stops a search after max_probes pulses
+
+    Every search appends one pulse to its probe_trace per pulse, so
+    raising from append() stops a search that would never finish (for
+    example find_capture_voltage() on a threshold below about 0.1 V,
+    where the x0.95 step snaps back to the same grid value).
+    """
+
+    def __init__(self, max_probes: int):
+        super().__init__()
+        self.max_probes = max_probes
+
+    def append(self, probe):
+        if len(self) >= self.max_probes:
+            raise ProbeLimitExceeded("search did not finish within {} "
+                                     "pulses".format(self.max_probes))
+        super().append(probe)
+
+
+@contextlib.contextmanager
+def quiet_search():
+    """Silences the print and logging output of a threshold search"""
+    logging.disable(logging.CRITICAL)
+    try:
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def run_traced_search(search_function, duration: float, voltage_list: list,
+                      capture_list: list, max_probes: int = 100):
+    """Runs a threshold search and records every stimulus pulse
+
+    Args:
+        search_function (function): threshold search with the same
+                arguments as capture_threshold_detection
+                .find_capture_voltage() (including probe_trace)
+        duration (float): pulse duration [ms] of the capture record
+        voltage_list (list): stimulus voltages [V] of the record
+        capture_list (list): capture status values of the record
+        max_probes (int): the search is stopped after this many pulses
+
+    Returns:
+        probe_trace (list): (voltage, capture status) of every pulse
+        capture_voltage (float): threshold found by the search (NaN if
+                                 it was stopped after max_probes pulses)
+    """
+    probe_trace = BoundedProbeTrace(max_probes)
+    try:
+        _, capture_voltage = search_function(
+            [duration] * len(voltage_list), voltage_list, capture_list,
+            probe_trace=probe_trace)
+    except ProbeLimitExceeded:
+        capture_voltage = np.nan
+    return list(probe_trace), float(capture_voltage)
+
+
+def record_trace_set(durations, voltage_grid, capture_matrix,
+                     search_function=ctd.find_capture_voltage,
+                     backup_voltage: float = 4.5,
+                     pacing_resistance: float = 1000,
+                     max_probes: int = 100):
+    """Records the probe sequence of a search for many capture records
+
+    Args:
+        durations (list or np.array): pulse duration [ms] of every record
+        voltage_grid (list or np.array): stimulus voltages [V] shared by
+                                         every record
+        capture_matrix (np.array): 2D array of capture status values
+                                   with one row per record
+        search_function (function): threshold search to record
+        backup_voltage (float): voltage [V] of the backup pulse
+        pacing_resistance (float): total pacing impedence [ohms]
+        max_probes (int): searches are stopped after this many pulses
+                          and recorded as failed (NaN threshold)
+
+    Returns:
+        trace_set (dict): recorded traces (see the top of this module)
+    """
+    durations = np.asarray(durations, dtype=float)
+    voltage_grid = np.asarray(voltage_grid, dtype=float)
+    capture_matrix = np.asarray(capture_matrix)
+    voltage_list = voltage_grid.tolist()
+    probe_offsets = [0]
+    probe_voltages = []
+    probe_captures = []
+    capture_voltages = []
+    search_energies = []
+    with quiet_search():
+        for duration, capture_record in zip(durations, capture_matrix):
+            probe_trace, capture_voltage = run_traced_search(
+                search_function, float(duration), voltage_list,
+                capture_record.tolist(), max_probes)
+            voltages = [probe[0] for probe in probe_trace]
+            captures = [probe[1] for probe in probe_trace]
+            probe_voltages.extend(voltages)
+            probe_captures.extend(captures)
+            probe_offsets.append(len(probe_voltages))
+            capture_voltages.append(capture_voltage)
+            search_energies.append(ctd.calculate_search_energy(
+                duration, voltages, captures, backup_voltage,
+                pacing_resistance))
+    probe_indices = gcd.find_nearest_indices(voltage_grid, probe_voltages)
+    if not np.array_equal(voltage_grid[probe_indices], probe_voltages):
+        raise ValueError("Every probe voltage must be on the voltage grid")
+    return {
+        "voltage_grid": voltage_grid,
+        "durations": durations,
+        "capture_bits": np.packbits(capture_matrix.astype(bool), axis=1),
+        "probe_offsets": np.array(probe_offsets, dtype=np.int64),
+        "probe_indices": probe_indices.astype(np.uint16),
+        "probe_captures": np.array(probe_captures, dtype=np.int8),
+        "capture_voltage": np.array(capture_voltages),
+        "search_energy": np.array(search_energies),
+        "backup_voltage": np.array(backup_voltage),
+        "pacing_resistance": np.array(pacing_resistance)}
+
+
+def save_trace_set(filename: str, trace_set: dict):
+    """Saves a trace set to a compressed .npz file"""
+    np.savez_compressed(filename, **trace_set)
+
+
+def load_trace_set(filename: str):
+    """Loads a trace set saved with save_trace_set()"""
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
+
+
+def capture_matrix_of(trace_set: dict):
+    """Unpacks the capture records of a trace set
+
+    Returns:
+        capture_matrix (np.array): 2D int8 array of capture status
+                                   values with one row per record
+    """
+    n_voltages = len(trace_set["voltage_grid"])
+    capture_matrix = np.unpackbits(trace_set["capture_bits"], axis=1)
+    return capture_matrix[:, :n_voltages].astype(np.int8)
+
+
+def trace_probes(trace_set: dict, trace_idx: int):
+    """Returns the recorded (voltage, capture status) pulses of a trace"""
+    start, stop = trace_set["probe_offsets"][trace_idx:trace_idx + 2]
+    voltages = trace_set["voltage_grid"][trace_set["probe_indices"]
+                                         [start:stop]]
+    captures = trace_set["probe_captures"][start:stop]
+    return list(zip(voltages.tolist(), captures.tolist()))
+
+
+def replay_trace_set(trace_set: dict, search_function,
+                     energy_tolerance: float = 1e-15,
+                     max_probes: int = 100):
+    """Checks a search implementation against a recorded trace set
+
+    The search is run on the capture record of every trace and its
+    probe count, search energy and chosen threshold are compared with
+    the recorded values. No data files are read or generated.
+
+    Args:
+        trace_set (dict): trace set from record_trace_set() or
+                          load_trace_set()
+        search_function (function): threshold search with the same
+                arguments as capture_threshold_detection
+                .find_capture_voltage() (including probe_trace)
+        energy_tolerance (float): largest search energy difference [J]
+                                  that is not reported as a change
+        max_probes (int): replayed searches are stopped after this many
+                          pulses and counted as failed
+
+    Returns:
+        report (dict): "n_traces", "n_changed", "n_failed" (replayed
+                searches that did not finish), "elapsed" [s] and
+                "changes", a list with one dictionary per changed trace
+                containing the trace index and the (recorded, replayed)
+                values of "probe_count", "search_energy" and
+                "capture_voltage"
+    """
+    start_time = time.perf_counter()
+    voltage_list = trace_set["voltage_grid"].tolist()
+    capture_matrix = capture_matrix_of(trace_set)
+    probe_counts = np.diff(trace_set["probe_offsets"])
+    backup_voltage = float(trace_set["backup_voltage"])
+    pacing_resistance = float(trace_set["pacing_resistance"])
+    changes = []
+    n_failed = 0
+    with quiet_search():
+        for i, (duration, capture_record) in enumerate(
+                zip(trace_set["durations"].tolist(), capture_matrix)):
+            probe_trace, capture_voltage = run_traced_search(
+                search_function, duration, voltage_list,
+                capture_record.tolist(), max_probes)
+            if np.isnan(capture_voltage):
+                n_failed += 1
+            search_energy = ctd.calculate_search_energy(
+                duration, [probe[0] for probe in probe_trace],
+                [probe[1] for probe in probe_trace], backup_voltage,
+                pacing_resistance)
+            recorded_energy = float(trace_set["search_energy"][i])
+            recorded_voltage = float(trace_set["capture_voltage"][i])
+            if len(probe_trace) != probe_counts[i] or \
+                    abs(search_energy - recorded_energy) > \
+                    energy_tolerance or \
+                    not (capture_voltage == recorded_voltage or
+                         np.isnan(capture_voltage) and
+                         np.isnan(recorded_voltage)):
+                changes.append({
+                    "trace": i,
+                    "probe_count": (int(probe_counts[i]), len(probe_trace)),
+                    "search_energy": (recorded_energy, search_energy),
+                    "capture_voltage": (recorded_voltage, capture_voltage)})
+    return {"n_traces": len(probe_counts),
+            "n_changed": len(changes),
+            "n_failed": n_failed,
+            "elapsed": time.perf_counter() - start_time,
+            "changes": changes}
+
+
+if __name__ == "__main__":
+    # Record the reference search on 5000 synthetic capture records
+    rng = np.random.default_rng(0)
+    n_records = 5000
+    durations = rng.choice([0.1, 0.2, 0.3, 0.4, 0.5, 1, 1.5], n_records)
+    voltage_grid, capture_matrix = gcd.generate_capture_records(
+        rng.uniform(0.3, 4.9, n_records))
+    trace_set = record_trace_set(durations, voltage_grid, capture_matrix)
+    save_trace_set("reference_traces.npz", trace_set)
+    print("Recorded {} traces ({} bytes)".format(
+        n_records, os.path.getsize("reference_traces.npz")))
+
+    # Replay the recorded traces against the current search
+    report = replay_trace_set(load_trace_set("reference_traces.npz"),
+                              ctd.find_capture_voltage)
+    print("Replayed {} traces in {:.2f} s: {} changed".format(
+        report["n_traces"], report["elapsed"], report["n_changed"]))
+    os.remove("reference_traces.npz")
@@ -136,6 +136,336 @@ def calculate_energy(pulse_duration,
     return energy
 
 
+# Strength-duration model registry
+#
+# Every model describes the threshold voltage as a function of pulse
+# duration with two parameters (rheobase and chronaxie) so that the
+# fitted values of different models can be compared directly. Models
+# are stored in STRENGTH_DURATION_MODELS with the following keys:
+#     "voltage": function(duration, rheobase, chronaxie) -> voltage
+#     "batch_fit": function(durations, voltages, mask) -> (rheobase,
+#                  chronaxie) arrays with one value per patient
+#     "minimum_energy_duration": function(rheobase, chronaxie) ->
+#                  pulse duration of minimum pacing energy
+#     "n_params": number of fitted parameters
+#     "error_weight": function(duration) -> w, the model assumes that
+#                  w * (voltage residual) has the same normal
+#                  distribution at every duration (None means w = 1,
+#                  constant voltage error)
+
+STRENGTH_DURATION_MODELS = {}
+
+
+def register_strength_duration_model(name: str, voltage_function,
+                                     batch_fitter,
+                                     minimum_energy_duration,
+                                     n_params: int = 2,
+                                     error_weight=None):
+    """Adds a strength-duration model to STRENGTH_DURATION_MODELS
+
+    Args:
+        name (str): name of the model
+        voltage_function (function): threshold voltage [V] as a function
+                of (duration [ms], rheobase [V], chronaxie [ms])
+        batch_fitter (function): takes durations, voltages and a mask
+                (2D arrays, one row per patient) and returns the
+                rheobase and chronaxie of every patient
+        minimum_energy_duration (function): pulse duration [ms] of
+                minimum pacing energy as a function of
+                (rheobase, chronaxie)
+        n_params (int): number of fitted parameters (used by AIC/BIC)
+        error_weight (function or None): weight w(duration) of the
+                error model (see above). None for a constant voltage
+                error
+    """
+    STRENGTH_DURATION_MODELS[name] = {
+        "voltage": voltage_function,
+        "batch_fit": batch_fitter,
+        "minimum_energy_duration": minimum_energy_duration,
+        "n_params": n_params,
+        "error_weight": error_weight}
+
+
+def cohort_arrays(pulse_duration_experimental, voltage_amp_experimental):
+    """Converts strength-duration data into 2D cohort arrays
+
+    A single patient can be entered as two lists. A cohort is entered
+    as 2D arrays with one row per patient. Patients with fewer data
+    points are padded with NaN values, which are masked out.
+
+    Args:
+        pulse_duration_experimental (list or np.array): pulse durations
+        voltage_amp_experimental (list or np.array): capture voltages
+
+    Returns:
+        durations (np.array): 2D array of pulse durations [ms]
+        voltages (np.array): 2D array of capture voltages [V]
+        mask (np.array): 2D boolean array, True for valid data points
+    """
+    durations = np.atleast_2d(np.asarray(pulse_duration_experimental,
+                                         dtype=float))
+    voltages = np.atleast_2d(np.asarray(voltage_amp_experimental,
+                                        dtype=float))
+    if durations.shape != voltages.shape:
+        raise ValueError("duration and voltage data must have the same "
+                         "shape")
+    mask = ~(np.isnan(durations) | np.isnan(voltages))
+    durations = np.where(mask, durations, 1.0)
+    voltages = np.where(mask, voltages, 0.0)
+    return durations, voltages, mask
+
+
+def batch_linear_fit(x1, x2, y, mask):
+    """Least squares fit of y = a*x1 + b*x2 for every row at once
+
+    Args:
+        x1, x2 (np.array): 2D arrays of the two basis functions
+        y (np.array): 2D array of the data to fit
+        mask (np.array): 2D boolean array, True for valid data points
+
+    Returns:
+        a (np.array): first coefficient of every row
+        b (np.array): second coefficient of every row
+    """
+    w = mask.astype(float)
+    s11 = np.sum(w * x1 * x1, axis=1)
+    s12 = np.sum(w * x1 * x2, axis=1)
+    s22 = np.sum(w * x2 * x2, axis=1)
+    s1y = np.sum(w * x1 * y, axis=1)
+    s2y = np.sum(w * x2 * y, axis=1)
+    determinant = s11 * s22 - s12**2
+    a = (s22 * s1y - s12 * s2y) / determinant
+    b = (s11 * s2y - s12 * s1y) / determinant
+    return a, b
+
+
+def lapicque_voltage(duration, rheobase, chronaxie):
+    """Hyperbolic strength-duration curve V = Vr * (1 + t_c/t)"""
+    return rheobase * (1 + chronaxie / duration)
+
+
+def lapicque_batch_fit(durations, voltages, mask):
+    """Fits V = Vr * (1 + t_c/t) to every patient at once
+
+    V = Vr + (Vr * t_c) / t is linear in 1/t, so the least squares fit
+    in voltage has a closed form solution (the same optimum that
+    strength_duration_trend_line() finds with scipy.optimize).
+    """
+    rheobase, slope = batch_linear_fit(np.ones_like(durations),
+                                       1 / durations, voltages, mask)
+    return rheobase, slope / rheobase
+
+
+def weiss_batch_fit(durations, voltages, mask):
+    """Fits the Weiss linear charge law Q = V*t = Vr * (t + t_c)
+
+    The Weiss law gives the same hyperbolic voltage curve as
+    lapicque_voltage(), but the measurement error is assumed to be in
+    the stimulus charge instead of the voltage, so the straight line is
+    fitted to the charge. Long pulse durations get more weight, so the
+    fitted rheobase and chronaxie differ. The model is registered with
+    error_weight = t so that AIC/BIC use the same charge error model.
+    """
+    rheobase, intercept = batch_linear_fit(durations,
+                                           np.ones_like(durations),
+                                           voltages * durations, mask)
+    return rheobase, intercept / rheobase
+
+
+def charge_error_weight(duration):
+    """Error weight of a model with a constant charge (V*t) error"""
+    return duration
+
+
+def exponential_voltage(duration, rheobase, chronaxie):
+    """Exponential (Blair) curve V = Vr / (1 - exp(-t*ln(2)/t_c))
+
+    The membrane time constant is t_c / ln(2), which makes the
+    threshold at the chronaxie exactly twice the rheobase.
+    """
+    return rheobase / -np.expm1(-duration * np.log(2) / chronaxie)
+
+
+def exponential_batch_fit(durations, voltages, mask):
+    """Fits the exponential (Blair) model to every patient at once
+
+    For a fixed chronaxie the optimal rheobase has a closed form, so
+    only the chronaxie is searched. A coarse log-spaced grid brackets
+    the optimum of every patient and a golden-section search refines
+    all patients simultaneously.
+    """
+    w = mask.astype(float)
+
+    def profile(chronaxie):
+        g = 1 / -np.expm1(-durations * np.log(2) / chronaxie[:, np.newaxis])
+        rheobase = np.sum(w * voltages * g, axis=1) / np.sum(w * g * g,
+                                                             axis=1)
+        residual = voltages - rheobase[:, np.newaxis] * g
+        return rheobase, np.sum(w * residual**2, axis=1)
+
+    n_patients = durations.shape[0]
+    log_grid = np.linspace(np.log(0.01), np.log(20), 32)
+    rss_grid = np.array([profile(np.full(n_patients, np.exp(x)))[1]
+                         for x in log_grid])
+    best = np.argmin(rss_grid, axis=0)
+    low = log_grid[np.maximum(best - 1, 0)]
+    high = log_grid[np.minimum(best + 1, len(log_grid) - 1)]
+    ratio = (np.sqrt(5) - 1) / 2
+    x1 = high - ratio * (high - low)
+    x2 = low + ratio * (high - low)
+    rss1 = profile(np.exp(x1))[1]
+    rss2 = profile(np.exp(x2))[1]
+    for i in range(30):
+        move_low = rss1 > rss2
+        low = np.where(move_low, x1, low)
+        high = np.where(move_low, high, x2)
+        x_new = np.where(move_low, low + ratio * (high - low),
+                         high - ratio * (high - low))
+        rss_new = profile(np.exp(x_new))[1]
+        x1, x2 = np.where(move_low, x2, x_new), np.where(move_low, x_new, x1)
+        rss1, rss2 = (np.where(move_low, rss2, rss_new),
+                      np.where(move_low, rss_new, rss1))
+    chronaxie = np.exp((low + high) / 2)
+    rheobase, _ = profile(chronaxie)
+    return rheobase, chronaxie
+
+
+def hyperbolic_minimum_energy_duration(rheobase, chronaxie):
+    """E = V^2*t/R with V = Vr*(1 + t_c/t) is minimum at t = t_c"""
+    return chronaxie
+
+
+def exponential_minimum_energy_duration(rheobase, chronaxie):
+    """Minimum energy duration of the exponential model
+
+    With x = t*ln(2)/t_c the energy is proportional to
+    x / (1 - exp(-x))^2, which is minimum where exp(x) - 1 = 2x.
+    """
+    x = so.brentq(lambda x: np.expm1(x) - 2 * x, 0.5, 3)
+    return x * np.asarray(chronaxie) / np.log(2)
+
+
+register_strength_duration_model("lapicque", lapicque_voltage,
+                                 lapicque_batch_fit,
+                                 hyperbolic_minimum_energy_duration)
+register_strength_duration_model("weiss", lapicque_voltage,
+                                 weiss_batch_fit,
+                                 hyperbolic_minimum_energy_duration,
+                                 error_weight=charge_error_weight)
+register_strength_duration_model("exponential", exponential_voltage,
+                                 exponential_batch_fit,
+                                 exponential_minimum_energy_duration)
+
+
+def fit_strength_duration_models(pulse_duration_experimental,
+                                 voltage_amp_experimental,
+                                 model_names=None,
+                                 pacing_resistance=1000):
+    """Fits strength-duration models to a whole cohort in one pass
+
+    Every model is fitted to every patient with its vectorized batch
+    fitter. The Akaike (AIC) and Bayesian (BIC) information criteria
+    are calculated from the likelihood of the measured voltages under
+    the error model of each model (error weight w, see
+    register_strength_duration_model()), so models with different
+    error models can be compared:
+
+        -2 ln(L) = n * ln(RSS_w/n) - 2 * sum(ln(w)) + constant
+        RSS_w = sum((w * (V - V_fit))^2)
+        AIC = -2 ln(L) + 2k
+        BIC = -2 ln(L) + k * ln(n)
+
+    For a constant voltage error (w = 1) this is n * ln(RSS/n). The
+    reported "rss" is always the unweighted voltage RSS.
+
+    The analytic minimum energy point of every fitted curve is also
+    calculated.
+
+    Args:
+        pulse_duration_experimental (list or np.array): pulse durations
+                [ms] of one patient, or a 2D array (one row per
+                patient, padded with NaN)
+        voltage_amp_experimental (list or np.array): capture voltages
+                [V] with the same shape as pulse_duration_experimental
+        model_names (list or None): models of STRENGTH_DURATION_MODELS
+                to fit. Defaults to every registered model
+        pacing_resistance (float or int): total pacing impedence [ohms]
+
+    Returns:
+        fits (dict): for every model name a dictionary of arrays (one
+                value per patient) with the keys "rheobase",
+                "chronaxie", "rss", "aic", "bic",
+                "min_energy_duration", "min_energy_voltage" and
+                "min_energy"
+    """
+    durations, voltages, mask = cohort_arrays(pulse_duration_experimental,
+                                              voltage_amp_experimental)
+    if model_names is None:
+        model_names = list(STRENGTH_DURATION_MODELS)
+    n_points = mask.sum(axis=1)
+    fits = {}
+    for name in model_names:
+        model = STRENGTH_DURATION_MODELS[name]
+        rheobase, chronaxie = model["batch_fit"](durations, voltages, mask)
+        fitted = model["voltage"](durations, rheobase[:, np.newaxis],
+                                  chronaxie[:, np.newaxis])
+        rss = np.sum(np.where(mask, voltages - fitted, 0)**2, axis=1)
+        if model["error_weight"] is None:
+            weight = np.ones_like(durations)
+        else:
+            weight = model["error_weight"](durations)
+        weighted_rss = np.sum(np.where(mask, weight * (voltages - fitted),
+                                       0)**2, axis=1)
+        log_likelihood_term = \
+            n_points * np.log(np.maximum(weighted_rss, 1e-12) / n_points) - \
+            2 * np.sum(np.where(mask, np.log(weight), 0), axis=1)
+        k = model["n_params"]
+        min_energy_duration = model["minimum_energy_duration"](rheobase,
+                                                               chronaxie)
+        min_energy_voltage = model["voltage"](min_energy_duration,
+                                              rheobase, chronaxie)
+        fits[name] = {
+            "rheobase": rheobase,
+            "chronaxie": chronaxie,
+            "rss": rss,
+            "aic": log_likelihood_term + 2 * k,
+            "bic": log_likelihood_term + k * np.log(n_points),
+            "min_energy_duration": min_energy_duration,
+            "min_energy_voltage": min_energy_voltage,
+            "min_energy": calculate_energy(min_energy_duration,
+                                           min_energy_voltage,
+                                           pacing_resistance)}
+    return fits
+
+
+def select_strength_duration_model(fits: dict, criterion: str = "bic"):
+    """Chooses the best strength-duration model of every patient
+
+    Args:
+        fits (dict): output of fit_strength_duration_models()
+        criterion (str): "aic" or "bic" (lowest value wins)
+
+    Returns:
+        best_model (np.array): name of the best model of every patient
+        best_fit (dict): the values of fits for the best model of every
+                         patient (same keys as fits[model_name])
+    """
+    if criterion not in ("aic", "bic"):
+        raise ValueError("criterion must be 'aic' or 'bic'")
+    model_names = list(fits)
+    scores = np.array([fits[name][criterion] for name in model_names])
+    best_idx = np.argmin(scores, axis=0)
+    best_model = np.array(model_names)[best_idx]
+    patients = np.arange(len(best_idx))
+    best_fit = {}
+    for key in fits[model_names[0]]:
+        values = np.array([np.broadcast_to(fits[name][key],
+                                           best_idx.shape)
+                           for name in model_names])
+        best_fit[key] = values[best_idx, patients]
+    return best_model, best_fit
+
+
 def plot_strength_duration_curve(pulse_duration_experimental,
                                  voltage_amp_experimental,
                                  pulse_duration_interp,
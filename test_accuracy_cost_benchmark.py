@@ -0,0 +1,89 @@
+# test_accuracy_cost_benchmark.py
+# Used to test the accuracy_cost_benchmark.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+def test_exact_thresholds():
+    import numpy as np
+    from accuracy_cost_benchmark import exact_thresholds
+    from generate_capture_data import generate_capture_records
+    capture_voltages = np.round(np.arange(0, 5, 0.01), 2)
+    voltage_grid, capture_matrix = generate_capture_records(
+        capture_voltages)
+    assert np.array_equal(exact_thresholds(voltage_grid, capture_matrix),
+                          capture_voltages)
+    capture_matrix[3] = 0
+    capture_matrix[4, 100] = 1
+    thresholds = exact_thresholds(voltage_grid, capture_matrix)
+    assert np.isnan(thresholds[3])
+    assert thresholds[4] == 0.04
+
+
+@pytest.mark.parametrize("costs, expected", [
+    ([[1, 1], [2, 2]], [True, False]),
+    ([[1, 2], [2, 1]], [True, True]),
+    ([[1, 2], [1, 2], [1, 3]], [True, True, False])])
+def test_pareto_front(costs, expected):
+    from accuracy_cost_benchmark import pareto_front
+    assert pareto_front(costs).tolist() == expected
+
+
+def test_run_benchmark():
+    import numpy as np
+    from accuracy_cost_benchmark import (bayesian_search, reference_search,
+                                         run_benchmark, synthetic_cohort)
+    cohort = synthetic_cohort(3, seed=1)
+    rows = run_benchmark(cohort, {"reference": reference_search,
+                                  "bayesian": bayesian_search(0.25)})
+    assert len(rows) == 2 * 4
+    assert [row["fit"] for row in rows[:4]] == ["lapicque", "weiss",
+                                                "exponential", "bic"]
+    assert any(row["pareto"] for row in rows)
+    assert any(row["curve_pareto"] for row in rows)
+    # The threshold error frontier only depends on the search: every fit
+    # of a search has the same threshold error, probes and energy
+    for i in range(0, 8, 4):
+        assert len({row["pareto"] for row in rows[i:i + 4]}) == 1
+    reference = rows[0]
+    assert reference["failure_rate"] == 0
+    # find_capture_voltage() stops within 5% above the threshold
+    assert 0 <= reference["threshold_error"] < 0.06
+    assert reference["probes"] > 7
+    bic = rows[3]["curve_error"]
+    assert bic <= max(row["curve_error"] for row in rows[:3])
+    assert np.isfinite([row["search_energy"] for row in rows]).all()
+
+
+def test_synthetic_cohort_thresholds_are_on_the_grid():
+    import numpy as np
+    from accuracy_cost_benchmark import exact_thresholds, synthetic_cohort
+    cohort = synthetic_cohort(2000, seed=2)
+    assert len(cohort["rheobase"]) == 2000
+    thresholds = cohort["thresholds"]
+    assert np.all((thresholds >= 0.1) & (thresholds <= 4.99))
+    # The exact threshold is the true threshold snapped to the 0.01 V grid
+    exact = exact_thresholds(cohort["voltage_grid"],
+                             cohort["capture_matrix"])
+    assert np.all(np.abs(exact - thresholds) <= 0.005 + 1e-9)
+
+
+def test_bayesian_search_energy():
+    from accuracy_cost_benchmark import bayesian_search, synthetic_cohort
+    from capture_threshold_detection import calculate_search_energy
+    from adaptive_threshold_estimation import batch_bayesian_threshold_search
+    cohort = synthetic_cohort(2, seed=3)
+    thresholds, probe_counts, search_energies = bayesian_search(0.25)(
+        cohort["record_durations"], cohort["voltage_grid"],
+        cohort["capture_matrix"])
+    results = batch_bayesian_threshold_search(
+        cohort["capture_matrix"], tolerance=0.25,
+        voltage_grid=cohort["voltage_grid"])
+    for i, duration in enumerate(cohort["record_durations"]):
+        n_probes = probe_counts[i]
+        assert search_energies[i] == pytest.approx(calculate_search_energy(
+            duration, results["probe_voltages"][i, :n_probes],
+            results["capture_results"][i, :n_probes]), rel=1e-12)
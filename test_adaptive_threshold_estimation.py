@@ -0,0 +1,92 @@
+# test_adaptive_threshold_estimation.py
+# Used to test the adaptive_threshold_estimation.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+@pytest.mark.parametrize("voltage, expected", [
+    (2.2, 0.5),
+    (5.0, 1.0),
+    (0.0, 0.0)])
+def test_capture_probability(voltage, expected):
+    from generate_capture_data import capture_probability
+    answer = capture_probability(voltage, 2.2, 0.05)
+    assert answer == pytest.approx(expected, abs=1e-6)
+
+
+@pytest.mark.parametrize("capture_voltage", [0.92, 2.2, 3.61])
+def test_bayesian_threshold_search_stochastic(capture_voltage):
+    from generate_capture_data import stochastic_capture_oracle
+    from adaptive_threshold_estimation import bayesian_threshold_search
+    capture_function = stochastic_capture_oracle(capture_voltage, 0.05,
+                                                 seed=3)
+    answer, interval, probe_voltages, capture_results = \
+        bayesian_threshold_search(capture_function, tolerance=0.1)
+    assert answer == pytest.approx(capture_voltage, abs=0.1)
+    assert interval[1] - interval[0] <= 0.1
+    assert len(probe_voltages) == len(capture_results) <= 30
+
+
+def test_bayesian_threshold_search_data_file():
+    from import_capture_data import import_parse_convert_data
+    from adaptive_threshold_estimation import (bayesian_threshold_search,
+                                               data_capture_function)
+    _, voltage_list, capture_list = import_parse_convert_data(
+        "patient2_1ms.csv")
+    capture_function = data_capture_function(voltage_list, capture_list)
+    answer, interval, probe_voltages, _ = bayesian_threshold_search(
+        capture_function, spread=0.01, tolerance=0.05)
+    assert answer == pytest.approx(1.15, abs=0.05)
+    assert len(probe_voltages) < 15
+
+
+def test_bayesian_threshold_search_caps_probes_at_backup_voltage():
+    from generate_capture_data import stochastic_capture_oracle
+    from adaptive_threshold_estimation import bayesian_threshold_search
+    capture_function = stochastic_capture_oracle(4.9, 0.05, seed=0)
+    _, _, probe_voltages, _ = bayesian_threshold_search(
+        capture_function, max_probes=10)
+    assert max(probe_voltages) <= 4.5
+
+
+def test_generate_capture_records_stochastic_top_voltage_captures():
+    from generate_capture_data import generate_capture_records
+    _, capture_matrix = generate_capture_records([4.9] * 200, spread=0.05,
+                                                 seed=0)
+    assert capture_matrix[:, -1].all()
+
+
+def test_batch_search_matches_scalar_search():
+    import logging
+    import numpy as np
+    from adaptive_threshold_estimation import (
+        batch_bayesian_threshold_search, bayesian_threshold_search)
+    from generate_capture_data import generate_capture_records
+    voltage_grid, capture_matrix = generate_capture_records(
+        [0.35, 1.27, 2.2, 3.9, 4.8], spread=0.05, seed=3)
+    results = batch_bayesian_threshold_search(capture_matrix, tolerance=0.1,
+                                              voltage_grid=voltage_grid)
+    voltage_index = {voltage: idx for idx, voltage in
+                     enumerate(voltage_grid.tolist())}
+    logging.disable(logging.CRITICAL)
+    try:
+        for i, record in enumerate(capture_matrix.tolist()):
+            capture_voltage, interval, probe_voltages, capture_results = \
+                bayesian_threshold_search(
+                    lambda voltage: record[voltage_index[voltage]],
+                    tolerance=0.1, voltage_grid=voltage_grid)
+            n_probes = results["probe_count"][i]
+            assert n_probes == len(probe_voltages)
+            assert results["probe_voltages"][i, :n_probes].tolist() == \
+                probe_voltages
+            assert results["capture_results"][i, :n_probes].tolist() == \
+                capture_results
+            assert np.isnan(results["probe_voltages"][i, n_probes:]).all()
+            assert results["capture_voltage"][i] == \
+                pytest.approx(capture_voltage)
+            assert (results["low"][i], results["high"][i]) == interval
+    finally:
+        logging.disable(logging.NOTSET)
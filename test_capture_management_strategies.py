@@ -0,0 +1,76 @@
+# test_capture_management_strategies.py
+# Used to test the capture_management_strategies.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+def test_synthetic_patients_are_shared():
+    import numpy as np
+    from capture_management_strategies import SyntheticPatients
+    patients1 = SyntheticPatients(10, seed=4)
+    patients2 = SyntheticPatients(10, seed=4)
+    for beat in [0, 5, 3000, 7]:
+        assert np.array_equal(patients1.threshold(beat, 0.4),
+                              patients2.threshold(beat, 0.4))
+
+
+@pytest.mark.parametrize("strategy_idx", [0, 1, 2, 3])
+def test_simulate_strategy_energy_accounting(strategy_idx):
+    import numpy as np
+    from capture_management_strategies import (SyntheticPatients,
+                                               default_strategies,
+                                               simulate_strategy)
+    patients = SyntheticPatients(50, seed=1)
+    strategy = default_strategies()[strategy_idx]
+    result = simulate_strategy(strategy, patients, 2000)
+    assert result["n_beats"] == 100000
+    assert result["total_energy"] == pytest.approx(
+        result["pacing_energy"] + result["backup_energy"] +
+        result["search_energy"])
+    assert result["patient_energy"].sum() == pytest.approx(
+        result["total_energy"])
+    assert 0 < result["search_pulses"] < result["n_beats"]
+    assert result["lost_beats"] < 0.01 * result["n_beats"]
+    # Every patient finished its first search and is paced below 4.5 V
+    voltage, _, searching = strategy.pulse(2000)
+    assert np.median(voltage[~searching]) < 4.5
+
+
+def test_project_algorithm_output_from_fit():
+    import numpy as np
+    from capture_management_strategies import (
+        ProjectEnergySavingAlgorithm, SyntheticPatients, simulate_strategy)
+    patients = SyntheticPatients(20, seed=2, diurnal_amplitude=0,
+                                 beat_noise=0)
+    strategy = ProjectEnergySavingAlgorithm()
+    simulate_strategy(strategy, patients, 200)
+    assert not strategy.searching.any()
+    assert strategy.output_voltage == pytest.approx(2 * patients.rheobase,
+                                                    rel=0.15)
+    assert np.all(strategy.output_voltage >= 2 * patients.rheobase * 0.85)
+
+
+def test_boston_output_capped_when_first_search_pulse_misses():
+    import numpy as np
+    from capture_management_strategies import (
+        BostonScientificAutomaticCapture, SyntheticPatients)
+    patients = SyntheticPatients(20, seed=3, diurnal_amplitude=0,
+                                 beat_noise=0)
+    patients.rheobase = np.full(20, 2.5)
+    strategy = BostonScientificAutomaticCapture()
+    strategy.reset(patients)
+    for beat in range(300):
+        voltage, _, searching = strategy.pulse(beat)
+        assert np.all(voltage <= strategy.max_voltage)
+        captured = voltage >= patients.threshold(beat, 0.4)
+        backup, _ = strategy.respond(beat, captured)
+        assert np.all(backup <= strategy.max_voltage)
+    # Searches of patients above max_voltage never capture, so no
+    # threshold is measured and they are paced at max_voltage
+    above = patients.threshold(300, 0.4) > strategy.max_voltage
+    assert above.any()
+    assert np.all(strategy.threshold[above] == strategy.max_voltage)
+    assert np.all(strategy.threshold <= strategy.max_voltage)
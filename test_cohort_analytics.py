@@ -0,0 +1,86 @@
+# test_cohort_analytics.py
+# Used to test the cohort_analytics.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+def test_merged_aggregate_matches_single_aggregate():
+    import numpy as np
+    from cohort_analytics import (CohortAggregate, merge_aggregates,
+                                  synthetic_result_batch)
+    batch = synthetic_result_batch(0, 10000)
+    single = CohortAggregate()
+    single.update_batch(batch)
+    parts = []
+    for i in range(4):
+        part = CohortAggregate()
+        part.update_batch({name: values[i::4]
+                           for name, values in batch.items()})
+        parts.append(part)
+    merged = merge_aggregates(parts).summary()
+    expected = single.summary()
+    assert merged["n_records"] == 10000
+    for name in ["rheobase", "probe_count"]:
+        assert merged[name]["mean"] == pytest.approx(expected[name]["mean"])
+        assert merged[name]["std"] == pytest.approx(expected[name]["std"])
+        assert merged[name]["quantiles"] == expected[name]["quantiles"]
+        assert merged[name]["histogram"] == expected[name]["histogram"]
+    assert merged["rheobase"]["std"] == pytest.approx(
+        np.std(batch["rheobase"], ddof=1))
+
+
+@pytest.mark.parametrize("q", [0.05, 0.5, 0.95])
+def test_quantile_sketch_relative_accuracy(q):
+    import numpy as np
+    from cohort_analytics import QuantileSketch
+    values = np.random.default_rng(1).lognormal(0, 1, 50000)
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    sketch.update(values)
+    expected = np.quantile(values, q, method="lower")
+    assert sketch.quantile(q) == pytest.approx(expected, rel=0.011)
+
+
+def test_update_skips_missing_metrics():
+    from cohort_analytics import CohortAggregate
+    aggregate = CohortAggregate()
+    aggregate.update({"rheobase": 1.86, "chronaxie": 0.17})
+    aggregate.update({"rheobase": 0.63, "probe_count": 6})
+    summary = aggregate.summary()
+    assert summary["n_records"] == 2
+    assert summary["rheobase"]["count"] == 2
+    assert summary["chronaxie"]["count"] == 1
+    assert summary["probe_count"]["max"] == 6
+
+
+def test_search_energy_histogram_covers_real_searches():
+    import numpy as np
+    import fixed_point_search as fps
+    from accuracy_cost_benchmark import synthetic_cohort
+    from cohort_analytics import CohortAggregate
+    from import_capture_data import (data_str_to_float, isolate_data_vector,
+                                     parse_data)
+    energies = []
+    for duration in ["0.1", "0.2", "0.3", "0.4", "0.5", "1", "1.4"]:
+        with open("test_data/patient1_{}ms.csv".format(duration)) as in_file:
+            data = data_str_to_float(parse_data(in_file.readlines()))
+        _, _, search_energy = fps.bulk_search(
+            isolate_data_vector(data, 0)[:1],
+            isolate_data_vector(data, 1),
+            [isolate_data_vector(data, 2)])
+        energies.append(search_energy[0])
+    cohort = synthetic_cohort(500)
+    _, _, search_energies = fps.bulk_search(cohort["record_durations"],
+                                            cohort["voltage_grid"],
+                                            cohort["capture_matrix"])
+    aggregate = CohortAggregate()
+    aggregate.update({"search_energy": sum(energies)})
+    aggregate.update_batch({"search_energy":
+                            search_energies.reshape(500, -1).sum(axis=1)})
+    histogram = aggregate.summary()["search_energy"]["histogram"]
+    assert histogram["overflow"] == 0
+    assert histogram["underflow"] == 0
+    # Grid-bounded cohorts spread over a few bins of 1e-5 J
+    assert np.count_nonzero(histogram["counts"]) >= 5
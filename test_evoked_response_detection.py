@@ -0,0 +1,90 @@
+# test_evoked_response_detection.py
+# Used to test the evoked_response_detection.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+def test_detection_weights_cancel_polarization_artifact():
+    import numpy as np
+    from evoked_response_detection import (detection_weights,
+                                           generate_post_pacing_electrograms)
+    electrograms = generate_post_pacing_electrograms(
+        np.zeros(1000, dtype=bool), 4.5, 1.5, seed=0, noise_sd=0)
+    assert np.abs(electrograms @ detection_weights()).max() < 0.5
+
+
+def test_detection_weights_measure_evoked_response_amplitude():
+    import numpy as np
+    from evoked_response_detection import (detection_weights,
+                                           evoked_response_template)
+    amplitudes = (5 * evoked_response_template()) @ detection_weights(
+        max_lag=2)
+    assert amplitudes[2] == pytest.approx(5)
+
+
+@pytest.mark.parametrize("voltage, duration", [
+    (0.5, 0.1), (2.5, 0.4), (4.5, 1.5)])
+def test_streaming_detector_accuracy(voltage, duration):
+    import numpy as np
+    from evoked_response_detection import (StreamingCaptureDetector,
+                                           generate_post_pacing_electrograms)
+    rng = np.random.default_rng(1)
+    captured = rng.random(4000) < 0.5
+    electrograms = generate_post_pacing_electrograms(captured, voltage,
+                                                     duration, seed=2)
+    detector = StreamingCaptureDetector()
+    detected = np.concatenate([detector.process(electrograms[i:i + 512])
+                               for i in range(0, 4000, 512)])
+    assert detector.n_beats == 4000
+    assert np.mean(detected[captured] == 1) > 0.97
+    assert np.mean(detected[~captured] == 0) > 0.99
+
+
+def test_evoked_response_capture_list_finds_threshold():
+    import numpy as np
+    from capture_threshold_detection import find_capture_voltage
+    from evoked_response_detection import evoked_response_capture_list
+    from probe_trace_replay import quiet_search
+    voltage_list = np.round(np.arange(0, 5, 0.01), 2).tolist()
+    capture_list = evoked_response_capture_list(voltage_list, 0.4, 2.6,
+                                                seed=1)
+    with quiet_search():
+        _, capture_voltage = find_capture_voltage([0.4] * 500, voltage_list,
+                                                  capture_list)
+    assert capture_voltage == pytest.approx(2.6, rel=0.05)
+
+
+def test_electrogram_capture_function_drives_bayesian_search():
+    from adaptive_threshold_estimation import bayesian_threshold_search
+    from evoked_response_detection import electrogram_capture_function
+    capture_function = electrogram_capture_function(2.2, 0.4, spread=0.05,
+                                                    seed=1)
+    capture_voltage, _, _, _ = bayesian_threshold_search(capture_function)
+    assert capture_voltage == pytest.approx(2.2, abs=0.1)
+
+
+def test_benchmark_detector():
+    from evoked_response_detection import benchmark_detector
+    results = benchmark_detector(n_beats=20000)
+    assert results["beats_per_second"] > 0
+    assert results["latency_ms"] == 64
+    assert results["sensitivity"] > 0.97
+    assert results["specificity"] > 0.99
+
+
+def test_capture_list_search_always_finishes():
+    import numpy as np
+    from evoked_response_detection import evoked_response_capture_list
+    from fixed_point_search import find_capture_voltage_fixed_point
+    voltage_list = np.round(np.arange(0, 5, 0.01), 2).tolist()
+    # Seed 35 used to detect the top voltage (4.99 V) as not captured
+    for seed in [35, 36]:
+        capture_list = evoked_response_capture_list(voltage_list, 0.4, 4.5,
+                                                    seed=seed)
+        assert capture_list[-1] == 1
+        _, capture_voltage = find_capture_voltage_fixed_point(
+            [0.4] * len(voltage_list), voltage_list, capture_list)
+        assert 4.2 <= capture_voltage <= 4.99
@@ -0,0 +1,98 @@
+# test_fixed_point_search.py
+# Used to test the fixed_point_search.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+@pytest.mark.parametrize("filename", [
+    "patient1_0.1ms.csv", "patient1_0.2ms.csv", "patient1_0.3ms.csv",
+    "patient1_0.4ms.csv", "patient1_0.5ms.csv", "patient1_1ms.csv",
+    "patient1_1.4ms.csv", "patient2_0.3ms.csv", "patient2_0.5ms.csv",
+    "patient2_0.8ms.csv", "patient2_1ms.csv", "patient2_1.5ms.csv"])
+def test_fixed_point_matches_float_search(filename):
+    from capture_threshold_detection import find_capture_voltage
+    from fixed_point_search import find_capture_voltage_fixed_point
+    from import_capture_data import import_parse_convert_data
+    from probe_trace_replay import quiet_search
+    duration_list, voltage_list, capture_list = import_parse_convert_data(
+        filename)
+    float_trace = []
+    fixed_trace = []
+    with quiet_search():
+        expected = find_capture_voltage(duration_list, voltage_list,
+                                        capture_list, float_trace)
+    answer = find_capture_voltage_fixed_point(duration_list, voltage_list,
+                                              capture_list, fixed_trace)
+    assert answer == expected
+    assert fixed_trace == float_trace
+
+
+def test_fixed_point_matches_float_search_every_threshold():
+    import numpy as np
+    from generate_capture_data import generate_capture_records
+    from fixed_point_search import find_capture_voltage_fixed_point
+    from probe_trace_replay import record_trace_set, replay_trace_set
+    # The reference search only finishes for thresholds of 0.1 V and up
+    voltage_grid, capture_matrix = generate_capture_records(
+        np.round(np.arange(0.1, 5, 0.01), 2))
+    durations = np.full(len(capture_matrix), 0.4)
+    trace_set = record_trace_set(durations, voltage_grid, capture_matrix)
+    assert not np.isnan(trace_set["capture_voltage"]).any()
+    report = replay_trace_set(trace_set, find_capture_voltage_fixed_point)
+    assert report["n_changed"] == 0
+
+
+def test_fixed_point_search_fails_below_reference_range():
+    from generate_capture_data import generate_capture_records
+    from fixed_point_search import (FixedPointSearchKernel,
+                                    find_capture_voltage_fixed_point)
+    voltage_grid, capture_matrix = generate_capture_records([0.08])
+    kernel = FixedPointSearchKernel(voltage_grid)
+    assert kernel.run(400, capture_matrix[0].tobytes()) == -1
+    assert kernel.n_probes == kernel.max_probes
+    with pytest.raises(ValueError):
+        find_capture_voltage_fixed_point([0.4] * 500, voltage_grid.tolist(),
+                                         capture_matrix[0].tolist())
+
+
+def test_bulk_search_energy_and_budget():
+    from capture_threshold_detection import calculate_search_energy
+    from generate_capture_data import generate_capture_records
+    from fixed_point_search import FixedPointSearchKernel, bulk_search
+    voltage_grid, capture_matrix = generate_capture_records([2.8, 1.15])
+    capture_voltages, probe_counts, search_energies = bulk_search(
+        [0.3, 1.0], voltage_grid, capture_matrix)
+    assert capture_voltages.tolist() == [2.85, 1.15]
+    assert probe_counts.tolist() == [4, 8]
+    assert search_energies[0] == pytest.approx(calculate_search_energy(
+        0.3, [3.0, 2.25, 2.85, 2.71], [1, 0, 1, 0]), rel=1e-12)
+    kernel = FixedPointSearchKernel(voltage_grid)
+    kernel.run(300, capture_matrix[0].tobytes())
+    budget = kernel.budget()
+    assert budget["probes"] == 4
+    assert budget["backup_pulses"] == 2
+    assert budget["operations"] == 2 * 6 + 2 * 8
+    assert budget["rom_bytes"] == 4000
+
+
+def test_bulk_search_any_capture_dtype():
+    import numpy as np
+    from generate_capture_data import generate_capture_records
+    from fixed_point_search import bulk_search
+    voltage_grid, capture_matrix = generate_capture_records([2.8, 1.15])
+    for dtype in [np.int64, np.float64, bool]:
+        capture_voltages, probe_counts, _ = bulk_search(
+            [0.3, 1.0], voltage_grid, capture_matrix.astype(dtype))
+        assert capture_voltages.tolist() == [2.85, 1.15]
+        assert probe_counts.tolist() == [4, 8]
+
+
+def test_ram_budget_counts_every_state_slot():
+    from fixed_point_search import STATE_RAM_BYTES, FixedPointSearchKernel
+    kernel = FixedPointSearchKernel([0.5, 1.0, 3.0])
+    assert "duration_us" in kernel.__slots__
+    assert STATE_RAM_BYTES == 23
+    assert kernel.budget()["ram_bytes"] == STATE_RAM_BYTES
@@ -0,0 +1,83 @@
+# test_lockstep_search.py
+# Used to test the lockstep_search.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+def test_lockstep_matches_recorded_reference_traces():
+    import numpy as np
+    from generate_capture_data import generate_capture_records
+    from lockstep_search import (find_capture_voltage_lockstep,
+                                 lockstep_search)
+    from probe_trace_replay import record_trace_set, replay_trace_set
+    # The reference search only finishes for thresholds of 0.1 V and up
+    voltage_grid, capture_matrix = generate_capture_records(
+        np.round(np.arange(0.1, 5, 0.01), 2))
+    durations = np.tile([0.2, 0.4, 1.0], len(capture_matrix))[
+        :len(capture_matrix)]
+    trace_set = record_trace_set(durations, voltage_grid, capture_matrix)
+    report = replay_trace_set(trace_set, find_capture_voltage_lockstep)
+    assert report["n_changed"] == 0
+
+    results = lockstep_search(durations, voltage_grid, capture_matrix,
+                              record_probes=True)
+    assert np.array_equal(results["capture_voltage"],
+                          trace_set["capture_voltage"])
+    assert np.array_equal(results["probe_count"],
+                          np.diff(trace_set["probe_offsets"]))
+    probe_indices = results["probe_indices"]
+    assert np.array_equal(probe_indices[probe_indices >= 0],
+                          trace_set["probe_indices"])
+    assert results["search_energy"] == pytest.approx(
+        trace_set["search_energy"], rel=1e-12)
+
+
+def test_lockstep_matches_fixed_point_kernel_parameters():
+    import numpy as np
+    from fixed_point_search import FixedPointSearchKernel
+    from generate_capture_data import generate_capture_records
+    from lockstep_search import lockstep_search
+    rng = np.random.default_rng(3)
+    voltage_grid, capture_matrix = generate_capture_records(
+        rng.uniform(0.1, 4.99, 300))
+    for voltage_start in [1.5, 3, 4.2]:
+        kernel = FixedPointSearchKernel(voltage_grid, voltage_start)
+        results = lockstep_search(0.5, voltage_grid, capture_matrix,
+                                  voltage_start=voltage_start)
+        for i, capture_record in enumerate(capture_matrix):
+            code = kernel.run(500, capture_record.tobytes())
+            assert results["capture_voltage"][i] == voltage_grid[code]
+            assert results["probe_count"][i] == kernel.n_probes
+            assert results["backup_count"][i] == kernel.n_backup
+
+
+def test_lockstep_max_probes_guard():
+    import numpy as np
+    from generate_capture_data import generate_capture_records
+    from lockstep_search import (find_capture_voltage_lockstep,
+                                 lockstep_search)
+    voltage_grid, capture_matrix = generate_capture_records([0.08, 2.0])
+    results = lockstep_search(0.4, voltage_grid, capture_matrix,
+                              max_probes=40)
+    assert np.isnan(results["capture_voltage"][0])
+    assert results["probe_count"].tolist()[0] == 40
+    assert results["capture_voltage"][1] == pytest.approx(2.0, rel=0.06)
+    with pytest.raises(ValueError):
+        find_capture_voltage_lockstep([0.4] * 500, voltage_grid.tolist(),
+                                      capture_matrix[0].tolist())
+
+
+def test_lockstep_search_parameters():
+    import numpy as np
+    from generate_capture_data import generate_capture_records
+    from lockstep_search import lockstep_search
+    voltage_grid, capture_matrix = generate_capture_records([1.0, 2.5])
+    default = lockstep_search(0.4, voltage_grid, capture_matrix)
+    finer = lockstep_search(0.4, voltage_grid, capture_matrix,
+                            fine_factor=0.99, miss_limit=3)
+    assert np.all(finer["probe_count"] > default["probe_count"])
+    assert np.all(finer["capture_voltage"] <= default["capture_voltage"])
+    assert np.all(finer["capture_voltage"] >= [1.0, 2.5])
@@ -0,0 +1,154 @@
+# test_parameter_sweep.py
+# Used to test the parameter_sweep.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+def test_parameter_grid():
+    from parameter_sweep import DEFAULT_PARAMETERS, parameter_grid
+    configurations = parameter_grid(miss_limit=[2, 3],
+                                    voltage_margin=[1.5, 2, 2.5])
+    assert len(configurations) == 6
+    assert {(c["miss_limit"], c["voltage_margin"])
+            for c in configurations} == {(2, 1.5), (2, 2), (2, 2.5),
+                                         (3, 1.5), (3, 2), (3, 2.5)}
+    assert all(c["voltage_start"] == DEFAULT_PARAMETERS["voltage_start"]
+               for c in configurations)
+    with pytest.raises(ValueError):
+        parameter_grid(start_voltage=[2, 3])
+
+
+def test_random_configurations():
+    from parameter_sweep import random_configurations
+    configurations = random_configurations(
+        50, seed=2, miss_limit=(1, 3), fine_factor=(0.85, 0.99),
+        backup_voltage=[3.5, 4.5])
+    assert len(configurations) == 50
+    assert {c["miss_limit"] for c in configurations} == {1, 2, 3}
+    assert all(0.85 <= c["fine_factor"] <= 0.99 for c in configurations)
+    assert {c["backup_voltage"] for c in configurations} <= {3.5, 4.5}
+    assert configurations == random_configurations(
+        50, seed=2, miss_limit=(1, 3), fine_factor=(0.85, 0.99),
+        backup_voltage=[3.5, 4.5])
+
+
+def test_truncated_searches_match_lockstep_search():
+    import numpy as np
+    from accuracy_cost_benchmark import synthetic_cohort
+    from lockstep_search import lockstep_search
+    from parameter_sweep import run_search_group
+    cohort = synthetic_cohort(100, seed=3)
+    voltage_grid = cohort["voltage_grid"]
+    capture_matrix = cohort["capture_matrix"]
+    results = run_search_group({"voltage_start": 2, "fine_factor": 0.9},
+                               [1, 2, 4], voltage_grid, capture_matrix)
+    for miss_limit in [1, 2, 4]:
+        expected = lockstep_search(1.0, voltage_grid, capture_matrix,
+                                   voltage_start=2, fine_factor=0.9,
+                                   miss_limit=miss_limit)
+        searches = results[miss_limit]
+        assert np.array_equal(searches["capture_voltage"],
+                              expected["capture_voltage"], equal_nan=True)
+        assert np.array_equal(searches["probe_count"],
+                              expected["probe_count"])
+        assert np.array_equal(searches["backup_count"],
+                              expected["backup_count"])
+
+
+def test_default_configuration_matches_reference_search():
+    import numpy as np
+    from accuracy_cost_benchmark import reference_search, synthetic_cohort
+    from parameter_sweep import run_sweep
+    cohort = synthetic_cohort(40, seed=4)
+    cache = {}
+    row = run_sweep(cohort, [{}], max_workers=1, cache=cache)[0]
+    thresholds, probe_counts, search_energies = reference_search(
+        cohort["record_durations"], cohort["voltage_grid"],
+        cohort["capture_matrix"])
+    (searches, fit), = cache.values()
+    assert np.array_equal(searches["capture_voltage"], thresholds,
+                          equal_nan=True)
+    assert row["probes"] == pytest.approx(probe_counts.sum() / 40)
+    assert row["search_energy"] == pytest.approx(
+        search_energies.sum() / 40, rel=1e-9)
+    assert row["rheobase_error"] < 0.1
+    assert row["loss_of_capture_rate"] == 0
+    assert row["min_safety_margin"] > 1
+
+
+def test_sweep_shares_searches_and_runs_in_parallel():
+    from accuracy_cost_benchmark import synthetic_cohort
+    from parameter_sweep import parameter_grid, run_sweep
+    cohort = synthetic_cohort(40, seed=5)
+    configurations = parameter_grid(coarse_factor=[0.5, 0.75],
+                                    miss_limit=[1, 2, 3],
+                                    backup_voltage=[3.5, 4.5],
+                                    voltage_margin=[1.25, 2])
+    cache = {}
+    rows = run_sweep(cohort, configurations, max_workers=2, cache=cache)
+    assert len(rows) == 24
+    assert len(cache) == 6
+    assert any(row["pareto"] for row in rows)
+    assert rows == run_sweep(cohort, configurations, max_workers=1)
+
+    # Backup voltage only changes the search energy, the margins only the
+    # output, so they trade energy against safety
+    by_parameters = {(row["coarse_factor"], row["miss_limit"],
+                      row["backup_voltage"], row["voltage_margin"]): row
+                     for row in rows}
+    low_backup = by_parameters[(0.75, 2, 3.5, 2)]
+    high_backup = by_parameters[(0.75, 2, 4.5, 2)]
+    assert low_backup["search_energy"] < high_backup["search_energy"]
+    assert low_backup["threshold_error"] == high_backup["threshold_error"]
+    low_margin = by_parameters[(0.75, 2, 4.5, 1.25)]
+    assert low_margin["pacing_energy"] < high_backup["pacing_energy"]
+    assert low_margin["loss_of_capture_rate"] >= \
+        high_backup["loss_of_capture_rate"]
+    assert low_margin["median_safety_margin"] < \
+        high_backup["median_safety_margin"]
+
+
+def test_backup_below_true_threshold_loses_beats():
+    import numpy as np
+    from accuracy_cost_benchmark import synthetic_cohort
+    from parameter_sweep import parameter_grid, run_sweep
+    cohort = synthetic_cohort(40, seed=6)
+    configurations = parameter_grid(backup_voltage=[1, 3.5, 5])
+    rows = run_sweep(cohort, configurations, max_workers=1)
+    lost = [row["lost_backup_beats"] for row in rows]
+    # Backup pulses above every true threshold never lose a beat
+    assert lost[2] == 0
+    assert lost[0] > lost[1] > 0
+    assert rows[0]["search_energy"] < rows[2]["search_energy"]
+    cache = {}
+    run_sweep(cohort, [{"backup_voltage": 1}], max_workers=1, cache=cache)
+    (searches, _), = cache.values()
+    assert lost[0] == pytest.approx(
+        np.sum(searches["backup_count"] * (cohort["thresholds"] > 1)) / 40)
+    # The low backup voltage saves search energy at the cost of lost
+    # beats, so it is not dominated by the safe one
+    assert rows[2]["pareto"]
+    assert rows[0]["pareto"]
+
+
+def test_cache_is_keyed_by_cohort_and_max_probes():
+    from accuracy_cost_benchmark import synthetic_cohort
+    from parameter_sweep import run_sweep
+    cohort = synthetic_cohort(40, seed=7)
+    other_cohort = synthetic_cohort(40, seed=8)
+    cache = {}
+    row = run_sweep(cohort, [{}], max_workers=1, cache=cache)[0]
+    assert run_sweep(cohort, [{}], max_workers=1, cache=cache)[0] == row
+    assert len(cache) == 1
+    # Most searches limited to 4 pulses do not reach their second miss
+    short = run_sweep(cohort, [{}], max_workers=1, max_probes=4,
+                      cache=cache)[0]
+    assert short["failure_rate"] > 0.5 > row["failure_rate"]
+    assert short["probes"] < row["probes"]
+    other = run_sweep(other_cohort, [{}], max_workers=1, cache=cache)[0]
+    assert other == run_sweep(other_cohort, [{}], max_workers=1)[0]
+    assert other != row
+    assert len(cache) == 3
@@ -0,0 +1,88 @@
+# test_probe_trace_replay.py
+# Used to test the probe_trace_replay.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+def test_generate_capture_records_matches_data_files():
+    import numpy as np
+    from generate_capture_data import generate_capture_records
+    from import_capture_data import import_parse_convert_data
+    _, voltage_list, capture_list = import_parse_convert_data(
+        "patient1_0.3ms.csv")
+    voltage_grid, capture_matrix = generate_capture_records([2.8, 4.99])
+    assert voltage_grid.tolist() == voltage_list
+    assert capture_matrix[0].tolist() == capture_list
+    assert np.argmax(capture_matrix[1]) == 499
+
+
+def test_find_capture_voltage_probe_trace():
+    from capture_threshold_detection import find_capture_voltage
+    from import_capture_data import import_parse_convert_data
+    duration_list, voltage_list, capture_list = import_parse_convert_data(
+        "patient1_0.3ms.csv")
+    probe_trace = []
+    _, capture_voltage = find_capture_voltage(duration_list, voltage_list,
+                                              capture_list, probe_trace)
+    assert probe_trace == [(3.0, 1), (2.25, 0), (2.85, 1), (2.71, 0)]
+    assert capture_voltage == 2.85
+
+
+def test_replay_trace_set_round_trip(tmp_path):
+    import numpy as np
+    from capture_threshold_detection import find_capture_voltage
+    from generate_capture_data import generate_capture_records
+    from probe_trace_replay import (load_trace_set, record_trace_set,
+                                    replay_trace_set, save_trace_set,
+                                    trace_probes)
+    durations = [0.3, 0.5, 1.0]
+    voltage_grid, capture_matrix = generate_capture_records([2.8, 1.55,
+                                                             1.15])
+    trace_set = record_trace_set(durations, voltage_grid, capture_matrix)
+    save_trace_set(tmp_path / "traces.npz", trace_set)
+    loaded = load_trace_set(tmp_path / "traces.npz")
+    assert trace_probes(loaded, 0) == [(3.0, 1), (2.25, 0), (2.85, 1),
+                                       (2.71, 0)]
+    assert np.array_equal(loaded["capture_voltage"], [2.85, 1.61, 1.15])
+    report = replay_trace_set(loaded, find_capture_voltage)
+    assert report["n_traces"] == 3
+    assert report["n_changed"] == 0
+
+
+def test_replay_trace_set_flags_changes():
+    from generate_capture_data import generate_capture_records
+    from probe_trace_replay import record_trace_set, replay_trace_set
+
+    def single_probe_search(duration_list, voltage_list, capture_list,
+                            probe_trace=None):
+        probe_trace.append((voltage_list[-1], capture_list[-1]))
+        return duration_list[0], voltage_list[-1]
+
+    voltage_grid, capture_matrix = generate_capture_records([2.8, 1.15])
+    trace_set = record_trace_set([0.3, 1.0], voltage_grid, capture_matrix)
+    report = replay_trace_set(trace_set, single_probe_search)
+    assert report["n_changed"] == 2
+    change = report["changes"][0]
+    assert change["probe_count"] == (4, 1)
+    assert change["capture_voltage"] == (2.85, 4.99)
+    assert change["search_energy"][1] == pytest.approx(4.99**2 * 0.3e-6)
+
+
+def test_record_trace_set_stops_searches_that_never_finish():
+    import numpy as np
+    from generate_capture_data import generate_capture_records
+    from probe_trace_replay import record_trace_set, replay_trace_set
+    from capture_threshold_detection import find_capture_voltage
+    voltage_grid, capture_matrix = generate_capture_records([0.08, 1.15])
+    trace_set = record_trace_set([0.4, 1.0], voltage_grid, capture_matrix,
+                                 max_probes=50)
+    assert np.isnan(trace_set["capture_voltage"][0])
+    assert np.diff(trace_set["probe_offsets"])[0] == 50
+    assert trace_set["capture_voltage"][1] == 1.15
+    report = replay_trace_set(trace_set, find_capture_voltage,
+                              max_probes=50)
+    assert report["n_changed"] == 0
+    assert report["n_failed"] == 1
@@ -8,3 +8,93 @@ import pytest
 
 
 # Global Variables
+PATIENT1_DURATION = [0.1, 0.2, 0.3, 0.4, 0.5, 1, 1.4]
+PATIENT1_VOLTAGE = [5, 3.5, 2.8, 2.6, 2.4, 2.2, 2.2]
+
+
+def test_lapicque_batch_fit_matches_curve_fit():
+    from strength_duration_curve import (fit_strength_duration_models,
+                                         strength_duration_trend_line)
+    rheobase, chronaxie = strength_duration_trend_line(PATIENT1_DURATION,
+                                                       PATIENT1_VOLTAGE)
+    fits = fit_strength_duration_models(PATIENT1_DURATION, PATIENT1_VOLTAGE)
+    assert fits["lapicque"]["rheobase"][0] == pytest.approx(rheobase,
+                                                            abs=1e-3)
+    assert fits["lapicque"]["chronaxie"][0] == pytest.approx(chronaxie,
+                                                             abs=1e-3)
+
+
+@pytest.mark.parametrize("model_name", ["lapicque", "weiss",
+                                        "exponential"])
+def test_fit_recovers_model_parameters(model_name):
+    import numpy as np
+    from strength_duration_curve import (STRENGTH_DURATION_MODELS,
+                                         fit_strength_duration_models)
+    voltage_function = STRENGTH_DURATION_MODELS[model_name]["voltage"]
+    durations = np.array([[0.2, 0.3, 0.5, 1, 1.5],
+                          [0.1, 0.4, 0.8, 1.2, np.nan]])
+    rheobase = np.array([0.8, 1.5])
+    chronaxie = np.array([0.4, 0.25])
+    voltages = voltage_function(durations, rheobase[:, np.newaxis],
+                                chronaxie[:, np.newaxis])
+    fit = fit_strength_duration_models(durations, voltages,
+                                       [model_name])[model_name]
+    assert fit["rheobase"] == pytest.approx(rheobase, rel=1e-4)
+    assert fit["chronaxie"] == pytest.approx(chronaxie, rel=1e-4)
+
+
+def test_select_strength_duration_model():
+    import numpy as np
+    from strength_duration_curve import (exponential_voltage,
+                                         fit_strength_duration_models,
+                                         select_strength_duration_model)
+    durations = np.array([[0.2, 0.3, 0.5, 1, 1.5],
+                          [0.2, 0.3, 0.5, 1, 1.5]])
+    voltages = np.vstack([1.0 * (1 + 0.5 / durations[0]),
+                          exponential_voltage(durations[1], 1.0, 0.5)])
+    voltages = voltages + np.array([0.01, -0.01, 0.01, -0.01, 0.01])
+    fits = fit_strength_duration_models(durations, voltages,
+                                        ["lapicque", "exponential"])
+    best_model, best_fit = select_strength_duration_model(fits, "bic")
+    assert list(best_model) == ["lapicque", "exponential"]
+    assert best_fit["chronaxie"] == pytest.approx([0.5, 0.5], rel=0.05)
+
+
+def test_minimum_energy_points():
+    import numpy as np
+    from strength_duration_curve import (calculate_energy,
+                                         exponential_voltage,
+                                         fit_strength_duration_models)
+    durations = np.linspace(0.1, 2, 8)
+    voltages = exponential_voltage(durations, 1.0, 0.5)
+    fit = fit_strength_duration_models(durations, voltages,
+                                       ["exponential"])["exponential"]
+    grid = np.linspace(0.05, 3, 100000)
+    energy = calculate_energy(grid, exponential_voltage(grid, 1.0, 0.5),
+                              1000)
+    assert fit["min_energy_duration"][0] == pytest.approx(
+        grid[np.argmin(energy)], rel=1e-3)
+    assert fit["min_energy"][0] == pytest.approx(energy.min(), rel=1e-6)
+
+
+def test_weiss_selected_for_charge_error_data():
+    import numpy as np
+    from strength_duration_curve import (fit_strength_duration_models,
+                                         select_strength_duration_model)
+    rng = np.random.default_rng(0)
+    n_patients = 1000
+    durations = np.tile([0.2, 0.3, 0.5, 1, 1.5], (n_patients, 1))
+    rheobase = rng.uniform(0.5, 1.5, (n_patients, 1))
+    chronaxie = rng.uniform(0.2, 0.8, (n_patients, 1))
+    charge = rheobase * (durations + chronaxie) + \
+        rng.normal(0, 0.02, durations.shape)
+    voltage = rheobase * (1 + chronaxie / durations) + \
+        rng.normal(0, 0.02, durations.shape)
+    fits = fit_strength_duration_models(durations, charge / durations,
+                                        ["lapicque", "weiss"])
+    best_model, _ = select_strength_duration_model(fits)
+    assert np.mean(best_model == "weiss") > 0.6
+    fits = fit_strength_duration_models(durations, voltage,
+                                        ["lapicque", "weiss"])
+    best_model, _ = select_strength_duration_model(fits)
+    assert np.mean(best_model == "lapicque") > 0.6
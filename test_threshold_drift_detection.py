@@ -0,0 +1,104 @@
+# test_threshold_drift_detection.py
+# Used to test the threshold_drift_detection.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+@pytest.mark.parametrize("shift, detected", [(1, 0), (-1, 1)])
+def test_cusum_detects_step_change(shift, detected):
+    import numpy as np
+    from threshold_drift_detection import TwoSidedCusum
+    rng = np.random.default_rng(0)
+    detector = TwoSidedCusum(100, slack=1, threshold=8)
+    for _ in range(500):
+        alarms = detector.update(rng.standard_normal(100))
+        assert not alarms[0].any() and not alarms[1].any()
+    n_detected = np.zeros(100, dtype=int)
+    for _ in range(20):
+        alarms = detector.update(rng.standard_normal(100) + 2 * shift)
+        n_detected += alarms[detected]
+        assert not alarms[1 - detected].any()
+    assert np.all(n_detected > 0)
+
+
+def test_cusum_mask_and_reset():
+    import numpy as np
+    from threshold_drift_detection import TwoSidedCusum
+    detector = TwoSidedCusum(3, slack=0, threshold=1.5)
+    mask = np.array([True, False, True])
+    for _ in range(2):
+        increase, _ = detector.update(np.ones(3), mask)
+    assert increase.tolist() == [True, False, True]
+    detector.reset(np.array([0]))
+    assert detector.upper.tolist() == [0, 0, 2]
+
+
+def test_drift_triggered_without_drift_only_searches_once():
+    from capture_management_strategies import SyntheticPatients
+    from threshold_drift_detection import compare_search_scheduling
+    patients = SyntheticPatients(20, seed=3, diurnal_amplitude=0,
+                                 beat_noise=0)
+    report = compare_search_scheduling(patients, 3600)
+    assert report["drift"]["searches"] == 20
+    assert report["fixed"]["searches"] == 20 * 4
+    assert report["search_energy_saved"] > 0
+    assert report["drift"]["lost_beats"] <= report["fixed"]["lost_beats"]
+
+
+def test_drift_triggers_searches():
+    from capture_management_strategies import SyntheticPatients
+    from threshold_drift_detection import (DriftTriggeredCaptureManagement,
+                                           compare_search_scheduling)
+    patients = SyntheticPatients(20, seed=3, diurnal_amplitude=0.3)
+    strategy = DriftTriggeredCaptureManagement()
+    report = compare_search_scheduling(patients, 6 * 3600,
+                                       drift_strategy=strategy)
+    assert strategy.n_alarms > 0
+    assert report["drift"]["searches"] == \
+        20 + strategy.n_alarms + strategy.n_history_alarms
+    assert report["drift"]["searches"] < report["fixed"]["searches"]
+    assert report["search_energy_saved"] > 0
+    assert report["drift"]["lost_beats"] < report["fixed"]["lost_beats"]
+
+
+def test_fit_history_change_point_triggers_search():
+    import numpy as np
+    from capture_management_strategies import SyntheticPatients
+    from threshold_drift_detection import DriftTriggeredCaptureManagement
+    patients = SyntheticPatients(3, seed=0)
+    strategy = DriftTriggeredCaptureManagement()
+    strategy.reset(patients)
+    durations = strategy.search_durations
+    finished = np.ones(3, dtype=bool)
+    # Patient 0 keeps its fit, patient 1 its chronaxie and patient 2 its
+    # rheobase when the other parameter changes by 50 %
+    fits = [[(1, 0.4), (1, 0.4), (1, 0.4)],
+            [(1, 0.4), (1, 0.6), (1.5, 0.4)]]
+    for beat, fit in enumerate(fits):
+        strategy.thresholds = np.array([rheobase * (1 + chronaxie /
+                                                    durations)
+                                        for rheobase, chronaxie in fit])
+        strategy._finish_search(beat, finished)
+    assert strategy.rheobase_change_points.tolist() == [0, 0, 1]
+    assert strategy.chronaxie_change_points.tolist() == [0, 1, 0]
+    assert strategy.n_history_alarms == 2
+    assert strategy.next_search[1:].tolist() == [2, 2]
+    assert strategy.next_search[0] > 2
+
+
+def test_fixed_baseline_backs_up_paced_beats():
+    from capture_management_strategies import (
+        ProjectEnergySavingAlgorithm, SyntheticPatients, simulate_strategy)
+    from threshold_drift_detection import VerifiedCaptureManagement
+    patients = SyntheticPatients(20, seed=3, diurnal_amplitude=0.3)
+    # A small voltage margin so that paced beats lose capture
+    plain = simulate_strategy(ProjectEnergySavingAlgorithm(
+        voltage_margin=1.1), patients, 3 * 3600)
+    verified = simulate_strategy(VerifiedCaptureManagement(
+        voltage_margin=1.1), patients, 3 * 3600)
+    assert verified["search_pulses"] == plain["search_pulses"]
+    assert verified["backup_pulses"] > plain["backup_pulses"]
+    assert verified["lost_beats"] < plain["lost_beats"]
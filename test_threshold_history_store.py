@@ -0,0 +1,173 @@
+# test_threshold_history_store.py
+# Used to test the threshold_history_store.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+DURATIONS = [0.2, 0.5, 1.0]
+
+
+def append_sessions(store, patient, timestamps):
+    for i, timestamp in enumerate(timestamps):
+        store.append(patient, timestamp, DURATIONS,
+                     [2.1 + 0.01 * i, 1.3, float("nan")], 0.7, 0.4123,
+                     1.4, 1.2369, 1.5e-4 + 1e-6 * i)
+
+
+def test_encode_decode_block():
+    import numpy as np
+    from threshold_history_store import decode_block, encode_block
+    records = np.array([[0, 5, -1], [900, 7, -1], [1800, 2, 40]])
+    assert np.array_equal(decode_block(encode_block(records)), records)
+
+
+def test_query_time_range(tmp_path):
+    import numpy as np
+    from threshold_history_store import ThresholdHistoryStore
+    timestamps = list(range(0, 900 * 1000, 900))
+    with ThresholdHistoryStore(str(tmp_path), block_size=64) as store:
+        append_sessions(store, "patient1", timestamps)
+        append_sessions(store, "patient2", timestamps[:10])
+    store = ThresholdHistoryStore(str(tmp_path), block_size=64)
+    assert store.patients() == ["patient1", "patient2"]
+    history = store.query("patient1", 900 * 100, 900 * 200)
+    assert history["timestamp"].tolist() == timestamps[100:200]
+    assert history["thresholds"].shape == (100, 3)
+    assert history["thresholds"][0].tolist()[:2] == [3.1, 1.3]
+    assert np.isnan(history["thresholds"][:, 2]).all()
+    assert history["chronaxie"] == pytest.approx(0.4123)
+    assert history["output_duration"] == pytest.approx(1.2369)
+    assert history["search_energy"][0] == pytest.approx(2.5e-4)
+    assert history["durations"].tolist() == DURATIONS
+    assert len(store.query("patient1")["timestamp"]) == 1000
+    assert len(store.query("patient2", 900 * 100)["timestamp"]) == 0
+
+
+def test_query_reads_only_overlapping_blocks(tmp_path):
+    from threshold_history_store import ThresholdHistoryStore
+    store = ThresholdHistoryStore(str(tmp_path), block_size=10)
+    append_sessions(store, "patient1", range(0, 100 * 60, 60))
+    read = []
+    read_records = store._read_records
+    store._read_records = lambda patient, entries: read.append(
+        len(entries)) or read_records(patient, entries)
+    history = store.query("patient1", 60 * 25, 60 * 35)
+    assert len(history["timestamp"]) == 10
+    assert read == [2]
+
+
+def test_buffered_sessions_and_compaction(tmp_path):
+    import os
+    from threshold_history_store import ThresholdHistoryStore
+    store = ThresholdHistoryStore(str(tmp_path), block_size=50)
+    # Sessions flushed one at a time make one block per session, and
+    # out of order sessions must come back sorted
+    for timestamp in [300, 100, 200, 0]:
+        append_sessions(store, "patient1", [timestamp])
+        store.flush()
+    append_sessions(store, "patient1", [400])
+    timestamps = store.query("patient1")["timestamp"].tolist()
+    assert timestamps == [0, 100, 200, 300, 400]
+    assert len(store.index("patient1")) == 4
+    store.compact()
+    assert len(store.index("patient1")) == 1
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "patient1.hist", "patient1.idx", "patient1.meta.json"]
+    store = ThresholdHistoryStore(str(tmp_path))
+    assert store.query("patient1", 100, 400)["timestamp"].tolist() == [
+        100, 200, 300]
+
+
+def test_durations_must_match(tmp_path):
+    from threshold_history_store import ThresholdHistoryStore
+    store = ThresholdHistoryStore(str(tmp_path))
+    append_sessions(store, "patient1", [0])
+    with pytest.raises(ValueError):
+        store.append("patient1", 900, [0.2, 0.4, 1.0], [1, 1, 1], 0.7, 0.4,
+                     1.4, 1.2, 1e-4)
+    with pytest.raises(ValueError):
+        store.append("../patient1", 900, DURATIONS, [1, 1, 1], 0.7, 0.4,
+                     1.4, 1.2, 1e-4)
+    with pytest.raises(KeyError):
+        store.query("patient3")
+
+
+def test_patient_strength_duration_data_history_hook(tmp_path, monkeypatch):
+    import logging
+    import capture_threshold_detection as ctd
+    import strength_duration_curve as sdc
+    from threshold_history_store import ThresholdHistoryStore
+
+    def fit_without_plots(durations, voltages):
+        rheobase, chronaxie = sdc.strength_duration_trend_line(durations,
+                                                               voltages)
+        return rheobase, chronaxie, 0
+
+    monkeypatch.setattr(logging, "basicConfig", lambda **kwargs: None)
+    monkeypatch.setattr(sdc, "patient_data_manipulation", fit_without_plots)
+    filenames = ["patient1_0.2ms.csv", "patient1_0.5ms.csv",
+                 "patient1_1ms.csv"]
+    store = ThresholdHistoryStore(str(tmp_path))
+    rheobase, chronaxie = ctd.patient_strength_duration_data(
+        "patient1", filenames, history_store=store, timestamp=1000)
+    history = store.query("patient1")
+    assert history["timestamp"].tolist() == [1000]
+    assert history["durations"].tolist() == [0.2, 0.5, 1.0]
+    assert history["thresholds"][0].tolist() == [
+        ctd.find_patient_capture_voltage(filename)[1]
+        for filename in filenames]
+    assert history["rheobase"][0] == pytest.approx(rheobase, abs=1e-6)
+    assert history["output_voltage"][0] == pytest.approx(2 * rheobase,
+                                                         abs=1e-6)
+    assert history["output_duration"][0] == pytest.approx(3 * chronaxie,
+                                                          abs=1e-6)
+    assert history["search_energy"][0] > 0
+
+
+@pytest.mark.parametrize("failing_replace", [0, 1, 2, 3, "index first"])
+def test_interrupted_compaction(tmp_path, monkeypatch, failing_replace):
+    import os
+    import numpy as np
+    import threshold_history_store as ths
+    store = ths.ThresholdHistoryStore(str(tmp_path), block_size=50)
+    for timestamp in [300, 100, 200, 0]:
+        append_sessions(store, "patient1", [timestamp])
+        store.flush()
+    expected = store.query("patient1")
+
+    # The compaction renames .hist.tmp and .idx.tmp to .compact (the
+    # second rename commits it) and then replaces .hist and .idx. The
+    # process stops at one of these renames
+    replace = os.replace
+    calls = []
+
+    def interrupted_replace(source, destination):
+        if len(calls) == (2 if failing_replace == "index first"
+                          else failing_replace):
+            raise KeyboardInterrupt
+        calls.append(source)
+        replace(source, destination)
+
+    monkeypatch.setattr(ths.os, "replace", interrupted_replace)
+    with pytest.raises(KeyboardInterrupt):
+        store.compact("patient1")
+    monkeypatch.setattr(ths.os, "replace", replace)
+    if failing_replace == "index first":
+        replace(str(tmp_path / "patient1.idx.compact"),
+                str(tmp_path / "patient1.idx"))
+
+    store = ths.ThresholdHistoryStore(str(tmp_path))
+    history = store.query("patient1")
+    for key, values in expected.items():
+        assert np.array_equal(history[key], values, equal_nan=True)
+    committed = failing_replace not in (0, 1)
+    assert len(store.index("patient1")) == (1 if committed else 4)
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "patient1.hist", "patient1.idx", "patient1.meta.json"]
+    append_sessions(store, "patient1", [400])
+    store.flush()
+    assert ths.ThresholdHistoryStore(str(tmp_path)).query(
+        "patient1")["timestamp"].tolist() == [0, 100, 200, 300, 400]
@@ -0,0 +1,113 @@
+# test_threshold_service.py
+# Used to test the threshold_service.py code
+# Author: Alex Thomason
+
+
+# Import Necessary Packages
+import pytest
+
+
+@pytest.fixture
+def service(tmp_path):
+    import threading
+    from threshold_service import make_server
+    address = str(tmp_path / "threshold_service.sock")
+    server = make_server(address)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield address
+    server.shutdown()
+    server.server_close()
+
+
+def test_find_thresholds_matches_reference(service):
+    from capture_threshold_detection import find_patient_capture_voltage
+    from probe_trace_replay import quiet_search
+    from threshold_service import ThresholdServiceClient
+    files = ["patient1_0.1ms.csv", "patient1_0.4ms.csv", "patient1_1ms.csv"]
+    with quiet_search():
+        expected = [find_patient_capture_voltage(filename)
+                    for filename in files]
+    with ThresholdServiceClient(service) as client:
+        result = client.call([{"op": "find_thresholds", "files": files}])[0]
+        assert result["ok"]
+        assert result["durations"] == [e[0] for e in expected]
+        assert result["voltages"] == [e[1] for e in expected]
+        client.call([{"op": "find_thresholds", "files": files}])
+        stats = client.call([{"op": "stats"}])[0]
+    assert stats["misses"] == 3
+    assert stats["hits"] == 3
+
+
+def test_missing_file_returns_error(service):
+    from threshold_service import ThresholdServiceClient
+    with ThresholdServiceClient(service) as client:
+        results = client.call([
+            {"op": "find_thresholds", "files": ["no_such_file.csv"]},
+            {"op": "find_thresholds", "files": ["../README.md"]},
+            {"op": "unknown"},
+            {"op": "stats"}])
+    assert [result["ok"] for result in results] == [False, False, False,
+                                                    True]
+    assert "no_such_file.csv" in results[0]["error"]
+
+
+def test_fit_and_recommend(service):
+    from strength_duration_curve import calculate_energy
+    from threshold_service import ThresholdServiceClient
+    durations = [0.1, 0.2, 0.3, 0.4, 0.5, 1, 1.4]
+    voltages = [1.5 * (1 + 0.5 / d) for d in durations]
+    with ThresholdServiceClient(service) as client:
+        fit, recommendation = client.call([
+            {"op": "fit", "durations": durations, "voltages": voltages},
+            {"op": "recommend", "rheobase": 1.5, "chronaxie": 0.5}])
+    assert fit["ok"]
+    assert set(fit["models"]) == {"lapicque", "weiss", "exponential"}
+    assert fit["models"]["lapicque"]["rheobase"] == pytest.approx(1.5)
+    assert fit["models"]["lapicque"]["chronaxie"] == pytest.approx(0.5)
+    assert recommendation["voltage"] == 3
+    assert recommendation["duration"] == 1.5
+    assert recommendation["energy"] == pytest.approx(
+        calculate_energy(1.5, 3, 1000))
+
+
+def test_concurrent_clients(service):
+    from concurrent.futures import ThreadPoolExecutor
+    from threshold_service import ThresholdServiceClient
+    files = ["patient1_0.1ms.csv", "patient1_0.2ms.csv",
+             "patient1_0.3ms.csv", "patient1_0.4ms.csv",
+             "patient1_0.5ms.csv", "patient1_1ms.csv", "patient1_1.4ms.csv"]
+
+    def recommend(i):
+        with ThresholdServiceClient(service) as client:
+            return client.call([{"op": "recommend", "files": files}])[0]
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(recommend, range(16)))
+    assert all(result["ok"] for result in results)
+    assert len({result["voltage"] for result in results}) == 1
+
+
+def test_invalid_request_line(service):
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(service)
+    sock.sendall(b"not json\n")
+    response = sock.makefile("rb").readline()
+    sock.close()
+    assert b"Invalid request" in response
+
+
+def test_bad_operations_do_not_fail_the_batch(service):
+    import json
+    from threshold_service import ThresholdServiceClient
+    with ThresholdServiceClient(service) as client:
+        results = client.call([
+            1, "stats", None,
+            {"op": "fit", "durations": [0.4], "voltages": [1.2]},
+            {"op": "fit", "durations": [0.4, 0.4], "voltages": [1.2, 1.3]},
+            {"op": "recommend", "rheobase": float("nan"), "chronaxie": 0.4},
+            {"op": "stats"}])
+    assert [result["ok"] for result in results] == [False] * 6 + [True]
+    # Every response is standard JSON (no NaN values)
+    json.dumps(results, allow_nan=False)
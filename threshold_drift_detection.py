@@ -0,0 +1,265 @@
+# threshold_drift_detection.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import numpy as np
+import capture_management_strategies as cms
+
+
+class TwoSidedCusum:
+    """Two-sided CUSUM change-point detector for many signals at once
+
+    Every signal (one per patient) x is accumulated as
+
+        S+ = max(0, S+ + x - slack)
+        S- = max(0, S- - x - slack)
+
+    and a change is detected when S+ or S- exceeds the threshold. An
+    update is a few array operations for the whole cohort, so it can
+    run on every beat.
+
+    Args:
+        n_signals (int): number of signals (patients)
+        slack (float): drift per sample that is ignored (k)
+        threshold (float): decision threshold (h)
+    """
+
+    def __init__(self, n_signals: int, slack: float = 0.25,
+                 threshold: float = 1.5):
+        self.slack = slack
+        self.threshold = threshold
+        self.upper = np.zeros(n_signals)
+        self.lower = np.zeros(n_signals)
+
+    def reset(self, mask=None):
+        """Clears the sums of the masked signals (all by default)"""
+        if mask is None:
+            mask = slice(None)
+        self.upper[mask] = 0
+        self.lower[mask] = 0
+
+    def update(self, x, mask=None):
+        """Adds one sample to every (masked) signal
+
+        Args:
+            x (np.array): new sample of every signal
+            mask (np.array or None): signals that have a new sample
+
+        Returns:
+            increase (np.array): signals with a detected increase
+            decrease (np.array): signals with a detected decrease
+        """
+        upper = np.maximum(self.upper + x - self.slack, 0)
+        lower = np.maximum(self.lower - x - self.slack, 0)
+        if mask is None:
+            self.upper, self.lower = upper, lower
+        else:
+            self.upper = np.where(mask, upper, self.upper)
+            self.lower = np.where(mask, lower, self.lower)
+        return self.upper > self.threshold, self.lower > self.threshold
+
+
+class VerifiedCaptureManagement(cms.ProjectEnergySavingAlgorithm):
+    """Project algorithm with beat-to-beat capture verification
+
+    Same fixed-interval searches and output as
+    ProjectEnergySavingAlgorithm, but capture is verified on every beat
+    and a paced beat that does not capture gets a backup pulse, as in
+    DriftTriggeredCaptureManagement. It is the fixed-interval baseline
+    of compare_search_scheduling(), so both schedules protect paced
+    beats the same way.
+    """
+
+    name = "Verified Energy Saving Algorithm"
+
+    def respond(self, beat, captured):
+        pacing = ~self.searching
+        backup, backup_duration = super().respond(beat, captured)
+        backup = np.where(pacing & ~captured, self.backup_voltage, backup)
+        return backup, backup_duration
+
+
+class DriftTriggeredCaptureManagement(VerifiedCaptureManagement):
+    """Project algorithm that only searches when the threshold drifts
+
+    Same search and output as ProjectEnergySavingAlgorithm, but instead
+    of searching every 15 minutes a search is triggered by a change
+    point of the capture margin:
+        - Capture is verified on every beat. A paced beat that does not
+          capture gets a backup pulse and counts as an increase
+        - Every sentinel_interval beats the pulse is a sentinel at the
+          threshold predicted by the last fit (at the programmed pulse
+          duration) times (1 + sentinel_band), alternating with
+          (1 - sentinel_band). A loss of capture of the upper sentinel
+          means the threshold increased (+1), a capture of the lower
+          sentinel means it decreased (-1). A sentinel that does not
+          capture is followed by the programmed output pulse
+        - A TwoSidedCusum over these samples triggers the search and
+          refit
+        - A search also runs max_interval_hours after the last one
+    Every fitted rheobase and chronaxie is also compared with the
+    previous fit of the patient by a TwoSidedCusum over
+    log(ratio) / history_scale (one per parameter). A change point of
+    the fit history (for example lead maturation) triggers a
+    confirmation search and refit on the next beat, and is counted in
+    rheobase_change_points or chronaxie_change_points.
+    """
+
+    name = "Drift-Triggered Energy Saving Algorithm"
+
+    def __init__(self, sentinel_interval: int = 60,
+                 sentinel_band: float = 0.1, slack: float = 0.25,
+                 threshold: float = 1.5, max_interval_hours: float = 24,
+                 history_scale: float = 0.05, **kwargs):
+        super().__init__(search_interval_minutes=max_interval_hours * 60,
+                         **kwargs)
+        self.sentinel_interval = sentinel_interval
+        self.sentinel_band = sentinel_band
+        self.slack = slack
+        self.threshold = threshold
+        self.history_scale = history_scale
+
+    def reset(self, patients):
+        super().reset(patients)
+        n = patients.n_patients
+        self.detector = TwoSidedCusum(n, self.slack, self.threshold)
+        self.history_detectors = {
+            name: TwoSidedCusum(n, self.slack, self.threshold)
+            for name in ("rheobase", "chronaxie")}
+        self.last_fit = {name: np.full(n, np.nan)
+                         for name in ("rheobase", "chronaxie")}
+        self.reference = np.full(n, np.nan)
+        self.sentinel = np.zeros(n, dtype=bool)
+        self.sentinel_sign = 0
+        self.n_alarms = 0
+        self.n_history_alarms = 0
+        self.rheobase_change_points = np.zeros(n, dtype=int)
+        self.chronaxie_change_points = np.zeros(n, dtype=int)
+
+    def pulse(self, beat):
+        voltage, duration, searching = super().pulse(beat)
+        self.sentinel[:] = False
+        if beat % self.sentinel_interval == 0:
+            self.sentinel_sign = 1 if \
+                (beat // self.sentinel_interval) % 2 == 0 else -1
+            self.sentinel = ~searching & np.isfinite(self.reference)
+            voltage = np.where(self.sentinel, cms.snap_to_grid(
+                self.reference * (1 + self.sentinel_sign *
+                                  self.sentinel_band)), voltage)
+            searching = searching | self.sentinel
+        return voltage, duration, searching
+
+    def respond(self, beat, captured):
+        pacing = ~self.searching & ~self.sentinel
+        backup, backup_duration = super().respond(beat, captured)
+        loss = ~captured
+        backup = np.where(self.sentinel & loss, self.output_voltage, backup)
+
+        sample = (pacing & loss).astype(float)
+        if self.sentinel_sign > 0:
+            sample[self.sentinel & loss] = 1
+        else:
+            sample[self.sentinel & captured] = -1
+        increase, decrease = self.detector.update(sample,
+                                                  pacing | self.sentinel)
+        alarm = (increase | decrease) & ~self.searching
+        if alarm.any():
+            self.n_alarms += int(alarm.sum())
+            self.detector.reset(alarm)
+            self.next_search[alarm] = beat + 1
+        return backup, backup_duration
+
+    def _finish_search(self, beat, finished):
+        super()._finish_search(beat, finished)
+        rows = np.flatnonzero(finished)
+        self.reference[rows] = self.rheobase[rows] * \
+            (1 + self.chronaxie[rows] / self.output_duration[rows])
+        self.detector.reset(rows)
+
+        shifted = np.zeros(len(self.reference), dtype=bool)
+        for name, change_points in (
+                ("rheobase", self.rheobase_change_points),
+                ("chronaxie", self.chronaxie_change_points)):
+            fitted = getattr(self, name)
+            last_fit = self.last_fit[name]
+            detector = self.history_detectors[name]
+            change = np.zeros(len(self.reference), dtype=bool)
+            change[rows] = np.isfinite(fitted[rows]) & \
+                np.isfinite(last_fit[rows])
+            x = np.zeros(len(self.reference))
+            x[change] = np.log(fitted[change] / last_fit[change]) / \
+                self.history_scale
+            increase, decrease = detector.update(x, change)
+            alarm = increase | decrease
+            change_points[alarm] += 1
+            detector.reset(alarm)
+            shifted |= alarm
+            valid = np.isfinite(fitted[rows])
+            last_fit[rows[valid]] = fitted[rows[valid]]
+        if shifted.any():
+            self.n_history_alarms += int(shifted.sum())
+            self.next_search[shifted] = beat + 1
+
+
+def compare_search_scheduling(patients: cms.SyntheticPatients,
+                              n_beats: int, fixed_strategy=None,
+                              drift_strategy=None,
+                              pacing_resistance: float = 1000):
+    """Compares drift-triggered with fixed-interval threshold searches
+
+    The capture management energy of a strategy is the energy of its
+    search pulses (including sentinel pulses) plus all backup pulses.
+    Both default strategies verify capture on every beat and back up
+    every paced beat that does not capture, so lost beats are compared
+    like with like (a plain ProjectEnergySavingAlgorithm has no
+    beat-to-beat verification and loses those beats).
+
+    Args:
+        patients (SyntheticPatients): shared synthetic patients
+        n_beats (int): number of beats per patient
+        fixed_strategy (ProjectEnergySavingAlgorithm or None): search
+                every 15 minutes (default: VerifiedCaptureManagement)
+        drift_strategy (DriftTriggeredCaptureManagement or None):
+                drift-triggered searches (default settings)
+        pacing_resistance (float): total pacing impedence [ohms]
+
+    Returns:
+        report (dict): "fixed" and "drift" (outputs of
+                simulate_strategy() with "searches" added),
+                "search_energy_saved" [J] (capture management energy of
+                fixed minus drift) and "total_energy_saved" [J]
+    """
+    if fixed_strategy is None:
+        fixed_strategy = VerifiedCaptureManagement()
+    if drift_strategy is None:
+        drift_strategy = DriftTriggeredCaptureManagement()
+    report = {}
+    for key, strategy in (("fixed", fixed_strategy),
+                          ("drift", drift_strategy)):
+        result = cms.simulate_strategy(strategy, patients, n_beats,
+                                       pacing_resistance)
+        result["searches"] = strategy.n_searches
+        report[key] = result
+    overhead = {key: result["search_energy"] + result["backup_energy"]
+                for key, result in report.items()}
+    report["search_energy_saved"] = overhead["fixed"] - overhead["drift"]
+    report["total_energy_saved"] = report["fixed"]["total_energy"] - \
+        report["drift"]["total_energy"]
+    return report
+
+
+if __name__ == "__main__":
+    # 200 patients for 24 hours at 60 bpm
+    patients = cms.SyntheticPatients(200, seed=0)
+    report = compare_search_scheduling(patients, 24 * 60 * 60)
+    for key in ("fixed", "drift"):
+        result = report[key]
+        print("{}: {} searches, search {:.4f} J, backup {:.4f} J, total \
+{:.4f} J, {} lost beats".format(key, result["searches"],
+                                result["search_energy"],
+                                result["backup_energy"],
+                                result["total_energy"],
+                                result["lost_beats"]))
+    print("Search energy saved: {:.4f} J, total energy saved: {:.4f} J".format(
+        report["search_energy_saved"], report["total_energy_saved"]))
@@ -0,0 +1,388 @@
+# threshold_history_store.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import json
+import os
+import struct
+import zlib
+import numpy as np
+
+
+# Every patient has three files in the store directory:
+#     <patient>.meta.json: the pulse durations [ms] of the thresholds
+#     <patient>.hist: append-only data blocks. A block is a header
+#             (BLOCK_HEADER: magic, number of records, number of
+#             columns, payload length) and a zlib compressed payload of
+#             int64 values. The first row of a block is a keyframe
+#             (absolute values) and every other row is the difference
+#             from the row before, so every block can be decoded on its
+#             own
+#     <patient>.idx: append-only index with one INDEX_DTYPE entry per
+#             block (first and last timestamp, offset and length of the
+#             block in the .hist file and number of records)
+# compact() writes <patient>.hist.tmp and <patient>.idx.tmp, syncs them
+# to disk and renames them to <patient>.hist.compact and then
+# <patient>.idx.compact. The existence of <patient>.idx.compact commits
+# the compaction: the .compact files then replace .hist and .idx (in
+# either order). If the process stops in between, recover() (run before
+# the index of a patient is read) finishes a committed compaction,
+# whichever of the two files was already replaced, and deletes the files
+# of an uncommitted one, so the .hist and .idx files always belong
+# together.
+# A record has one column per field of record_columns(). Values are
+# stored as integers in the units of COLUMN_SCALES and missing values
+# (NaN) are stored as -1 (every stored quantity is non-negative).
+BLOCK_MAGIC = b"THB1"
+BLOCK_HEADER = struct.Struct("<4sIII")
+INDEX_DTYPE = np.dtype([("first_time", "<i8"), ("last_time", "<i8"),
+                        ("offset", "<u8"), ("length", "<u8"),
+                        ("n_records", "<u4")])
+COLUMN_SCALES = {"timestamp": 1,            # [s]
+                 "threshold": 1e6,          # [uV]
+                 "rheobase": 1e6,           # [uV]
+                 "chronaxie": 1e6,          # [ns]
+                 "output_voltage": 1e6,     # [uV]
+                 "output_duration": 1e6,    # [ns]
+                 "search_energy": 1e12}     # [pJ]
+
+
+def record_columns(n_durations: int):
+    """Field of every stored column for n_durations thresholds"""
+    return ["timestamp"] + ["threshold"] * n_durations + \
+        ["rheobase", "chronaxie", "output_voltage", "output_duration",
+         "search_energy"]
+
+
+def encode_block(records):
+    """Delta encodes a 2D int64 array of records into one block"""
+    records = np.asarray(records, dtype="<i8")
+    deltas = np.diff(records, axis=0, prepend=np.zeros(
+        (1, records.shape[1]), dtype="<i8"))
+    payload = zlib.compress(deltas.tobytes())
+    return BLOCK_HEADER.pack(BLOCK_MAGIC, records.shape[0],
+                             records.shape[1], len(payload)) + payload
+
+
+def decode_block(block: bytes):
+    """Decodes a block written by encode_block()"""
+    magic, n_records, n_columns, length = BLOCK_HEADER.unpack_from(block)
+    if magic != BLOCK_MAGIC:
+        raise ValueError("Not a threshold history block")
+    payload = block[BLOCK_HEADER.size:BLOCK_HEADER.size + length]
+    deltas = np.frombuffer(zlib.decompress(payload), dtype="<i8")
+    return np.cumsum(deltas.reshape(n_records, n_columns), axis=0)
+
+
+def _sync_directory(directory: str):
+    """Makes renames in a directory durable (where the OS supports it)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class ThresholdHistoryStore:
+    """Append-only longitudinal store of threshold search sessions
+
+    Sessions of a patient are buffered and written as delta encoded
+    blocks of block_size records. Range queries only read the index
+    and the blocks that overlap the time range, so they do not reread
+    the whole history. compact() rewrites a patient's history into
+    full, time-ordered blocks (for example after many flush() calls
+    with small blocks).
+
+    Args:
+        directory (str): directory of the store (created if missing)
+        block_size (int): records per block
+    """
+
+    def __init__(self, directory: str, block_size: int = 256):
+        self.directory = directory
+        self.block_size = block_size
+        os.makedirs(directory, exist_ok=True)
+        self.buffers = {}
+        self.indexes = {}
+        self.durations = {}
+
+    def path_of(self, patient: str, extension: str):
+        if os.path.basename(patient) != patient or \
+                patient in ("", ".", ".."):
+            raise ValueError("{} is not a valid patient name".format(patient))
+        return os.path.join(self.directory, patient + extension)
+
+    def patients(self):
+        """Names of every patient in the store"""
+        names = {filename[:-len(".meta.json")]
+                 for filename in os.listdir(self.directory)
+                 if filename.endswith(".meta.json")}
+        return sorted(names | set(self.buffers))
+
+    def patient_durations(self, patient: str):
+        """Pulse durations [ms] of the thresholds of a patient (or None)"""
+        if patient not in self.durations:
+            path = self.path_of(patient, ".meta.json")
+            if not os.path.exists(path):
+                return None
+            with open(path, "r") as in_file:
+                self.durations[patient] = tuple(
+                    json.load(in_file)["durations"])
+        return self.durations[patient]
+
+    def recover(self, patient: str):
+        """Finishes or rolls back an interrupted compaction of a patient
+
+        Returns:
+            recovered (bool): True if a committed compaction was finished
+        """
+        hist_path = self.path_of(patient, ".hist")
+        idx_path = self.path_of(patient, ".idx")
+        committed = os.path.exists(idx_path + ".compact")
+        # Both .tmp files are complete before the first rename, so a
+        # .hist.compact without .idx.tmp means that the new index has
+        # already replaced the old one
+        hist_pending = os.path.exists(hist_path + ".compact") and \
+            not os.path.exists(idx_path + ".tmp")
+        if committed or hist_pending:
+            if os.path.exists(hist_path + ".compact"):
+                os.replace(hist_path + ".compact", hist_path)
+            if committed:
+                os.replace(idx_path + ".compact", idx_path)
+            _sync_directory(self.directory)
+            return True
+        for path in (hist_path + ".compact", hist_path + ".tmp",
+                     idx_path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+        return False
+
+    def index(self, patient: str):
+        """Block index of a patient (array of INDEX_DTYPE entries)"""
+        if patient not in self.indexes:
+            self.recover(patient)
+            path = self.path_of(patient, ".idx")
+            if os.path.exists(path):
+                self.indexes[patient] = np.fromfile(path, dtype=INDEX_DTYPE)
+            else:
+                self.indexes[patient] = np.zeros(0, dtype=INDEX_DTYPE)
+        return self.indexes[patient]
+
+    def append(self, patient: str, timestamp, durations, thresholds,
+               rheobase, chronaxie, output_voltage, output_duration,
+               search_energy):
+        """Appends the results of one session
+
+        Args:
+            patient (str): patient name
+            timestamp (int): time of the session [s] (e.g. since the
+                             epoch)
+            durations (list): pulse durations [ms] of the thresholds.
+                              Every session of a patient must use the
+                              same durations
+            thresholds (list): capture threshold [V] at every duration
+                               (NaN if not measured)
+            rheobase (float): fitted rheobase [V]
+            chronaxie (float): fitted chronaxie [ms]
+            output_voltage (float): programmed output voltage [V]
+            output_duration (float): programmed pulse duration [ms]
+            search_energy (float): energy [J] of the threshold searches
+        """
+        durations = tuple(float(duration) for duration in durations)
+        known = self.patient_durations(patient)
+        if known is None:
+            with open(self.path_of(patient, ".meta.json"), "w") as out_file:
+                json.dump({"durations": durations}, out_file)
+            self.durations[patient] = durations
+        elif known != durations:
+            raise ValueError("{} has thresholds at the durations {}, not "
+                             "{}".format(patient, known, durations))
+        if len(thresholds) != len(durations):
+            raise ValueError("One threshold is needed per duration")
+        values = np.array([float(value) for value in [timestamp] +
+                           list(thresholds) + [rheobase, chronaxie,
+                                               output_voltage,
+                                               output_duration,
+                                               search_energy]])
+        scales = np.array([COLUMN_SCALES[column] for column in
+                           record_columns(len(durations))])
+        record = np.where(np.isnan(values), -1,
+                          np.round(np.nan_to_num(values) * scales))
+        buffer = self.buffers.setdefault(patient, [])
+        buffer.append(record.astype(np.int64))
+        if len(buffer) >= self.block_size:
+            self.flush(patient)
+
+    def _write_blocks(self, path: str, records, mode: str):
+        """Writes records as blocks and returns their index entries"""
+        entries = []
+        with open(path, mode) as out_file:
+            out_file.seek(0, os.SEEK_END)
+            for start in range(0, len(records), self.block_size):
+                block_records = records[start:start + self.block_size]
+                block = encode_block(block_records)
+                entries.append((block_records[:, 0].min(),
+                                block_records[:, 0].max(),
+                                out_file.tell(), len(block),
+                                len(block_records)))
+                out_file.write(block)
+            if mode == "wb":
+                out_file.flush()
+                os.fsync(out_file.fileno())
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def flush(self, patient=None):
+        """Writes the buffered sessions of a patient (default: all)"""
+        patients = list(self.buffers) if patient is None else [patient]
+        for name in patients:
+            buffer = self.buffers.pop(name, [])
+            if not buffer:
+                continue
+            index = self.index(name)
+            entries = self._write_blocks(self.path_of(name, ".hist"),
+                                         np.array(buffer), "ab")
+            with open(self.path_of(name, ".idx"), "ab") as out_file:
+                out_file.write(entries.tobytes())
+            self.indexes[name] = np.concatenate([index, entries])
+
+    def _read_records(self, patient: str, entries):
+        if len(entries) == 0:
+            return []
+        blocks = []
+        with open(self.path_of(patient, ".hist"), "rb") as in_file:
+            for entry in entries:
+                in_file.seek(int(entry["offset"]))
+                blocks.append(decode_block(in_file.read(
+                    int(entry["length"]))))
+        return blocks
+
+    def query(self, patient: str, start=None, end=None):
+        """Sessions of a patient with start <= timestamp < end
+
+        Only the index and the blocks that overlap the time range are
+        read.
+
+        Args:
+            patient (str): patient name
+            start (int or None): first timestamp [s] (None = no limit)
+            end (int or None): end of the time range [s] (None = no
+                               limit)
+
+        Returns:
+            history (dict): time-ordered arrays "timestamp",
+                    "thresholds" (2D, one column per duration),
+                    "durations", "rheobase", "chronaxie",
+                    "output_voltage", "output_duration" and
+                    "search_energy"
+        """
+        durations = self.patient_durations(patient)
+        if durations is None:
+            raise KeyError("No history for {}".format(patient))
+        start = np.iinfo(np.int64).min if start is None else int(start)
+        end = np.iinfo(np.int64).max if end is None else int(end)
+        index = self.index(patient)
+        overlap = (index["last_time"] >= start) & (index["first_time"] < end)
+        blocks = self._read_records(patient, index[overlap])
+        if self.buffers.get(patient):
+            blocks.append(np.array(self.buffers[patient]))
+        columns = record_columns(len(durations))
+        if blocks:
+            records = np.concatenate(blocks)
+        else:
+            records = np.zeros((0, len(columns)), dtype=np.int64)
+        records = records[(records[:, 0] >= start) & (records[:, 0] < end)]
+        records = records[np.argsort(records[:, 0], kind="stable")]
+        scales = np.array([COLUMN_SCALES[column] for column in columns])
+        values = np.where(records < 0, np.nan, records / scales)
+        n_durations = len(durations)
+        history = {"timestamp": records[:, 0],
+                   "durations": np.array(durations),
+                   "thresholds": values[:, 1:1 + n_durations]}
+        for i, field in enumerate(columns[1 + n_durations:]):
+            history[field] = values[:, 1 + n_durations + i]
+        return history
+
+    def compact(self, patient=None):
+        """Rewrites the history of a patient (default: all) as full,
+        time-ordered blocks
+
+        The new files are written and synced next to the old ones
+        before they replace them (see the top of this module), so an
+        interrupted compaction leaves either the old or the new history.
+        """
+        patients = self.patients() if patient is None else [patient]
+        for name in patients:
+            self.flush(name)
+            blocks = self._read_records(name, self.index(name))
+            if not blocks:
+                continue
+            records = np.concatenate(blocks)
+            records = records[np.argsort(records[:, 0], kind="stable")]
+            hist_path = self.path_of(name, ".hist")
+            idx_path = self.path_of(name, ".idx")
+            # The cached index is read again (with recover()) if the
+            # compaction stops part way
+            del self.indexes[name]
+            entries = self._write_blocks(hist_path + ".tmp", records, "wb")
+            with open(idx_path + ".tmp", "wb") as out_file:
+                out_file.write(entries.tobytes())
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            os.replace(hist_path + ".tmp", hist_path + ".compact")
+            os.replace(idx_path + ".tmp", idx_path + ".compact")
+            _sync_directory(self.directory)
+            self.recover(name)
+            self.indexes[name] = entries
+
+    def close(self):
+        """Writes every buffered session"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    # 100 patients, one session every 15 minutes for 30 days
+    rng = np.random.default_rng(0)
+    durations = [0.2, 0.3, 0.5, 1.0, 1.5]
+    n_patients = 100
+    n_sessions = 30 * 24 * 4
+    with tempfile.TemporaryDirectory() as directory:
+        start_time = time.perf_counter()
+        with ThresholdHistoryStore(directory) as store:
+            rheobase = rng.lognormal(np.log(0.7), 0.3, n_patients)
+            chronaxie = rng.lognormal(np.log(0.4), 0.3, n_patients)
+            for session in range(n_sessions):
+                for patient in range(n_patients):
+                    thresholds = np.round(rheobase[patient] *
+                                          (1 + chronaxie[patient] /
+                                           np.array(durations)), 2)
+                    store.append("patient{}".format(patient),
+                                 session * 900, durations, thresholds,
+                                 rheobase[patient], chronaxie[patient],
+                                 2 * rheobase[patient],
+                                 3 * chronaxie[patient], 1.5e-4)
+        elapsed = time.perf_counter() - start_time
+        size = sum(os.path.getsize(os.path.join(directory, filename))
+                   for filename in os.listdir(directory))
+        print("Stored {} sessions in {:.1f} s ({:.1f} bytes per \
+session)".format(n_patients * n_sessions, elapsed,
+                 size / (n_patients * n_sessions)))
+        store = ThresholdHistoryStore(directory)
+        start_time = time.perf_counter()
+        history = store.query("patient7", 10 * 86400, 11 * 86400)
+        print("Queried {} sessions of one day in {:.4f} s".format(
+            len(history["timestamp"]), time.perf_counter() - start_time))
@@ -0,0 +1,388 @@
+# threshold_service.py
+# Author: Alex Thomason
+
+
+# Import necessary packages
+import argparse
+import collections
+import json
+import os
+import socket
+import socketserver
+import threading
+import numpy as np
+import import_capture_data as icd
+import strength_duration_curve as sdc
+import fixed_point_search as fps
+
+
+# Protocol: one JSON object per line in both directions. A request is
+#     {"id": <any>, "requests": [<operation>, ...]}
+# and its response is
+#     {"id": <same>, "results": [<result>, ...]}
+# with one result per operation, in order. Every result has "ok": true
+# and the values of the operation, or "ok": false and an "error"
+# message, so one bad operation does not fail the rest of the batch.
+# Operations:
+#     {"op": "find_thresholds", "files": [filename, ...]}
+#     {"op": "fit", "durations": [...], "voltages": [...],
+#      "models": [...] (optional), "criterion": "bic" (optional)}
+#     {"op": "recommend", "rheobase": r, "chronaxie": c}
+#     {"op": "recommend", "files": [filename, ...]}
+#     {"op": "stats"}
+DEFAULT_SOCKET = "/tmp/threshold_service.sock"
+DEFAULT_DATA_DIR = "test_data"
+
+
+class CaptureDataCache:
+    """Thread-safe, bounded cache of parsed capture data files
+
+    Entries are keyed by file path, modification time and size, so an
+    edited file is parsed again. The least recently used entries are
+    dropped once the cache holds max_entries files.
+
+    Args:
+        data_dir (str): directory of the capture data files
+        max_entries (int): maximum number of cached files
+    """
+
+    def __init__(self, data_dir: str = DEFAULT_DATA_DIR,
+                 max_entries: int = 1024):
+        self.data_dir = data_dir
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path_of(self, filename: str):
+        """Path of a data file (only files in data_dir are served)"""
+        if os.path.basename(filename) != filename or filename in ("", ".",
+                                                                  ".."):
+            raise ValueError("{} is not a file name in the '{}' "
+                             "directory".format(filename, self.data_dir))
+        return os.path.join(self.data_dir, filename)
+
+    def get(self, filename: str):
+        """Parsed capture data and threshold of a data file
+
+        Args:
+            filename (str): patient data file ending in .csv
+
+        Returns:
+            entry (dict): "duration_list", "voltage_list",
+                    "capture_list" and the "capture_duration" and
+                    "capture_voltage" of the threshold search
+
+        Raises:
+            FileNotFoundError: if the file does not exist
+            ValueError: if the search does not finish
+        """
+        path = self.path_of(filename)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        with open(path, "r") as in_file:
+            in_lines = in_file.readlines()
+        data_float = icd.data_str_to_float(icd.parse_data(in_lines))
+        duration_list = icd.isolate_data_vector(data_float, 0)
+        voltage_list = icd.isolate_data_vector(data_float, 1)
+        capture_list = icd.isolate_data_vector(data_float, 2)
+        # Bit-exact with find_capture_voltage(), but prints and logs
+        # nothing and keeps no shared state, so it is safe in threads
+        capture_duration, capture_voltage = \
+            fps.find_capture_voltage_fixed_point(duration_list,
+                                                 voltage_list, capture_list)
+        entry = {"duration_list": duration_list,
+                 "voltage_list": voltage_list,
+                 "capture_list": capture_list,
+                 "capture_duration": float(capture_duration),
+                 "capture_voltage": float(capture_voltage)}
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        """Number of cached files, cache hits and cache misses"""
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits,
+                    "misses": self.misses}
+
+
+def find_thresholds(cache: CaptureDataCache, files: list):
+    """Capture thresholds of data files
+
+    Returns:
+        result (dict): "durations" [ms] and "voltages" [V] of the
+                       capture thresholds (one per file)
+    """
+    entries = [cache.get(filename) for filename in files]
+    return {"durations": [entry["capture_duration"] for entry in entries],
+            "voltages": [entry["capture_voltage"] for entry in entries]}
+
+
+def fit_points(durations: list, voltages: list, models=None,
+               criterion: str = "bic"):
+    """Fits the strength-duration models to one patient's thresholds
+
+    Returns:
+        result (dict): "best_model" and, for every fitted model, its
+                       rheobase, chronaxie, rss, aic, bic and minimum
+                       energy point in "models"
+
+    Raises:
+        ValueError: if the points do not determine a finite fit (for
+                    example fewer than two distinct durations)
+    """
+    fits = sdc.fit_strength_duration_models(durations, voltages, models)
+    for name, fit in fits.items():
+        if not all(np.isfinite(values[0]) for values in fit.values()):
+            raise ValueError("The {} model cannot be fitted to these "
+                             "points".format(name))
+    best_model, _ = sdc.select_strength_duration_model(fits, criterion)
+    return {"best_model": str(best_model[0]),
+            "models": {name: {key: float(values[0])
+                              for key, values in fit.items()}
+                       for name, fit in fits.items()}}
+
+
+def recommend_output(rheobase: float, chronaxie: float,
+                     pacing_resistance: float = 1000):
+    """Recommended pacing output of a patient
+
+    Same recommendation as patient_strength_duration_data(): twice the
+    rheobase at three times the chronaxie.
+
+    Returns:
+        result (dict): "rheobase", "chronaxie", "voltage" [V],
+                       "duration" [ms] and "energy" [J]
+
+    Raises:
+        ValueError: if the rheobase or chronaxie is not finite
+    """
+    if not (np.isfinite(rheobase) and np.isfinite(chronaxie)):
+        raise ValueError("The rheobase and chronaxie must be finite")
+    voltage = 2 * rheobase
+    duration = 3 * chronaxie
+    return {"rheobase": float(rheobase), "chronaxie": float(chronaxie),
+            "voltage": float(voltage), "duration": float(duration),
+            "energy": float(sdc.calculate_energy(duration, voltage,
+                                                 pacing_resistance))}
+
+
+def handle_operation(cache: CaptureDataCache, operation: dict):
+    """Runs one operation of a request
+
+    Returns:
+        result (dict): "ok" and the result values, or "ok": false and
+                       an "error" message
+    """
+    if not isinstance(operation, dict):
+        return {"ok": False, "error": "An operation must be a JSON object"}
+    try:
+        op = operation.get("op")
+        if op == "find_thresholds":
+            result = find_thresholds(cache, operation["files"])
+        elif op == "fit":
+            result = fit_points(operation["durations"],
+                                operation["voltages"],
+                                operation.get("models"),
+                                operation.get("criterion", "bic"))
+        elif op == "recommend":
+            if "files" in operation:
+                thresholds = find_thresholds(cache, operation["files"])
+                rheobase, chronaxie = sdc.lapicque_batch_fit(
+                    *sdc.cohort_arrays(thresholds["durations"],
+                                       thresholds["voltages"]))
+                rheobase, chronaxie = rheobase[0], chronaxie[0]
+            else:
+                rheobase = operation["rheobase"]
+                chronaxie = operation["chronaxie"]
+            result = recommend_output(rheobase, chronaxie,
+                                      operation.get("pacing_resistance",
+                                                    1000))
+        elif op == "stats":
+            result = cache.stats()
+        else:
+            raise ValueError("Unknown operation: {}".format(op))
+    except FileNotFoundError as error:
+        return {"ok": False, "error": "The file {} does not exist".format(
+            os.path.basename(error.filename or ""))}
+    except Exception as error:
+        # One bad operation must not fail the rest of the batch
+        return {"ok": False, "error": "{}: {}".format(
+            type(error).__name__, error)}
+    result["ok"] = True
+    return result
+
+
+def handle_request(cache: CaptureDataCache, line):
+    """Answers one protocol line (see the top of this module)"""
+    try:
+        request = json.loads(line)
+        operations = request["requests"]
+        if not isinstance(operations, list):
+            raise TypeError("requests must be a list")
+    except (ValueError, KeyError, TypeError) as error:
+        return {"id": None, "error": "Invalid request: {}".format(error)}
+    return {"id": request.get("id"),
+            "results": [handle_operation(cache, operation)
+                        for operation in operations]}
+
+
+class ThresholdRequestHandler(socketserver.StreamRequestHandler):
+    """Answers request lines of one client connection until it closes"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = handle_request(self.server.cache, line)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class ThreadingTCPThresholdServer(socketserver.ThreadingMixIn,
+                                  socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class ThreadingUnixThresholdServer(socketserver.ThreadingMixIn,
+                                       socketserver.UnixStreamServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+
+def make_server(address=DEFAULT_SOCKET, cache=None):
+    """Creates the threshold service (one thread per client connection)
+
+    Args:
+        address (str or tuple): Unix socket path, or a (host, port)
+                                tuple for a localhost TCP socket
+        cache (CaptureDataCache or None): cache shared by every client
+
+    Returns:
+        server (socketserver.BaseServer): call serve_forever() to start
+    """
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.remove(address)
+        server = ThreadingUnixThresholdServer(address,
+                                              ThresholdRequestHandler)
+    else:
+        server = ThreadingTCPThresholdServer(tuple(address),
+                                             ThresholdRequestHandler)
+    server.cache = CaptureDataCache() if cache is None else cache
+    return server
+
+
+class ThresholdServiceClient:
+    """Client of the threshold service that keeps its connection open
+
+    Args:
+        address (str or tuple): Unix socket path or (host, port)
+        timeout (float): socket timeout [s]
+    """
+
+    def __init__(self, address=DEFAULT_SOCKET, timeout: float = 60):
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = tuple(address)
+        # A Unix socket connect with a timeout fails at once (instead of
+        # waiting) while the listen backlog is full
+        self.sock.connect(address)
+        self.sock.settimeout(timeout)
+        self.rfile = self.sock.makefile("rb")
+        self.n_requests = 0
+
+    def call(self, operations: list):
+        """Sends a batch of operations and returns their results"""
+        self.n_requests += 1
+        request = {"id": self.n_requests, "requests": operations}
+        self.sock.sendall(json.dumps(request).encode() + b"\n")
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("The threshold service closed the "
+                                  "connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["results"]
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_address(args):
+    if args.port is not None:
+        return ("127.0.0.1", args.port)
+    return args.socket
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Warm threshold and fit service and its client")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET,
+                        help="Unix socket path of the service")
+    parser.add_argument("--port", type=int, default=None,
+                        help="use a localhost TCP port instead")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="start the service")
+    serve.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    find = commands.add_parser("find", help="thresholds of data files")
+    find.add_argument("files", nargs="+")
+    fit = commands.add_parser("fit", help="fit strength-duration points")
+    fit.add_argument("--durations", type=float, nargs="+", required=True)
+    fit.add_argument("--voltages", type=float, nargs="+", required=True)
+    recommend = commands.add_parser("recommend",
+                                    help="recommended output of data files")
+    recommend.add_argument("files", nargs="+")
+    commands.add_parser("stats", help="cache statistics")
+    args = parser.parse_args(argv)
+
+    address = parse_address(args)
+    if args.command == "serve":
+        server = make_server(address, CaptureDataCache(args.data_dir))
+        print("Threshold service listening on {}".format(address))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return
+    if args.command == "find":
+        operation = {"op": "find_thresholds", "files": args.files}
+    elif args.command == "fit":
+        operation = {"op": "fit", "durations": args.durations,
+                     "voltages": args.voltages}
+    elif args.command == "recommend":
+        operation = {"op": "recommend", "files": args.files}
+    else:
+        operation = {"op": "stats"}
+    with ThresholdServiceClient(address) as client:
+        result = client.call([operation])[0]
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    main()